@@ -0,0 +1,178 @@
+import asyncio
+import json
+import os
+import posixpath
+import re
+import time
+import zipfile
+from dataclasses import dataclass
+from pathlib import PurePosixPath
+from typing import Optional
+
+from uploads import UploadPayload, read_payload
+
+# Batch conversion (POST /batch/).
+# Uploaded workbooks and the workbooks inside uploaded .zip archives become
+# BatchItems. stream_batch() keeps at most `max_in_flight` of them loaded and
+# converting at once and appends each output to the response zip as soon as it
+# is ready, so memory is bounded by the worker count rather than the batch size.
+
+BATCH_MAX_FILES = int(os.environ.get("PSV_BATCH_MAX_FILES", "500"))
+WORKBOOK_SUFFIXES = (".xlsx", ".xlsm", ".xls")
+ARCHIVE_SUFFIX = ".zip"
+MANIFEST_NAME = "manifest.json"
+OUTPUT_NAMES = {
+    "calc2data": "Data_Sheet_filled_{stem}.xlsm",
+    "data2calc": "Calculation_Sheet_filled_{stem}.xlsx",
+}
+
+
+@dataclass
+class BatchItem:
+    """One workbook of a batch: a direct upload, or a member of an uploaded archive."""
+    source: str
+    payload: Optional[UploadPayload] = None
+    archive: Optional[UploadPayload] = None
+    member: Optional[str] = None
+
+    def load(self, temp_dir):
+        """Return the workbook as an UploadPayload (archive members are read now)."""
+        if self.payload is not None:
+            return self.payload
+        with self.archive.open() as f, zipfile.ZipFile(f) as zf, zf.open(self.member) as member:
+            return read_payload(self.member, member, temp_dir)
+
+
+def _is_workbook_member(name):
+    path = PurePosixPath(name)
+    return (
+        not name.endswith("/")
+        and path.suffix.lower() in WORKBOOK_SUFFIXES
+        and "__MACOSX" not in path.parts
+        and not path.name.startswith(("~$", "."))
+    )
+
+
+def list_batch_items(payloads):
+    """
+    Expand uploaded payloads into batch items.
+    .zip uploads contribute one item per workbook member; other uploads are items themselves.
+    Raises:
+        zipfile.BadZipFile: An upload named .zip is not a zip archive.
+    """
+    items = []
+    for payload in payloads:
+        if not (payload.filename or "").lower().endswith(ARCHIVE_SUFFIX):
+            items.append(BatchItem(payload.filename or f"file{len(items) + 1}", payload=payload))
+            continue
+        with payload.open() as f, zipfile.ZipFile(f) as zf:
+            for info in zf.infolist():
+                if _is_workbook_member(info.filename):
+                    items.append(BatchItem(f"{payload.filename}/{info.filename}", archive=payload, member=info.filename))
+    return items
+
+
+def output_name(conversion, source, taken):
+    """Name of a converted workbook in the result zip, unique within `taken` (updated)."""
+    # 'turnover.zip/P-101/DS.xlsm' -> folder 'turnover/P-101' in the result zip.
+    directory, filename = posixpath.split(re.sub(r"(?i)\.zip/", "/", source.replace("\\", "/")))
+    name = OUTPUT_NAMES[conversion].format(stem=PurePosixPath(filename).stem)
+    if directory:
+        name = f"{directory}/{name}"
+    base, ext = posixpath.splitext(name)
+    candidate, n = name, 2
+    while candidate in taken:
+        candidate, n = f"{base} ({n}){ext}", n + 1
+    taken.add(candidate)
+    return candidate
+
+
+class ZipStreamWriter:
+    """
+    Builds a zip archive incrementally without a seekable file: zipfile writes
+    into this object and drain() hands out the bytes produced so far.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._zip = zipfile.ZipFile(self, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+
+    # File-like interface used by zipfile (no tell/seek: entries get data descriptors).
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def add(self, name, data, compress_type=zipfile.ZIP_STORED):
+        """Append one entry. Workbooks are already deflated, so they are stored as-is."""
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = compress_type
+        info.external_attr = 0o644 << 16
+        self._zip.writestr(info, data)
+
+    def close(self):
+        self._zip.close()
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+async def stream_batch(items, convert, max_in_flight, cleanup=None):
+    """
+    Convert batch items concurrently and stream the result zip.
+    Args:
+        items (list[BatchItem]): Workbooks to convert, submitted in order.
+        convert (coroutine function): convert(item) -> (manifest entry dict, output bytes or None).
+        max_in_flight (int): Items loaded and converting at once.
+        cleanup (callable): Called once the stream is finished or abandoned.
+    Yields:
+        bytes: Chunks of the zip; each output is written as soon as its conversion
+        finishes, followed by manifest.json with one entry per item.
+    """
+    writer = ZipStreamWriter()
+    manifest = []
+    taken = {MANIFEST_NAME}
+    pending = set()
+    queue = iter(items)
+    started = time.perf_counter()
+    try:
+        while True:
+            while len(pending) < max_in_flight:
+                item = next(queue, None)
+                if item is None:
+                    break
+                pending.add(asyncio.ensure_future(convert(item)))
+            if not pending:
+                break
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                entry, output_bytes = task.result()
+                if output_bytes is not None:
+                    entry["output"] = output_name(entry["conversion"], entry["source"], taken)
+                    writer.add(entry["output"], output_bytes)
+                manifest.append(entry)
+            chunk = writer.drain()
+            if chunk:
+                yield chunk
+
+        succeeded = sum(1 for entry in manifest if entry["status"] == "ok")
+        summary = {
+            "files": len(manifest),
+            "succeeded": succeeded,
+            "failed": len(manifest) - succeeded,
+            "seconds": round(time.perf_counter() - started, 3),
+            "results": manifest,
+        }
+        writer.add(MANIFEST_NAME, json.dumps(summary, indent=2, ensure_ascii=False).encode("utf-8"), zipfile.ZIP_DEFLATED)
+        writer.close()
+        yield writer.drain()
+    finally:
+        for task in pending:
+            task.cancel()
+        if cleanup is not None:
+            cleanup()
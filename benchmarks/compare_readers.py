@@ -0,0 +1,78 @@
+"""
+Compare pd.read_excel with the lean single-sheet reader (xlsx_reader.py).
+
+Every measurement runs in a fresh interpreter so peak RSS is not polluted by
+earlier runs. Usage (from the repository root):
+
+    python benchmarks/compare_readers.py [--repeat 5]
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = [
+    ("Data Sheet.xlsm", "FORM"),
+    ("Calculation Sheet.xlsm", "PSV"),
+]
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_one(mode, path, sheet, repeat):
+    """Child process: time `repeat` parses and report peak RSS growth."""
+    sys.path.insert(0, ROOT)
+    import pandas as pd
+    import xlsx_reader
+
+    readers = {
+        "pandas": lambda: pd.read_excel(path, sheet_name=sheet, header=None),
+        "lean": lambda: xlsx_reader.read_form_sheet(path) if sheet == "FORM" else xlsx_reader.read_psv_sheet(path),
+    }
+    rss_before = _peak_rss_mb()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = readers[mode]()
+        timings.append(time.perf_counter() - start)
+    print(json.dumps({
+        "median_s": statistics.median(timings),
+        "peak_rss_growth_mb": _peak_rss_mb() - rss_before,
+        "shape": list(df.shape),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--child", nargs=3, metavar=("MODE", "PATH", "SHEET"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_one(*args.child, repeat=args.repeat)
+        return
+
+    print(f"{'workbook':<24}{'sheet':<7}{'reader':<8}{'median s':>10}{'peak RSS +MB':>14}  shape")
+    for filename, sheet in CASES:
+        path = os.path.join(ROOT, filename)
+        for mode in ("pandas", "lean"):
+            out = subprocess.run(
+                [sys.executable, __file__, "--repeat", str(args.repeat), "--child", mode, path, sheet],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            print(f"{filename:<24}{sheet:<7}{mode:<8}{result['median_s']:>10.3f}{result['peak_rss_growth_mb']:>14.1f}  {tuple(result['shape'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Compare cold start and per-worker memory of `uvicorn main:app` with the
+pre-forked warm mode (serve.py).
+
+Every mode is started fresh on a free port with the result cache and the record
+store switched off and the same conversion pool size (PSV_WORKERS, default 1),
+and converts a Calculation Sheet generated with generate_workbooks.py.
+Reported per mode:
+
+    ready_s        launch until GET /ready answers 200
+    first_s        latency of the first POST /calc2data/ after that
+    warm_s         median latency of the following requests
+    rss_mb / pss_mb / uss_mb
+                   per HTTP worker (mean) right after startup and after the
+                   requests, from /proc/<pid>/smaps_rollup. PSS divides shared
+                   pages between the processes sharing them, USS counts only
+                   private pages, so their difference is what copy-on-write saves.
+    total_pss_mb   PSS of the whole process tree (supervisor, HTTP workers and
+                   conversion pools) after the requests
+
+Linux only. Usage (from the repository root):
+
+    python benchmarks/compare_startup.py [--workers 2] [--requests 8] [--tags 100]
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+READY_TIMEOUT = 120
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _children():
+    """{ppid: [pid, ...]} of every process on the host."""
+    tree = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                # The command name may contain spaces; ppid is the 2nd field after it.
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        tree.setdefault(ppid, []).append(int(name))
+    return tree
+
+
+def _memory_kb(pid):
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])
+    except OSError:
+        return None
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def _cmdline(pid):
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().replace(b"\0", b" ").decode(errors="replace")
+    except OSError:
+        return ""
+
+
+def _process_tree(root, supervised):
+    """
+    HTTP worker pids and every pid under `root` (itself included). Without a
+    supervisor (`uvicorn main:app`) the launched process is the only HTTP worker.
+    """
+    tree = _children()
+    if supervised:
+        workers = [pid for pid in tree.get(root, []) if "resource_tracker" not in _cmdline(pid)]
+    else:
+        workers = [root]
+    everything, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        everything.append(pid)
+        stack.extend(tree.get(pid, []))
+    return workers, everything
+
+
+def _memory_summary(pids):
+    samples = [m for m in (_memory_kb(pid) for pid in pids) if m is not None]
+    if not samples:
+        return {}
+    return {f"{key}_mb": round(statistics.mean(s[key] for s in samples) / 1024, 1) for key in ("rss", "pss", "uss")}
+
+
+def _get(url):
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def _post_workbook(url, payload):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"calc_sheet_file\"; filename=\"calc.xlsm\"\r\n"
+        f"Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + payload + f"\r\n--{boundary}--\r\n".encode()
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=300) as response:
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"POST {url} answered {response.status}")
+    return time.perf_counter() - start
+
+
+def measure(name, command, supervised, requests, payload):
+    port = _free_port()
+    command = [arg.format(port=port) for arg in command]
+    env = dict(os.environ, PSV_RESULT_CACHE_BYTES="0", PSV_RECORD_STORE="off")
+    env.pop("PSV_RESULT_CACHE_DIR", None)
+    env.setdefault("PSV_WORKERS", "1")
+    base = f"http://127.0.0.1:{port}"
+
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while _get(f"{base}/ready") != 200:
+            if process.poll() is not None:
+                raise RuntimeError(f"{name} exited with status {process.returncode}")
+            if time.perf_counter() - start > READY_TIMEOUT:
+                raise RuntimeError(f"{name} was not ready after {READY_TIMEOUT}s")
+            time.sleep(0.02)
+        ready_s = time.perf_counter() - start
+        # With several workers, /ready may have come from the fastest one: wait for the rest.
+        time.sleep(1.0)
+        workers, _ = _process_tree(process.pid, supervised)
+        idle = _memory_summary(workers)
+
+        timings = [_post_workbook(f"{base}/calc2data/", payload) for _ in range(requests)]
+        workers, everything = _process_tree(process.pid, supervised)
+        loaded = _memory_summary(workers)
+        total_pss = sum(m["pss"] for m in (_memory_kb(pid) for pid in everything) if m) / 1024
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    return {
+        "mode": name,
+        "http_workers": len(workers),
+        "ready_s": round(ready_s, 2),
+        "first_s": round(timings[0], 3),
+        "warm_s": round(statistics.median(timings[1:] or timings), 3),
+        "idle": idle,
+        "loaded": loaded,
+        "total_pss_mb": round(total_pss, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2, help="HTTP workers of the multi-worker modes")
+    parser.add_argument("--requests", type=int, default=8)
+    parser.add_argument("--tags", type=int, default=100, help="tags of the converted Calculation Sheet")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    if not sys.platform.startswith("linux"):
+        print("ERROR: compare_startup.py reads /proc and only runs on Linux.")
+        sys.exit(2)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from generate_workbooks import generate
+
+    with tempfile.TemporaryDirectory(prefix="psv_bench_") as data_dir:
+        _, calc_path = generate(args.tags, data_dir)
+        with open(calc_path, "rb") as f:
+            payload = f.read()
+
+    uvicorn = [sys.executable, "-m", "uvicorn", "main:app", "--port", "{port}", "--log-level", "warning"]
+    serve = [sys.executable, "serve.py", "--port", "{port}", "--log-level", "warning"]
+    modes = [
+        ("uvicorn main:app", uvicorn, False),
+        (f"uvicorn --workers {args.workers}", uvicorn + ["--workers", str(args.workers)], True),
+        ("serve.py --workers 1", serve + ["--workers", "1"], True),
+        (f"serve.py --workers {args.workers}", serve + ["--workers", str(args.workers)], True),
+    ]
+    results = [measure(name, command, supervised, args.requests, payload) for name, command, supervised in modes]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':<22}{'ready s':>8}{'first s':>9}{'warm s':>8}"
+          f"{'idle RSS/PSS/USS MB':>22}{'loaded RSS/PSS/USS MB':>24}{'tree PSS MB':>13}")
+    for r in results:
+        idle = "/".join(f"{r['idle'].get(k, 0):.0f}" for k in ("rss_mb", "pss_mb", "uss_mb"))
+        loaded = "/".join(f"{r['loaded'].get(k, 0):.0f}" for k in ("rss_mb", "pss_mb", "uss_mb"))
+        print(f"{r['mode']:<22}{r['ready_s']:>8.2f}{r['first_s']:>9.3f}{r['warm_s']:>8.3f}{idle:>22}{loaded:>24}{r['total_pss_mb']:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Generate synthetic Data Sheets (FORM layout) and Calculation Sheets (PSV layout)
+with N PSV tags, for load and scaling tests.
+
+Both are built from the bundled templates with the XML-patching writer, so the
+output keeps the templates' VBA, styles and merged cells. Usage (from the
+repository root):
+
+    python benchmarks/generate_workbooks.py --tags 1000 [--seed 7] [--out generated]
+"""
+import argparse
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from calc2data import DATA_SHEET_FORM_START_ROW, DATA_SHEET_SHEET_NAME, is_cleared_form_cell  # noqa: E402
+from xlsx_writer import SheetPatchTemplate  # noqa: E402
+
+DATA_SHEET_TEMPLATE = os.path.join(ROOT, "Data Sheet.xlsm")
+CALC_SHEET_TEMPLATE = os.path.join(ROOT, "Calculation Sheet.xlsm")
+CALC_SHEET_NAME = "PSV"
+CALC_SHEET_FIRST_TAG_COL = 4   # column D
+
+MIN_TAGS, MAX_TAGS = 10, 10_000
+
+RELIEF_CASES = [
+    "Blocked Outlet", "External Fire", "Control Valve Failure", "Power Failure",
+    "Cooling Water Failure", "Thermal Expansion", "Reflux Failure", "Tube Rupture",
+]
+FLUIDS = {
+    "VAPOR": ["Hydrocarbon Vapor", "Fuel Gas", "Nitrogen", "Hydrogen Rich Gas", "Flare Gas"],
+    "STEAM": ["LP Steam", "MP Steam", "HP Steam"],
+    "LIQUID": ["Naphtha", "Diesel", "Cooling Water", "Amine", "Crude Oil"],
+}
+PHASE_WEIGHTS = [("VAPOR", 0.55), ("STEAM", 0.15), ("LIQUID", 0.30)]
+PSV_TYPE_WEIGHTS = [("C", 0.5), ("B", 0.4), ("P", 0.1)]
+REMARKS = ["", "", "", "Note 1", "Discharge to closed system", "Pilot operated, non-flowing"]
+RUPTURE_DISK_REMARKS = ["Rupture disk upstream of PSV", "With rupture disk", "Rupture Disk installed, see Note 3"]
+RUPTURE_DISK_SHARE = 0.1
+
+
+def _weighted(rng, choices):
+    x = rng.random()
+    for value, weight in choices:
+        x -= weight
+        if x < 0:
+            return value
+    return choices[-1][0]
+
+
+def make_records(num_tags, seed=7):
+    """Realistic random PSV records, one dict per tag."""
+    if not MIN_TAGS <= num_tags <= MAX_TAGS:
+        raise ValueError(f"num_tags must be between {MIN_TAGS} and {MAX_TAGS}")
+    rng = random.Random(seed)
+    records = []
+    for i in range(num_tags):
+        phase = _weighted(rng, PHASE_WEIGHTS)
+        relief_case = rng.choice(RELIEF_CASES)
+        set_pressure = round(rng.uniform(15, 600), 1)
+        min_bp = round(rng.uniform(0, 30), 1)
+        # The Data Sheet holds "min / rise"; data2calc sums them back to max_bp.
+        bp_rise = round(rng.uniform(0, 0.3 * set_pressure), 1)
+        rupture_disk = rng.random() < RUPTURE_DISK_SHARE
+        records.append({
+            "tag": f"PSV-{1000 + i:05d}",
+            "dwg": f"P&ID-{rng.randint(100, 999)}-{rng.randint(1, 40):02d}",
+            "relief_case": relief_case,
+            "relief_condition": "Fire" if relief_case == "External Fire" else "Operating",
+            "phase": phase,
+            "fluid": rng.choice(FLUIDS[phase]),
+            "flow_rate": round(rng.lognormvariate(9.5, 1.2)),
+            "set_pressure": set_pressure,
+            "overpressure": 21 if relief_case == "External Fire" else rng.choice([10, 10, 16]),
+            "relief_temperature": round(rng.uniform(80, 650), 1),
+            "viscosity": round(rng.uniform(0.01, 0.02), 4) if phase != "LIQUID" else round(rng.uniform(0.2, 5.0), 2),
+            "molecular_weight": round(rng.uniform(2, 80), 2) if phase == "VAPOR" else (18.02 if phase == "STEAM" else ""),
+            "gas_z": round(rng.uniform(0.8, 1.0), 3) if phase != "LIQUID" else "",
+            "cp_cv": round(rng.uniform(1.05, 1.4), 3) if phase != "LIQUID" else "",
+            "specific_gravity": round(rng.uniform(0.55, 1.05), 3) if phase == "LIQUID" else "",
+            "min_bp": min_bp,
+            "bp_rise": bp_rise,
+            "max_bp": min_bp + bp_rise,
+            "psv_type": _weighted(rng, PSV_TYPE_WEIGHTS),
+            "rupture_disk": rupture_disk,
+            "remark": rng.choice(RUPTURE_DISK_REMARKS) if rupture_disk else rng.choice(REMARKS),
+        })
+    return records
+
+
+def _fmt(number):
+    return int(number) if float(number).is_integer() else number
+
+
+# Data Sheet cells per record pair: (column, row offset) -> value builder.
+DATA_SHEET_LAYOUT = {
+    (1, 0): lambda r: r["tag"],
+    (4, 0): lambda r: r["relief_case"],
+    (7, 0): lambda r: r["relief_condition"],
+    (10, 0): lambda r: r["phase"],
+    (11, 0): lambda r: r["flow_rate"],
+    (12, 0): lambda r: 3.63,
+    (13, 0): lambda r: "50.8 / F.V.",
+    (14, 0): lambda r: r["set_pressure"],
+    (15, 0): lambda r: f"{_fmt(r['min_bp'])} / {_fmt(r['bp_rise'])}",
+    (16, 0): lambda r: 4.12,
+    (17, 0): lambda r: "HVG",
+    (18, 0): lambda r: r["overpressure"],
+    (19, 0): lambda r: 104,
+    (20, 0): lambda r: 176,
+    (21, 0): lambda r: r["relief_temperature"],
+    (22, 0): lambda r: r["viscosity"],
+    (23, 0): lambda r: r["molecular_weight"],
+    (24, 0): lambda r: r["gas_z"],
+    (25, 0): lambda r: "0Ca",
+    (26, 0): lambda r: "0Ca",
+    (27, 0): lambda r: r["remark"],
+    (1, 1): lambda r: r["dwg"],
+    (10, 1): lambda r: r["fluid"],
+    (17, 1): lambda r: r["psv_type"],
+    (23, 1): lambda r: r["specific_gravity"],
+    (24, 1): lambda r: r["cp_cv"],
+}
+
+# Calculation Sheet rows (1-based Excel rows of the PSV sheet) -> value builder.
+# Rows 2..25 hold what data2calc's CALC_SHEET_MAPPING makes of DATA_SHEET_LAYOUT, so
+# converting the generated Data Sheet reproduces them; row 85 (Remark) is only read by calc2data.
+CALC_SHEET_LAYOUT = {
+    2: lambda r: r["tag"],
+    3: lambda r: r["relief_case"],
+    4: lambda r: r["dwg"],
+    5: lambda r: 1,
+    6: lambda r: r["psv_type"],
+    7: lambda r: {"C": 0.1, "B": 0.3, "P": 1.0}[r["psv_type"]],
+    8: lambda r: "CS",
+    9: lambda r: "Y" if r["rupture_disk"] else "N",
+    10: lambda r: "R",
+    12: lambda r: r["fluid"],
+    13: lambda r: {"VAPOR": "V", "STEAM": "S", "LIQUID": "L"}[r["phase"]],
+    14: lambda r: r["flow_rate"],
+    15: lambda r: r["specific_gravity"] * 1000 if r["phase"] == "LIQUID" else "",
+    16: lambda r: r["viscosity"],
+    17: lambda r: r["molecular_weight"],
+    18: lambda r: r["gas_z"],
+    19: lambda r: r["cp_cv"],
+    21: lambda r: r["set_pressure"],
+    22: lambda r: r["overpressure"],
+    23: lambda r: r["relief_temperature"],
+    24: lambda r: r["max_bp"],
+    25: lambda r: r["min_bp"],
+    85: lambda r: r["remark"],
+}
+
+
+def data_sheet_bytes(records, template_path=DATA_SHEET_TEMPLATE):
+    """A FORM-layout Data Sheet holding the records from row 9 on."""
+    with open(template_path, "rb") as f:
+        template = SheetPatchTemplate(
+            f.read(), DATA_SHEET_SHEET_NAME, first_row=DATA_SHEET_FORM_START_ROW, clear_cell=is_cleared_form_cell
+        )
+    cells = {}
+    for i, record in enumerate(records):
+        first_row = DATA_SHEET_FORM_START_ROW + 2 * i
+        for (col, offset), build in DATA_SHEET_LAYOUT.items():
+            cells[(first_row + offset, col)] = build(record)
+    return template.render(cells)
+
+
+def calc_sheet_bytes(records, template_path=CALC_SHEET_TEMPLATE):
+    """A PSV-layout Calculation Sheet with one column per record from column D on."""
+    with open(template_path, "rb") as f:
+        template = SheetPatchTemplate(
+            f.read(), CALC_SHEET_NAME, first_row=1, clear_cell=lambda row, col: col >= CALC_SHEET_FIRST_TAG_COL
+        )
+    cells = {}
+    for i, record in enumerate(records):
+        col = CALC_SHEET_FIRST_TAG_COL + i
+        for row, build in CALC_SHEET_LAYOUT.items():
+            cells[(row, col)] = build(record)
+    return template.render(cells)
+
+
+def generate(num_tags, out_dir, seed=7):
+    """Write both workbooks for num_tags tags; returns (data sheet path, calc sheet path)."""
+    os.makedirs(out_dir, exist_ok=True)
+    records = make_records(num_tags, seed)
+    data_path = os.path.join(out_dir, f"Data Sheet {num_tags} tags.xlsm")
+    calc_path = os.path.join(out_dir, f"Calculation Sheet {num_tags} tags.xlsm")
+    with open(data_path, "wb") as f:
+        f.write(data_sheet_bytes(records))
+    with open(calc_path, "wb") as f:
+        f.write(calc_sheet_bytes(records))
+    return data_path, calc_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tags", type=int, required=True, help=f"number of PSV tags ({MIN_TAGS}-{MAX_TAGS})")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", default="generated")
+    args = parser.parse_args()
+    for path in generate(args.tags, args.out, args.seed):
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Benchmark the converters and the HTTP endpoints on synthetic workbooks and
+compare against a stored baseline.
+
+For each tag count, Data Sheets and Calculation Sheets are generated with
+generate_workbooks.py. Every case then runs in a fresh interpreter:
+
+    data2calc        pipeline.run_data2calc (read, convert_data_to_calc_sheet, write)
+    calc2data        pipeline.run_calc2data (read, convert_calc_to_data_sheet, write)
+    http_data2calc   POST /data2calc/ through the ASGI app (thread executor, no result cache)
+    http_calc2data   POST /calc2data/ likewise
+
+Per-stage medians come from the metrics.stage() timers (Server-Timing for HTTP).
+The run fails (exit code 1) when the best-of-N total time or the peak RSS
+exceeds the baseline by more than the tolerance (the best run is compared
+because machine noise only ever adds time). Usage (from the repository root):
+
+    python benchmarks/run_benchmarks.py [--sizes 10 100 1000] [--repeat 5]
+    python benchmarks/run_benchmarks.py --update-baseline
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baseline.json")
+CASES = ("data2calc", "calc2data", "http_data2calc", "http_calc2data")
+DEFAULT_SIZES = (10, 100, 1000)
+# Timings below this many seconds of difference are treated as noise.
+TIME_SLACK_S = 0.05
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _parse_server_timing(header):
+    stages = {}
+    for part in header.split(","):
+        name, _, dur = part.strip().partition(";dur=")
+        if name and dur:
+            stages[name] = float(dur) / 1000
+    return stages
+
+
+def run_case(case, data_path, calc_path, repeat):
+    """Child process: one warm-up run, then `repeat` measured runs."""
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault("PSV_EXECUTOR", "thread")
+    os.environ.setdefault("PSV_WORKERS", "1")
+    os.environ["PSV_RESULT_CACHE_BYTES"] = "0"
+    os.environ.pop("PSV_RESULT_CACHE_DIR", None)
+
+    import metrics
+    import pipeline
+
+    if case.startswith("http_"):
+        from fastapi.testclient import TestClient
+        import main
+
+        client = TestClient(main.app)
+        client.__enter__()
+        endpoint, field, path = {
+            "http_data2calc": ("/data2calc/", "data_sheet_file", data_path),
+            "http_calc2data": ("/calc2data/", "calc_sheet_file", calc_path),
+        }[case]
+        with open(path, "rb") as f:
+            payload = f.read()
+
+        def once():
+            response = client.post(endpoint, files={field: (os.path.basename(path), payload)})
+            response.raise_for_status()
+            return _parse_server_timing(response.headers.get("server-timing", ""))
+    else:
+        fn, path = {
+            "data2calc": (pipeline.run_data2calc, data_path),
+            "calc2data": (pipeline.run_calc2data, calc_path),
+        }[case]
+
+        def once():
+            with metrics.tracing() as trace:
+                start = time.perf_counter()
+                fn(path)
+                total = time.perf_counter() - start
+            stages = trace.stage_totals()
+            stages["total"] = total
+            return stages
+
+    once()
+    runs = [once() for _ in range(repeat)]
+    stage_names = sorted({name for run in runs for name in run})
+    print(json.dumps({
+        "median_s": statistics.median(run["total"] for run in runs),
+        "min_s": min(run["total"] for run in runs),
+        "stages_s": {name: statistics.median(run.get(name, 0.0) for run in runs) for name in stage_names if name != "total"},
+        "peak_rss_mb": _peak_rss_mb(),
+    }))
+
+
+def measure(case, num_tags, data_path, calc_path, repeat):
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--repeat", str(repeat), "--child", case, data_path, calc_path],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    result["records_per_s"] = num_tags / result["median_s"] if result["median_s"] else None
+    return result
+
+
+def compare(results, baseline, time_tolerance, memory_tolerance):
+    """Regression messages for results exceeding the baseline."""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get("results", {}).get(key)
+        if base is None:
+            continue
+        time_limit = base["min_s"] * (1 + time_tolerance) + TIME_SLACK_S
+        if result["min_s"] > time_limit:
+            regressions.append(f"{key}: best {result['min_s']:.3f} s > {time_limit:.3f} s (baseline best {base['min_s']:.3f} s)")
+        memory_limit = base["peak_rss_mb"] * (1 + memory_tolerance)
+        if result["peak_rss_mb"] > memory_limit:
+            regressions.append(f"{key}: peak RSS {result['peak_rss_mb']:.1f} MB > {memory_limit:.1f} MB (baseline {base['peak_rss_mb']:.1f} MB)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="tag counts (10-10000)")
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=CASES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--time-tolerance", type=float, default=0.3, help="allowed slowdown vs baseline (0.3 = 30%%)")
+    parser.add_argument("--memory-tolerance", type=float, default=0.15, help="allowed peak RSS growth vs baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--child", nargs=3, metavar=("CASE", "DATA_SHEET", "CALC_SHEET"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_case(*args.child, repeat=args.repeat)
+        return
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from generate_workbooks import generate
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="psv_bench_") as data_dir:
+        print(f"{'case':<16}{'tags':>7}{'median s':>10}{'best s':>8}{'records/s':>12}{'peak RSS MB':>13}  stages (median s)")
+        for num_tags in args.sizes:
+            data_path, calc_path = generate(num_tags, data_dir, seed=args.seed)
+            for case in args.cases:
+                result = measure(case, num_tags, data_path, calc_path, args.repeat)
+                results[f"{case}/{num_tags}"] = result
+                stages = ", ".join(f"{name}={seconds:.3f}" for name, seconds in result["stages_s"].items())
+                print(f"{case:<16}{num_tags:>7}{result['median_s']:>10.3f}{result['min_s']:>8.3f}{result['records_per_s']:>12.0f}{result['peak_rss_mb']:>13.1f}  {stages}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+                "repeat": args.repeat,
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one.")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+    if regressions:
+        print("\nREGRESSIONS against baseline:")
+        for message in regressions:
+            print(f"  {message}")
+        sys.exit(1)
+    print("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
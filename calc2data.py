@@ -1,8 +1,19 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
 import pandas as pd
 import openpyxl
+from openpyxl.cell.cell import MergedCell
 from openpyxl.utils import get_column_letter
 import io
 
+from metrics import record, stage
+from xlsx_writer import SheetPatchTemplate
+
 # --- Configuration ---
 DATA_SHEET_TEMPLATE_PATH = "Data Sheet.xlsm"
 DATA_SHEET_SHEET_NAME = "FORM"
@@ -44,6 +55,48 @@ def format_back_pressure_calculated(row_data):
     except Exception:
         return "-"
 
+def convert_value_column(values):
+    """Vectorized convert_value()."""
+    result = np.asarray(values, dtype=object).copy()
+    missing = pd.isna(result)
+    is_float = np.fromiter((isinstance(v, float) for v in result), dtype=bool, count=len(result)) & ~missing
+    if is_float.any():
+        floats = result[is_float].astype(np.float64)
+        integral = np.isfinite(floats) & (floats == np.floor(floats))
+        idx = np.flatnonzero(is_float)[integral]
+        result[idx] = [int(v) for v in floats[integral]]
+    result[missing] = "-"
+    return result
+
+def get_state_column(values):
+    """Vectorized get_state()."""
+    values = np.asarray(values, dtype=object)
+    result = np.full(len(values), "-", dtype=object)
+    is_str = np.fromiter((isinstance(v, str) for v in values), dtype=bool, count=len(values))
+    if is_str.any():
+        states = pd.Series(values[is_str], dtype=str).str.strip().str.upper().map({"V": "VAPOR", "S": "STEAM", "L": "LIQUID"})
+        result[is_str] = states.fillna("-").to_numpy(dtype=object)
+    return result
+
+def format_back_pressure_column(psv_records_df):
+    """
+    Vectorized format_back_pressure_calculated().
+    Validity is decided for the whole column at once; only rows with both
+    pressures present are formatted, using the scalar helper so rounding matches.
+    """
+    result = np.full(len(psv_records_df), "-", dtype=object)
+    if 'Min. BP@Header' not in psv_records_df.columns or 'Max. BP@Header' not in psv_records_df.columns:
+        return result
+    min_bp = psv_records_df['Min. BP@Header'].to_numpy(dtype=object)
+    max_bp = psv_records_df['Max. BP@Header'].to_numpy(dtype=object)
+    valid = (
+        pd.to_numeric(pd.Series(min_bp, dtype=object), errors='coerce').notna().to_numpy()
+        & pd.to_numeric(pd.Series(max_bp, dtype=object), errors='coerce').notna().to_numpy()
+    )
+    for i in np.flatnonzero(valid):
+        result[i] = format_back_pressure_calculated({'Min. BP@Header': min_bp[i], 'Max. BP@Header': max_bp[i]})
+    return result
+
 # --- Column Name Mappings ---
 CALC_SHEET_HEADER_MAPPING = {
     "Tag No.": "Tag No.",
@@ -95,6 +148,76 @@ CALC_SHEET_HEADER_MAPPING = {
     "PSV TYPE": "PSV Type", "NO. OF PSV": "No. of PSV", "ALLOWABLE OVERPRESSURE": "Allowable Overpressure",
 }
 
+def normalize_header(label):
+    """Normalize a header label for alias lookup: case, whitespace and punctuation are ignored."""
+    return re.sub(r'[\W_]+', '', str(label).casefold())
+
+# Precompiled alias index: normalized label -> standardized name (first alias wins).
+CALC_SHEET_HEADER_INDEX = {}
+for _alias, _standard_name in CALC_SHEET_HEADER_MAPPING.items():
+    _key = normalize_header(_alias)
+    if _key:
+        CALC_SHEET_HEADER_INDEX.setdefault(_key, _standard_name)
+
+def standardize_header(cleaned_name):
+    """Resolve one stripped column-B label to its standardized property name, or None."""
+    standardized_name = CALC_SHEET_HEADER_MAPPING.get(cleaned_name)
+    if standardized_name is None:
+        key = normalize_header(cleaned_name)
+        standardized_name = CALC_SHEET_HEADER_INDEX.get(key) if key else None
+    return standardized_name
+
+class HeaderLayoutCache:
+    """
+    LRU cache of resolved Calculation Sheet row layouts.
+
+    Keyed on a fingerprint of the column-B labels, so repeat uploads of the same
+    Calculation Sheet revision skip header detection entirely.
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._layouts = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fingerprint):
+        with self._lock:
+            layout = self._layouts.get(fingerprint)
+            if layout is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._layouts.move_to_end(fingerprint)
+            return layout
+
+    def put(self, fingerprint, layout):
+        with self._lock:
+            self._layouts[fingerprint] = layout
+            self._layouts.move_to_end(fingerprint)
+            while len(self._layouts) > self.max_entries:
+                self._layouts.popitem(last=False)
+
+    def stats(self, include_layouts=False):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "entries": len(self._layouts),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
+            if include_layouts:
+                stats["layouts"] = {
+                    fingerprint: {str(r_idx): name for r_idx, name in layout.items()}
+                    for fingerprint, layout in self._layouts.items()
+                }
+        return stats
+
+HEADER_LAYOUT_CACHE = HeaderLayoutCache()
+
 # --- Data Sheet Write Mapping ---
 DATA_SHEET_WRITE_MAPPING = {
     (1, 0): ("Tag No.", None, None), 
@@ -125,123 +248,249 @@ DATA_SHEET_WRITE_MAPPING = {
     (27, 1): ("Remark", None, None), 
 }
 
+# Whole-column counterparts of the scalar format functions used above.
+COLUMN_FORMATTERS = {
+    get_state: get_state_column,
+}
+
 # --- Fixed Unit Cells in Row 10 (to prevent clearing) ---
 FIXED_UNIT_CELLS_IN_ROW_10 = [
     (11, 1), (12, 1), (13, 1), (14, 1), (15, 1), (16, 1),
     (19, 1), (20, 1), (21, 1), (22, 1), (23,1), (24,1)
 ]
 
-def convert_calc_to_data_sheet(calc_sheet_raw_df, data_sheet_template_path, output_filename="Data_Sheet_filled_final.xlsm", output_stream=None):
-    try:
-        wb = openpyxl.load_workbook(data_sheet_template_path, keep_vba=True)
-        ws = wb[DATA_SHEET_SHEET_NAME]
-    except Exception as e:
-        print(f"ERROR: Could not load Data Sheet template or sheet '{DATA_SHEET_SHEET_NAME}': {e}")
-        return False
+# Record area blanked before filling: rows 9..MAX_ROWS_TO_CLEAR_IN_TEMPLATE, mapped columns.
+_all_mapped_excel_cols = [coord[0] for coord in DATA_SHEET_WRITE_MAPPING.keys()]
+MIN_COL_TO_CLEAR = min(_all_mapped_excel_cols) if _all_mapped_excel_cols else 1
+MAX_COL_TO_CLEAR = max(_all_mapped_excel_cols) if _all_mapped_excel_cols else 27
+_FIXED_UNIT_CELLS = set(FIXED_UNIT_CELLS_IN_ROW_10)
+
+def load_data_sheet_template(data_sheet_template_path):
+    """Load the macro-enabled Data Sheet template (path or binary file object)."""
+    return openpyxl.load_workbook(data_sheet_template_path, keep_vba=True)
+
+def snapshot_form_block(wb):
+    """Capture the FORM cells a conversion may touch so a pooled template can be reset."""
+    ws = wb[DATA_SHEET_SHEET_NAME]
+    return {
+        coord: cell.value
+        for coord, cell in ws._cells.items()
+        if coord[0] >= DATA_SHEET_FORM_START_ROW
+    }
+
+def restore_form_block(wb, snapshot):
+    """Undo a conversion on a template workbook using snapshot_form_block() output."""
+    ws = wb[DATA_SHEET_SHEET_NAME]
+    for coord in [c for c in ws._cells if c[0] >= DATA_SHEET_FORM_START_ROW]:
+        if coord not in snapshot:
+            del ws._cells[coord]
+            continue
+        cell = ws._cells[coord]
+        if not isinstance(cell, MergedCell):
+            cell.value = snapshot[coord]
+
+def resolve_property_rows(property_labels):
+    """
+    Map Calculation Sheet row indexes to standardized property names.
+    Args:
+        property_labels (sequence): Column B of the Calculation Sheet.
+    Returns:
+        dict: {row index: standardized name}, excluding the Tag No. row.
+        The dict is shared with the layout cache and must not be modified.
+    """
+    cleaned_names = [
+        str(raw_prop_name).strip() if pd.notna(raw_prop_name) else ''
+        for raw_prop_name in property_labels
+    ]
+    fingerprint = hashlib.sha1("\x1f".join(cleaned_names[1:]).encode("utf-8")).hexdigest()
+    prop_row_to_standard_name = HEADER_LAYOUT_CACHE.get(fingerprint)
+    if prop_row_to_standard_name is not None:
+        record("header_layout_hits", 1)
+        return prop_row_to_standard_name
+    record("header_layout_misses", 1)
+
+    prop_row_to_standard_name = {}
+    for r_idx in range(1, len(cleaned_names)):
+        standardized_name = standardize_header(cleaned_names[r_idx])
+        if standardized_name and standardized_name != "Tag No.":
+            prop_row_to_standard_name[r_idx] = standardized_name
+
+    HEADER_LAYOUT_CACHE.put(fingerprint, prop_row_to_standard_name)
+    return prop_row_to_standard_name
+
+def header_layout_stats(include_layouts=True):
+    """Hit rate and resolved layouts of this process's header layout cache."""
+    stats = HEADER_LAYOUT_CACHE.stats(include_layouts=include_layouts)
+    stats["pid"] = os.getpid()
+    return stats
+
+def extract_psv_records(calc_sheet_raw_df):
+    """
+    Slice the tag block of a Calculation Sheet into one record per PSV tag.
+    Args:
+        calc_sheet_raw_df (pd.DataFrame): 'PSV' sheet read with header=None.
+    Returns:
+        pd.DataFrame: One row per tag, one column per standardized property
+        (empty if no Tag No. is found in row 2, col D onwards).
+    """
+    values = calc_sheet_raw_df.to_numpy(dtype=object)
+    tags = pd.Series(values[1, 3:], dtype=object)
+    tag_strs = tags.astype(str).str.strip()
+    psv_tag_nos = tag_strs[tags.notna() & (tag_strs != '')].tolist()
+    if not psv_tag_nos:
+        return pd.DataFrame()
+
+    prop_row_to_standard_name = resolve_property_rows(values[:, 1])
+
+    # Record i reads column D+i, the tag list being compacted as in the original layout.
+    tag_block = values[:, 3:3 + len(psv_tag_nos)]
+    columns = {'Tag No.': psv_tag_nos}
+    for raw_row_idx_in_df, standardized_name in prop_row_to_standard_name.items():
+        # Later rows mapping to the same property win.
+        columns[standardized_name] = tag_block[raw_row_idx_in_df]
+    return pd.DataFrame(columns, dtype=object)
+
+def build_write_plan(psv_records_df):
+    """
+    Compute every Data Sheet cell value for all records at once.
+    Returns:
+        list: (excel rows array, excel column, values array) per DATA_SHEET_WRITE_MAPPING entry.
+    """
+    num_records = len(psv_records_df)
+    record_start_rows = DATA_SHEET_FORM_START_ROW + 2 * np.arange(num_records)
+    write_plan = []
+
+    for (data_sheet_col, data_sheet_row_offset_in_pair), (calc_sheet_source, format_func, default_or_special) in DATA_SHEET_WRITE_MAPPING.items():
+        if default_or_special == 'CALCULATED':
+            values = format_back_pressure_column(psv_records_df)
+        elif default_or_special is not None:
+            values = np.full(num_records, default_or_special, dtype=object)
+        elif calc_sheet_source is not None:
+            if calc_sheet_source in psv_records_df.columns:
+                source_values = psv_records_df[calc_sheet_source].to_numpy(dtype=object)
+            else:
+                source_values = np.full(num_records, None, dtype=object)
+            if format_func in COLUMN_FORMATTERS:
+                values = COLUMN_FORMATTERS[format_func](source_values)
+            elif format_func:
+                values = np.array([format_func(v) for v in source_values], dtype=object)
+            else:
+                values = convert_value_column(source_values)
+        else:
+            values = np.full(num_records, None, dtype=object)
+
+        write_plan.append((record_start_rows + data_sheet_row_offset_in_pair, data_sheet_col, values))
+    return write_plan
+
+def is_cleared_form_cell(r, c):
+    """True for template cells of the record area that are blanked before filling."""
+    return (
+        DATA_SHEET_FORM_START_ROW <= r <= MAX_ROWS_TO_CLEAR_IN_TEMPLATE
+        and MIN_COL_TO_CLEAR <= c <= MAX_COL_TO_CLEAR
+        and (c, (r - DATA_SHEET_FORM_START_ROW) % 2) not in _FIXED_UNIT_CELLS
+    )
+
+def _clear_form_block(ws):
+    """Blank the record area of the template, keeping the fixed unit cells."""
+    for (r, c), cell in ws._cells.items():
+        # Cells covered by a merged range hold no value of their own.
+        if isinstance(cell, MergedCell) or cell.value is None:
+            continue
+        if is_cleared_form_cell(r, c):
+            cell.value = None
+
+def load_data_sheet_patch_template(data_sheet_template_file):
+    """Compile the Data Sheet template (binary file object) for the XML-patching writer."""
+    return SheetPatchTemplate(
+        data_sheet_template_file.read(),
+        DATA_SHEET_SHEET_NAME,
+        first_row=DATA_SHEET_FORM_START_ROW,
+        clear_cell=is_cleared_form_cell,
+    )
+
+def write_plan_cells(write_plan):
+    """Flatten a build_write_plan() result into {(excel row, excel col): value}."""
+    cells = {}
+    for excel_rows, data_sheet_col, values in write_plan:
+        for target_excel_row, value_to_write in zip(excel_rows.tolist(), values):
+            cells[(target_excel_row, data_sheet_col)] = value_to_write
+    return cells
+
+def _apply_write_plan(ws, write_plan):
+    for excel_rows, data_sheet_col, values in write_plan:
+        for target_excel_row, value_to_write in zip(excel_rows.tolist(), values):
+            # Cells covered by a merged range cannot hold a value; Excel shows the anchor cell only.
+            if isinstance(ws._cells.get((target_excel_row, data_sheet_col)), MergedCell):
+                continue
+            ws.cell(row=target_excel_row, column=data_sheet_col).value = value_to_write
+
+def convert_calc_to_data_sheet(calc_sheet_raw_df, data_sheet_template_path, output_filename="Data_Sheet_filled_final.xlsm", output_stream=None, template_workbook=None, patch_template=None, psv_records_df=None):
+    """
+    Fill the Data Sheet template with the PSV records of a Calculation Sheet.
+    With patch_template (a SheetPatchTemplate from load_data_sheet_patch_template),
+    only the FORM sheet XML is rebuilt and every other workbook part is copied as is;
+    otherwise the template is loaded (or template_workbook used) and saved with openpyxl.
+    Records already in extract_psv_records() form (e.g. from the record API) can be
+    passed as psv_records_df instead of calc_sheet_raw_df.
+    """
+    if patch_template is None:
+        try:
+            if template_workbook is not None:
+                wb = template_workbook
+            else:
+                wb = load_data_sheet_template(data_sheet_template_path)
+            ws = wb[DATA_SHEET_SHEET_NAME]
+        except Exception as e:
+            print(f"ERROR: Could not load Data Sheet template or sheet '{DATA_SHEET_SHEET_NAME}': {e}")
+            return False
 
     try:
-        psv_tag_nos_raw = calc_sheet_raw_df.iloc[1, 3:].tolist()
-        psv_tag_nos = [
-            str(x).strip() for x in psv_tag_nos_raw 
-            if pd.notna(x) and str(x).strip() != ''
-        ]
-        
-        if not psv_tag_nos:
+        if psv_records_df is None:
+            with stage("extract_records"):
+                psv_records_df = extract_psv_records(calc_sheet_raw_df)
+
+        if psv_records_df.empty:
             print("ERROR: No valid PSV Tag No. found in Calculation Sheet (expected in row 2, col D onwards).")
             return False
+        record("records", len(psv_records_df))
 
-        prop_row_to_standard_name = {}
-        for r_idx in range(1, calc_sheet_raw_df.shape[0]):
-            raw_prop_name = calc_sheet_raw_df.iloc[r_idx, 1] 
-            cleaned_name = str(raw_prop_name).strip() if pd.notna(raw_prop_name) else ''
-            
-            standardized_name = CALC_SHEET_HEADER_MAPPING.get(cleaned_name, None)
-            
-            if standardized_name is None:
-                for key, value in CALC_SHEET_HEADER_MAPPING.items():
-                    if key.strip().lower() == cleaned_name.lower():
-                        standardized_name = value
-                        break
-
-            if standardized_name and standardized_name != "Tag No.": 
-                prop_row_to_standard_name[r_idx] = standardized_name
-        
-        psv_records_list = []
-        for col_offset, tag_no in enumerate(psv_tag_nos):
-            current_psv_data = {'Tag No.': tag_no} 
-            for raw_row_idx_in_df, standardized_name in prop_row_to_standard_name.items():
-                if (3 + col_offset) < calc_sheet_raw_df.shape[1]:
-                    value = calc_sheet_raw_df.iloc[raw_row_idx_in_df, 3 + col_offset]
-                    current_psv_data[standardized_name] = value
-            
-            psv_records_list.append(current_psv_data)
-        
-        psv_records_df = pd.DataFrame(psv_records_list)
+        with stage("write_plan"):
+            write_plan = build_write_plan(psv_records_df)
 
     except Exception as e:
         print(f"ERROR: Problem parsing Calculation Sheet data: {e}")
         return False
-    
-    all_mapped_excel_cols = [coord[0] for coord in DATA_SHEET_WRITE_MAPPING.keys()]
-
-    min_col_to_clear = min(all_mapped_excel_cols) if all_mapped_excel_cols else 1
-    max_col_to_clear = max(all_mapped_excel_cols) if all_mapped_excel_cols else 27
 
-    original_merged_ranges = list(ws.merged_cells.ranges)
-    for m_range_obj in original_merged_ranges:
+    if patch_template is not None:
         try:
-            ws.unmerge_cells(str(m_range_obj))
-        except Exception:
-            pass
-
-    for r in range(DATA_SHEET_FORM_START_ROW, MAX_ROWS_TO_CLEAR_IN_TEMPLATE + 1):
-        for c in range(min_col_to_clear, max_col_to_clear + 1):
-            cell = ws.cell(row=r, column=c)
-            row_offset_in_pair = (r - DATA_SHEET_FORM_START_ROW) % 2
-            
-            is_fixed_unit_cell = False
-            if (c, row_offset_in_pair) in FIXED_UNIT_CELLS_IN_ROW_10:
-                is_fixed_unit_cell = True
-                
-            if not is_fixed_unit_cell:
-                cell.value = None
-
-    for idx, psv_record_row in psv_records_df.iterrows():
-        current_excel_row_start = DATA_SHEET_FORM_START_ROW + idx * 2
-        
-        for (data_sheet_col, data_sheet_row_offset_in_pair), (calc_sheet_source, format_func, default_or_special) in DATA_SHEET_WRITE_MAPPING.items():
-            
-            value_to_write = None
-
-            if default_or_special == 'CALCULATED':
-                value_to_write = format_func(psv_record_row)
-            elif default_or_special is not None:
-                value_to_write = default_or_special
-            elif calc_sheet_source is not None: 
-                value_from_calc_sheet = psv_record_row.get(calc_sheet_source) 
-                if format_func:
-                    value_to_write = format_func(value_from_calc_sheet)
-                else:
-                    value_to_write = convert_value(value_from_calc_sheet)
-
-            target_excel_row = current_excel_row_start + data_sheet_row_offset_in_pair
-            cell = ws.cell(row=target_excel_row, column=data_sheet_col)
-            cell.value = value_to_write
-
-    for m_range_obj in original_merged_ranges:
-        try:
-            ws.merge_cells(str(m_range_obj))
-        except Exception:
-            pass
+            with stage("render"):
+                output_bytes = patch_template.render(write_plan_cells(write_plan))
+            if output_stream is not None:
+                output_stream.write(output_bytes)
+                output_stream.seek(0)
+                return output_stream
+            with open(output_filename, "wb") as f:
+                f.write(output_bytes)
+            return True
+        except Exception as e:
+            print(f"ERROR: Failed to write file '{output_filename}': {e}")
+            return False
+
+    # Merged ranges are left in place: only anchor cells are written, so the
+    # template's merges and their formatting survive untouched.
+    with stage("cell_writes"):
+        _clear_form_block(ws)
+        _apply_write_plan(ws, write_plan)
 
     try:
-        if output_stream is not None:
-            wb.save(output_stream)
-            output_stream.seek(0)
-            return output_stream
-        else:
-            wb.save(output_filename)
-            return True
+        with stage("save"):
+            if output_stream is not None:
+                wb.save(output_stream)
+                output_stream.seek(0)
+                return output_stream
+            else:
+                wb.save(output_filename)
+                return True
     except Exception as e:
         print(f"ERROR: Failed to save file '{output_filename}': {e}")
         return False
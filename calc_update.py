@@ -0,0 +1,171 @@
+import math
+from numbers import Number
+
+import numpy as np
+import pandas as pd
+
+from data2calc import CALC_SHEET_MAPPING
+from xlsx_reader import PSV_FIRST_TAG_COL, PSV_TAG_ROW
+
+# Incremental Calculation Sheet update (POST /data2calc/update).
+# A tag has one record (and one PSV sheet column) per relief case, so the tag
+# columns of an existing filled PSV sheet are matched to the records of a revised
+# Data Sheet by (Tag No., occurrence of the tag): the n-th column of a tag, left
+# to right, takes the tag's n-th record, top to bottom. Only the mapped cells
+# whose value changed are rewritten, new records get new columns after the last
+# one and columns without a record are reported but left in place. The result is
+# a set of cell writes for SheetPatchTemplate, so everything else in the workbook is kept.
+
+UPDATED_ROWS = sorted(row for row in CALC_SHEET_MAPPING if row != PSV_TAG_ROW)
+RELIEF_CASE_ROW = 2   # Row 3 of the PSV sheet
+
+
+def _cell_key(value):
+    """Comparable form of a cell value: empty cells (None, NaN, "") are equal, numbers compare as floats."""
+    if value is None or (isinstance(value, str) and value == ""):
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return ("bool", bool(value))
+    if isinstance(value, Number):
+        value = float(value)
+        return None if math.isnan(value) else value
+    if value is pd.NaT:
+        return None
+    return value
+
+
+_cell_keys = np.frompyfunc(_cell_key, 1, 1)
+_is_float = np.frompyfunc(lambda key: isinstance(key, float), 1, 1)
+
+
+def changed_cells(old_values, new_values):
+    """
+    Mask of the cells whose value differs. Numbers equal to within float rounding
+    (e.g. 106.7 and 106.69999999999999 from summing 'X / Y') count as unchanged.
+    """
+    old_keys, new_keys = _cell_keys(old_values), _cell_keys(new_values)
+    differs = np.array([old != new for old, new in zip(old_keys, new_keys)], dtype=bool)
+    numeric = _is_float(old_keys).astype(bool) & _is_float(new_keys).astype(bool)
+    if numeric.any():
+        differs[numeric] = ~np.isclose(
+            old_keys[numeric].astype(np.float64), new_keys[numeric].astype(np.float64), rtol=1e-9, atol=0.0
+        )
+    return differs
+
+
+def _plain(value):
+    """JSON-friendly cell value for the change summary."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if _cell_key(value) is None:
+        return None
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def record_keys(tags):
+    """(Tag No., occurrence of the tag so far) for each tag of a sequence."""
+    seen = {}
+    keys = []
+    for tag in tags:
+        keys.append((tag, seen.get(tag, 0)))
+        seen[tag] = seen.get(tag, 0) + 1
+    return keys
+
+
+def sheet_tag_columns(calc_df):
+    """
+    {(Tag No., occurrence): 0-based column} of the tag columns of a PSV sheet block,
+    and the first free column after them.
+    """
+    if calc_df.shape[0] <= PSV_TAG_ROW:
+        return {}, PSV_FIRST_TAG_COL
+    tag_row = calc_df.iloc[PSV_TAG_ROW].to_numpy(dtype=object)
+    cols = [col for col in range(PSV_FIRST_TAG_COL, len(tag_row)) if _cell_key(tag_row[col]) is not None]
+    columns = dict(zip(record_keys(str(tag_row[col]).strip() for col in cols), cols))
+    return columns, (cols[-1] if cols else PSV_FIRST_TAG_COL - 1) + 1
+
+
+def _record_label(key, relief_case):
+    tag, occurrence = key
+    return {"tag": tag, "occurrence": occurrence + 1, "relief_case": _plain(relief_case)}
+
+
+def plan_update(calc_df, tag_block, fields):
+    """
+    Diff a revised tag block against the tag columns of an existing PSV sheet.
+    Args:
+        calc_df (pd.DataFrame): PSV sheet block of the existing Calculation Sheet (read_psv_sheet).
+        tag_block (np.ndarray): map_calc_sheet_block() result for the revised Data Sheet.
+        fields (dict): {row index: property name} for the change summary (calc_record_fields).
+    Returns:
+        tuple: ({(row, col): value} 1-based cell writes, change summary dict)
+    """
+    sheet_columns, next_col = sheet_tag_columns(calc_df)
+    tags = [str(tag).strip() for tag in tag_block[PSV_TAG_ROW]] if tag_block.shape[0] > PSV_TAG_ROW else []
+    record_of_key = {key: i for i, key in enumerate(record_keys(tags))}
+    rows = [row for row in UPDATED_ROWS if row < tag_block.shape[0]]
+    num_sheet_rows, num_sheet_cols = calc_df.shape
+
+    def sheet_relief_case(col):
+        return calc_df.iat[RELIEF_CASE_ROW, col] if RELIEF_CASE_ROW < num_sheet_rows else None
+
+    def record_relief_case(i):
+        return tag_block[RELIEF_CASE_ROW, i] if RELIEF_CASE_ROW < tag_block.shape[0] else None
+
+    kept = [(key, i) for key, i in record_of_key.items() if key in sheet_columns]
+    added = [(key, i) for key, i in record_of_key.items() if key not in sheet_columns]
+    removed = [_record_label(key, sheet_relief_case(col)) for key, col in sheet_columns.items() if key not in record_of_key]
+
+    cells = {}
+    changes = {}
+    if kept:
+        records = np.array([i for _, i in kept])
+        sheet_cols = np.array([sheet_columns[key] for key, _ in kept])
+        for row in rows:
+            new_values = tag_block[row, records]
+            old_values = np.full(len(kept), "", dtype=object)
+            if row < num_sheet_rows:
+                in_sheet = sheet_cols < num_sheet_cols
+                old_values[in_sheet] = calc_df.iloc[row].to_numpy(dtype=object)[sheet_cols[in_sheet]]
+            for k in np.flatnonzero(changed_cells(old_values, new_values)):
+                cells[(row + 1, sheet_cols[k] + 1)] = new_values[k]
+                changes.setdefault(k, []).append({
+                    "property": fields.get(row, f"Row {row + 1}"),
+                    "row": row + 1,
+                    "old": _plain(old_values[k]),
+                    "new": _plain(new_values[k]),
+                })
+    changed = [
+        dict(_record_label(kept[k][0], record_relief_case(kept[k][1])), column=int(sheet_cols[k]) + 1, changes=record_changes)
+        for k, record_changes in sorted(changes.items())
+    ]
+
+    for offset, (key, i) in enumerate(added):
+        col = next_col + offset + 1
+        cells[(PSV_TAG_ROW + 1, col)] = key[0]
+        for row in rows:
+            cells[(row + 1, col)] = tag_block[row, i]
+
+    summary = {
+        "records": len(sheet_columns) + len(added),
+        "added": [_record_label(key, record_relief_case(i)) for key, i in added],
+        "removed": removed,
+        "changed": changed,
+        "unchanged": len(kept) - len(changed),
+        "cells_written": len(cells),
+    }
+    return cells, summary
+
+
+def summary_counts(summary):
+    """Short form of a change summary (for the X-Change-Summary header)."""
+    return {
+        "records": summary["records"],
+        "added": len(summary["added"]),
+        "removed": len(summary["removed"]),
+        "changed": len(summary["changed"]),
+        "unchanged": summary["unchanged"],
+        "cells_written": summary["cells_written"],
+    }
@@ -0,0 +1,346 @@
+"""
+Convert whole directory trees of PSV workbooks without the HTTP server.
+
+Every workbook under INPUT (a directory, or a single file) is converted in the
+given direction (auto-detected from its sheets by default) across a process
+pool, and written to the same relative folder under OUTPUT with the names the
+batch endpoint uses (Data_Sheet_filled_<name>.xlsm / Calculation_Sheet_filled_<name>.xlsx).
+
+A manifest in OUTPUT (.psv_manifest.json) records, per input, its SHA-256 and
+the conversion key (input hash + template hash + converter version, as the
+result cache uses). Re-runs skip inputs whose key is unchanged, so only new or
+edited workbooks, or everything after a template or converter change, are
+converted again. Failed inputs are retried once they change (or with --force);
+until then every run lists them as failed and exits with status 1.
+With --watch the tree is polled and changed workbooks are reconverted as soon as
+they stop changing. Usage (from the repository root):
+
+    python cli.py "P&IDs/" converted/ [--direction auto|calc2data|data2calc] [--workers N]
+    python cli.py "P&IDs/" converted/ --watch [--interval 5]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from batch import WORKBOOK_SUFFIXES, output_name
+from pipeline import (
+    CONVERTER_VERSION,
+    DEFAULT_CALC_SHEET_TEMPLATE_PATH,
+    DEFAULT_DATA_SHEET_TEMPLATE_PATH,
+    ConversionError,
+    conversion_cache_key,
+    detect_conversion,
+    run_calc2data,
+    run_data2calc,
+    warm_templates,
+)
+
+MANIFEST_NAME = ".psv_manifest.json"
+MANIFEST_SAVE_EVERY = 50
+HASH_CHUNK_SIZE = 1024 * 1024
+
+CONVERSIONS = {"calc2data": run_calc2data, "data2calc": run_data2calc}
+
+
+def _file_sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def scan_inputs(input_root):
+    """{relative posix path: (size, mtime_ns)} of the workbooks under input_root (or of the file itself)."""
+    input_root = Path(input_root)
+    if input_root.is_file():
+        st = input_root.stat()
+        return {input_root.name: (st.st_size, st.st_mtime_ns)}
+
+    found = {}
+    for dirpath, dirnames, filenames in os.walk(input_root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(".") and d != "__MACOSX")
+        for filename in sorted(filenames):
+            if filename.startswith(("~$", ".")) or Path(filename).suffix.lower() not in WORKBOOK_SUFFIXES:
+                continue
+            path = Path(dirpath) / filename
+            try:
+                st = path.stat()
+            except OSError:
+                continue  # Deleted while scanning.
+            found[path.relative_to(input_root).as_posix()] = (st.st_size, st.st_mtime_ns)
+    return found
+
+
+def _input_path(input_root, rel_path):
+    input_root = Path(input_root)
+    return input_root if input_root.is_file() else input_root / rel_path
+
+
+class Manifest:
+    """The OUTPUT/.psv_manifest.json entries, {relative input path: entry dict}."""
+
+    def __init__(self, output_root):
+        self.path = Path(output_root) / MANIFEST_NAME
+        self.entries = {}
+        if self.path.exists():
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self.entries = json.load(f).get("inputs", {})
+            except (OSError, ValueError) as e:
+                print(f"WARNING: Ignoring unreadable manifest '{self.path}': {e}")
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(prefix=".tmp_", dir=self.path.parent)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"converter_version": CONVERTER_VERSION, "inputs": self.entries}, f, indent=1, sort_keys=True)
+            os.replace(tmp_name, self.path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+    def taken_outputs(self, excluding=None):
+        return {entry["output"] for rel_path, entry in self.entries.items() if entry.get("output") and rel_path != excluding}
+
+
+def _current_key(kind, sha256):
+    return conversion_cache_key(kind, sha256) if kind in CONVERSIONS else None
+
+
+def is_up_to_date(entry, stat, direction, output_root):
+    """
+    Whether an input needs no conversion: same file (size and mtime, else same hash) and the
+    same conversion key as when it was last converted, with its output still present.
+    Failed conversions count as up to date until the input or the templates change.
+    """
+    if entry is None or (entry["size"], entry["mtime_ns"]) != tuple(stat):
+        return False
+    if direction != "auto" and entry.get("kind") != direction:
+        return False
+    if entry.get("error"):
+        return entry.get("failed_key") == _current_key(entry.get("kind"), entry["sha256"])
+    return entry.get("key") == _current_key(entry["kind"], entry["sha256"]) and (Path(output_root) / entry["output"]).exists()
+
+
+def convert_file(input_path, output_path, kind):
+    """
+    Pool task: convert one workbook and write the result atomically.
+    Returns:
+        float: Seconds spent.
+    """
+    start = time.perf_counter()
+    output_bytes = CONVERSIONS[kind](str(input_path))
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(prefix=".tmp_", dir=output_path.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(output_bytes)
+        os.replace(tmp_name, output_path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+    return time.perf_counter() - start
+
+
+class TreeConverter:
+    """
+    Converts the changed workbooks of an input tree on a process pool and keeps the manifest.
+    Args:
+        input_root (str): Directory (or single workbook) to convert.
+        output_root (str): Directory for the outputs and the manifest.
+        direction (str): 'auto', 'calc2data' or 'data2calc'.
+        workers (int): Pool size (default: CPU count).
+        force (bool): Convert everything once, ignoring the manifest.
+    """
+
+    def __init__(self, input_root, output_root, direction="auto", workers=None, force=False):
+        self.input_root = Path(input_root)
+        self.output_root = Path(output_root)
+        self.direction = direction
+        self.force = force
+        self.manifest = Manifest(output_root)
+        self.pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=warm_templates)
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    def _plan(self, rel_path, stat):
+        """Entry fields of an input about to be converted; None if it turned out unchanged, False if it cannot be converted."""
+        entry = self.manifest.entries.get(rel_path)
+        input_path = _input_path(self.input_root, rel_path)
+        sha256 = _file_sha256(input_path)
+        if entry is not None and entry["sha256"] == sha256 and not self.force:
+            # Touched but not edited: remember the new stat and check the key again.
+            entry.update(size=stat[0], mtime_ns=stat[1])
+            if is_up_to_date(entry, stat, self.direction, self.output_root):
+                return None
+
+        planned = {"sha256": sha256, "size": stat[0], "mtime_ns": stat[1]}
+        try:
+            kind = self.direction if self.direction != "auto" else detect_conversion(str(input_path))
+        except ConversionError as e:
+            self._record_failure(rel_path, dict(planned, kind=None), e.detail)
+            return False
+        output = entry.get("output") if entry is not None and entry.get("kind") == kind else None
+        if output is None:
+            output = output_name(kind, rel_path, self.manifest.taken_outputs(excluding=rel_path))
+        planned.update(kind=kind, output=output)
+        return planned
+
+    def _record_failure(self, rel_path, planned, detail):
+        print(f"FAILED     {rel_path}: {detail}", flush=True)
+        self.manifest.entries[rel_path] = dict(
+            planned, key=None, error=detail, failed_key=_current_key(planned.get("kind"), planned["sha256"]),
+            converted_at=time.time(),
+        )
+
+    def _skip(self, rel_path, counts):
+        error = self.manifest.entries[rel_path].get("error")
+        if error:
+            print(f"FAILED     {rel_path}: {error} (unchanged since, not retried)", flush=True)
+            counts["still_failed"] += 1
+        else:
+            counts["skipped"] += 1
+
+    def failed_inputs(self):
+        """Inputs whose last conversion failed."""
+        return sorted(rel_path for rel_path, entry in self.manifest.entries.items() if entry.get("error"))
+
+    def run(self, stats):
+        """
+        Convert every input that is not up to date.
+        Args:
+            stats (dict): {relative path: (size, mtime_ns)} to consider (see scan_inputs).
+        Returns:
+            dict: Counts of converted, skipped and failed inputs; "still_failed" counts the
+            skipped inputs whose last conversion failed (not retried until they change).
+        """
+        counts = {"converted": 0, "skipped": 0, "failed": 0, "still_failed": 0}
+        futures = {}
+        for rel_path, stat in stats.items():
+            if not self.force and is_up_to_date(self.manifest.entries.get(rel_path), stat, self.direction, self.output_root):
+                self._skip(rel_path, counts)
+                continue
+            planned = self._plan(rel_path, stat)
+            if planned is None:
+                self._skip(rel_path, counts)
+                continue
+            if planned is False:
+                counts["failed"] += 1
+                continue
+            future = self.pool.submit(convert_file, _input_path(self.input_root, rel_path), self.output_root / planned["output"], planned["kind"])
+            futures[future] = (rel_path, planned)
+
+        done_since_save = 0
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel_path, planned = futures[future]
+                try:
+                    seconds = future.result()
+                except ConversionError as e:
+                    self._record_failure(rel_path, planned, f"{e.status_code}: {e.detail}")
+                    counts["failed"] += 1
+                except Exception as e:
+                    self._record_failure(rel_path, planned, f"{type(e).__name__}: {e}")
+                    counts["failed"] += 1
+                else:
+                    self.manifest.entries[rel_path] = dict(
+                        planned, key=_current_key(planned["kind"], planned["sha256"]), converted_at=time.time(), seconds=round(seconds, 3),
+                    )
+                    counts["converted"] += 1
+                    print(f"converted  {rel_path} -> {planned['output']} ({planned['kind']}, {seconds:.2f} s)", flush=True)
+                done_since_save += 1
+                if done_since_save >= MANIFEST_SAVE_EVERY:
+                    self.manifest.save()
+                    done_since_save = 0
+
+        self.manifest.save()
+        return counts
+
+    def forget_missing(self, stats):
+        """Drop manifest entries of inputs that no longer exist (their outputs are kept)."""
+        missing = [rel_path for rel_path in self.manifest.entries if rel_path not in stats]
+        for rel_path in missing:
+            del self.manifest.entries[rel_path]
+        if missing:
+            self.manifest.save()
+        return missing
+
+
+def watch(converter, interval):
+    """Poll the input tree and reconvert workbooks once they changed and then stayed unchanged for one interval."""
+    print(f"Watching {converter.input_root} every {interval:g} s (Ctrl+C to stop).", flush=True)
+    previous = scan_inputs(converter.input_root)
+    while True:
+        time.sleep(interval)
+        current = scan_inputs(converter.input_root)
+        for rel_path in converter.forget_missing(current):
+            print(f"removed    {rel_path}", flush=True)
+        # A workbook still being written shows a different stat on every poll; wait until it settles.
+        settled = {rel_path: stat for rel_path, stat in current.items() if previous.get(rel_path) == stat}
+        changed = {
+            rel_path: stat for rel_path, stat in settled.items()
+            if not is_up_to_date(converter.manifest.entries.get(rel_path), stat, converter.direction, converter.output_root)
+        }
+        if changed:
+            counts = converter.run(changed)
+            print(f"{counts['converted']} converted, {counts['failed']} failed.", flush=True)
+        previous = current
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="directory tree (or single workbook) to convert")
+    parser.add_argument("output", help="directory for the converted workbooks and the manifest")
+    parser.add_argument("--direction", choices=("auto", *CONVERSIONS), default="auto", help="conversion (default: detect from the sheets)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("PSV_WORKERS", "0")) or None, help="worker processes (default: PSV_WORKERS or CPU count)")
+    parser.add_argument("--force", action="store_true", help="convert everything, ignoring the manifest")
+    parser.add_argument("--watch", action="store_true", help="keep polling the input tree and reconvert changed workbooks")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between polls in watch mode")
+    args = parser.parse_args(argv)
+
+    if not Path(args.input).exists():
+        print(f"ERROR: Input '{args.input}' not found.")
+        return 2
+    for template_path in (DEFAULT_DATA_SHEET_TEMPLATE_PATH, DEFAULT_CALC_SHEET_TEMPLATE_PATH):
+        if not Path(template_path).exists():
+            print(f"ERROR: Template '{template_path}' not found. Run from the directory holding the templates.")
+            return 2
+
+    converter = TreeConverter(args.input, args.output, direction=args.direction, workers=args.workers, force=args.force)
+    failed = False
+    try:
+        start = time.perf_counter()
+        stats = scan_inputs(args.input)
+        converter.forget_missing(stats)
+        counts = converter.run(stats)
+        print(
+            f"{len(stats)} workbook(s): {counts['converted']} converted, {counts['skipped']} unchanged, "
+            f"{counts['failed'] + counts['still_failed']} failed ({counts['still_failed']} unchanged since failing) "
+            f"in {time.perf_counter() - start:.1f} s.",
+            flush=True,
+        )
+        failed = bool(converter.failed_inputs())
+        if args.watch:
+            converter.force = False
+            watch(converter, args.interval)
+    except KeyboardInterrupt:
+        print("Stopped.")
+    finally:
+        converter.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
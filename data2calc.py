@@ -1,6 +1,8 @@
 import pandas as pd
 import numpy as np # For pd.notnull and potential numeric operations
 
+from metrics import record, stage
+
 def get_state(row1_j):
     """Convert fluid state to Calculation Sheet abbreviation."""
     if row1_j in ["VAPOR", "GAS"]:
@@ -44,6 +46,185 @@ def get_left_bp(row1_O):
     except:
         return ""
 
+# Plain decimal literals (or str(NaN)) that float() and numpy parse identically.
+_NUMBER_PATTERN = r"\s*(?:[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|nan)\s*"
+
+def _is_str(values):
+    return np.fromiter((isinstance(v, str) for v in values), dtype=bool, count=len(values))
+
+def _lookup(values, table):
+    """Map each value through a dict, "" where it has no entry (like the scalar helpers)."""
+    mapped = pd.Series(values, dtype=object).map(table)
+    return np.where(mapped.notna(), mapped.to_numpy(dtype=object), "").astype(object)
+
+def get_state_column(values):
+    """Vectorized get_state()."""
+    return _lookup(values, {"VAPOR": "V", "GAS": "V", "STEAM": "S", "LIQUID": "L"})
+
+def get_ratio_column(values):
+    """Vectorized get_ratio()."""
+    return _lookup(values, {"C": 0.1, "B": 0.3, "P": 1.0})
+
+def get_rupture_disk_column(values):
+    """Vectorized get_rupture_disk()."""
+    result = np.full(len(values), "N", dtype=object)
+    is_str = _is_str(values)
+    if is_str.any():
+        found = pd.Series(values[is_str], dtype=str).str.lower().str.contains("rupture disk", regex=False)
+        result[np.flatnonzero(is_str)[found.to_numpy()]] = "Y"
+    return result
+
+def _split_bp_column(values, scalar_func, combine):
+    """
+    Parse 'X / Y' strings of a whole column at once.
+    Cells whose parts are plain numbers are parsed in bulk; anything else
+    (units, 'F.V.', unusual literals) falls back to the scalar helper.
+    """
+    result = np.empty(len(values), dtype=object)
+    if len(values) == 0:
+        return result
+    parts = pd.Series(np.asarray(values, dtype=object).astype(str), dtype=object).str.split("/", expand=True)
+    present = parts.notna().to_numpy()
+    numeric = np.ones(len(values), dtype=bool)
+    for j in range(parts.shape[1]):
+        numeric &= ~present[:, j] | parts[j].str.fullmatch(_NUMBER_PATTERN, na=False).to_numpy(dtype=bool)
+
+    if numeric.any():
+        fast = parts[numeric]
+        fast_present = present[numeric]
+        parsed = np.zeros(fast.shape, dtype=np.float64)
+        for j in range(fast.shape[1]):
+            rows = fast_present[:, j]
+            parsed[rows, j] = fast[j][rows].to_numpy(dtype=str).astype(np.float64)
+        result[numeric] = combine(parsed, fast_present).tolist()
+
+    for i in np.flatnonzero(~numeric):
+        result[i] = scalar_func(values[i])
+    return result
+
+def _sum_parts(parsed, present):
+    total = np.zeros(len(parsed), dtype=np.float64)
+    for j in range(parsed.shape[1]):
+        # Same left-to-right order as sum() so results match bit for bit.
+        total = np.where(present[:, j], total + parsed[:, j], total)
+    return total
+
+def get_sum_bp_column(values):
+    """Vectorized get_sum_bp()."""
+    return _split_bp_column(values, get_sum_bp, _sum_parts)
+
+def get_left_bp_column(values):
+    """Vectorized get_left_bp()."""
+    return _split_bp_column(values, get_left_bp, lambda parsed, present: parsed[:, 0])
+
+def _where(mask, values):
+    """values where mask is set, "" elsewhere."""
+    result = np.full(len(mask), "", dtype=object)
+    result[mask] = values[mask]
+    return result
+
+def _liquid_density(r1, r2):
+    values = r2[22]
+    mask = (get_state_column(r1[9]) == "L") & pd.notnull(values)
+    result = np.full(len(mask), "", dtype=object)
+    result[mask] = np.multiply(values[mask], 1000)
+    return result
+
+def _if_vapor_or_steam(r1, values):
+    return _where(np.isin(get_state_column(r1[9]), ["V", "S"]), values)
+
+class _RecordRows:
+    """One row of every record pair, indexed by Data Sheet column like the original row Series."""
+
+    def __init__(self, values):
+        self.values = values
+
+    def __len__(self):
+        return self.values.shape[1]
+
+    def __getitem__(self, col_idx):
+        if col_idx < self.values.shape[1]:
+            return self.values[:, col_idx]
+        return np.full(self.values.shape[0], "", dtype=object)
+
+# Mapping: Calculation Sheet row idx: (Data Sheet row offset, col idx, function)
+# row offset: 0 = first row, 1 = second row in each record pair
+# Functions receive the first/second rows of all records and return whole columns.
+CALC_SHEET_MAPPING = {
+    1:   (0, 0, None),
+    2:   (0, 3, None),
+    3:   (1, 0, None),
+    4:   (None, None, lambda r1, r2: np.full(len(r1.values), 1, dtype=object)),
+    5:   (1, 16, None),
+    6:   (None, None, lambda r1, r2: get_ratio_column(r2[16])),
+    7:   (None, None, lambda r1, r2: np.full(len(r1.values), "CS", dtype=object)),
+    8:   (None, None, lambda r1, r2: get_rupture_disk_column(r1[26])),
+    9:   (None, None, lambda r1, r2: np.full(len(r1.values), "R", dtype=object)),
+    11:  (1, 9, None),
+    12:  (0, 9, lambda r1, r2: get_state_column(r1[9])),
+    13:  (0, 10, None),
+    14:  (1, 22, _liquid_density),
+    15:  (0, 21, None),
+    16:  (0, 22, lambda r1, r2: _if_vapor_or_steam(r1, r1[22])),
+    17:  (0, 23, lambda r1, r2: _if_vapor_or_steam(r1, r1[23])),
+    18:  (1, 23, lambda r1, r2: _if_vapor_or_steam(r1, r2[23])),
+    20:  (0, 13, None),
+    21:  (0, 17, None),
+    22:  (0, 20, None),
+    23:  (0, 14, lambda r1, r2: get_sum_bp_column(r1[14])),
+    24:  (0, 14, lambda r1, r2: get_left_bp_column(r1[14])),
+}
+
+def split_record_pairs(data_sheet_df):
+    """
+    Reshape the Data Sheet into two aligned arrays, one row per record.
+    Records whose Tag No. is empty are dropped.
+    Returns:
+        tuple: (first rows, second rows) as 2D numpy arrays.
+    """
+    num_records = (data_sheet_df.shape[0] + 1) // 2 # Each record is two rows
+    values = data_sheet_df.to_numpy()
+    if values.shape[0] % 2:
+        # The reader trims a trailing empty row, which may be the second row of the last record.
+        values = np.vstack([values, np.full((1, values.shape[1]), np.nan, dtype=object)])
+    pairs = values.reshape(num_records, 2, values.shape[1])
+    rows1, rows2 = pairs[:, 0, :], pairs[:, 1, :]
+
+    if rows1.shape[1] == 0:
+        return rows1[:0], rows2[:0]
+    tags = pd.Series(rows1[:, 0], dtype=object)
+    keep = tags.notna().to_numpy() & (tags.astype(str).str.strip() != "").to_numpy()
+    return rows1[keep], rows2[keep]
+
+def map_calc_sheet_block(data_sheet_df, num_calc_rows):
+    """
+    Map every Data Sheet record onto its Calculation Sheet column.
+    Args:
+        data_sheet_df (pd.DataFrame): Data Sheet.
+        num_calc_rows (int): Rows of the Calculation Sheet; mapped rows beyond it are skipped.
+    Returns:
+        np.ndarray: (num_calc_rows, number of records) object array, "" where nothing is mapped.
+    """
+    with stage("split_records"):
+        rows1, rows2 = split_record_pairs(data_sheet_df)
+    num_tags = rows1.shape[0]
+    record("records", num_tags)
+
+    r1, r2 = _RecordRows(rows1), _RecordRows(rows2)
+    tag_block = np.full((num_calc_rows, num_tags), "", dtype=object)
+    if num_tags == 0:
+        return tag_block
+
+    with stage("map_properties"):
+        for calc_row_idx, (ds_row_offset, ds_col_idx, func) in CALC_SHEET_MAPPING.items():
+            if calc_row_idx >= num_calc_rows:
+                continue
+            if func:
+                tag_block[calc_row_idx] = func(r1, r2)
+            elif ds_row_offset is not None and ds_col_idx is not None:
+                tag_block[calc_row_idx] = (r1 if ds_row_offset == 0 else r2)[ds_col_idx]
+    return tag_block
+
 def convert_data_to_calc_sheet(data_sheet_df, calc_sheet_template_df):
     """
     Convert Data Sheet to Calculation Sheet format.
@@ -53,59 +234,18 @@ def convert_data_to_calc_sheet(data_sheet_df, calc_sheet_template_df):
     Returns:
         pd.DataFrame: Converted Calculation Sheet.
     """
-    # Mapping: Calculation Sheet col idx: (Data Sheet row offset, col idx, function)
-    # row offset: 0 = first row, 1 = second row in each record pair
-    mapping = {
-        1:   (0, 0, None),
-        2:   (0, 3, None),
-        3:   (1, 0, None),
-        4:   (None, None, lambda r1, r2: 1),
-        5:   (1, 16, None),
-        6:   (None, None, lambda r1, r2: get_ratio(r2[16])),
-        7:   (None, None, lambda r1, r2: "CS"),
-        8:   (None, None, lambda r1, r2: get_rupture_disk(r1[26] if len(r1) > 26 else "")),
-        9:   (None, None, lambda r1, r2: "R"),
-        11:  (1, 9, None),
-        12:  (0, 9, lambda r1, r2: get_state(r1[9])),
-        13:  (0, 10, None),
-        14:  (1, 22, lambda r1, r2: r2[22]*1000 if get_state(r1[9])=="L" and pd.notnull(r2[22]) else ""),
-        15:  (0, 21, None),
-        16:  (0, 22, lambda r1, r2: r1[22] if get_state(r1[9]) in ["V","S"] else ""),
-        17:  (0, 23, lambda r1, r2: r1[23] if get_state(r1[9]) in ["V","S"] else ""),
-        18:  (1, 23, lambda r1, r2: r2[23] if get_state(r1[9]) in ["V","S"] else ""),
-        20:  (0, 13, None),
-        21:  (0, 17, None),
-        22:  (0, 20, None),
-        23:  (0, 14, lambda r1, r2: get_sum_bp(r1[14])),
-        24:  (0, 14, lambda r1, r2: get_left_bp(r1[14]))
-    }
-
-    result_df = calc_sheet_template_df.copy()
-    num_records = data_sheet_df.shape[0] // 2 # Each record is two rows
-
-    for rec_idx in range(num_records):
-        row1 = data_sheet_df.iloc[rec_idx*2]
-        row2 = data_sheet_df.iloc[rec_idx*2+1]
-
-        # Skip if Tag No. is empty
-        if pd.isnull(row1[0]) or str(row1[0]).strip() == "":
-            continue
-
-        # Prepare new column for result_df
-        new_col_data = pd.Series([""] * calc_sheet_template_df.shape[0], index=calc_sheet_template_df.index)
-
-        for calc_col_idx, (ds_row_offset, ds_col_idx, func) in mapping.items():
-            value_to_map = ""
-            if func:
-                value_to_map = func(row1, row2)
-            elif ds_row_offset is not None and ds_col_idx is not None:
-                src_row = row1 if ds_row_offset == 0 else row2
-                if ds_col_idx < len(src_row):
-                    value_to_map = src_row[ds_col_idx]
-            if calc_col_idx < len(new_col_data):
-                new_col_data[calc_col_idx] = value_to_map
-        result_df[result_df.shape[1]] = new_col_data
-    return result_df
+    tag_block = map_calc_sheet_block(data_sheet_df, calc_sheet_template_df.shape[0])
+    num_tags = tag_block.shape[1]
+    if num_tags == 0:
+        return calc_sheet_template_df.copy()
+
+    first_col = calc_sheet_template_df.shape[1]
+    tag_columns = pd.DataFrame(
+        tag_block,
+        index=calc_sheet_template_df.index,
+        columns=range(first_col, first_col + num_tags),
+    )
+    return pd.concat([calc_sheet_template_df.copy(), tag_columns], axis=1)
 
 if __name__ == '__main__':
     # Only runs when this file is executed directly (for testing)
@@ -0,0 +1,127 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class ExecutorBusyError(Exception):
+    """Raised when the conversion queue is full and the request should be retried later."""
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class ConversionExecutor:
+    """
+    Runs blocking conversions off the event loop with bounded concurrency.
+
+    At most `max_workers` conversions run at once; up to `max_queue` more may wait
+    for a free worker. Anything beyond that is rejected with ExecutorBusyError so
+    callers can answer 503 + Retry-After instead of piling up latency.
+    Args:
+        kind (str): "process" (default) or "thread".
+        max_workers (int): Number of worker processes/threads.
+        max_queue (int): Number of requests allowed to wait for a worker.
+        retry_after (int): Seconds suggested to rejected clients.
+        initializer (callable): Run once in every worker (e.g. to warm template caches).
+    """
+
+    def __init__(self, kind="process", max_workers=None, max_queue=None, retry_after=5, initializer=None):
+        self.requested_kind = kind
+        self.kind = None
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = self.max_workers * 2 if max_queue is None else max_queue
+        self.retry_after = retry_after
+        self._initializer = initializer
+        self._pool = None
+        self._semaphore = None
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls, initializer=None):
+        """Build an executor from PSV_EXECUTOR / PSV_WORKERS / PSV_MAX_QUEUE / PSV_RETRY_AFTER."""
+        max_workers = os.environ.get("PSV_WORKERS")
+        max_queue = os.environ.get("PSV_MAX_QUEUE")
+        return cls(
+            kind=os.environ.get("PSV_EXECUTOR", "process"),
+            max_workers=int(max_workers) if max_workers else None,
+            max_queue=int(max_queue) if max_queue else None,
+            retry_after=int(os.environ.get("PSV_RETRY_AFTER", "5")),
+            initializer=initializer,
+        )
+
+    def _create_pool(self):
+        if self.requested_kind == "process":
+            try:
+                pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=self._initializer)
+                self.kind = "process"
+                return pool
+            except (ImportError, NotImplementedError, OSError) as e:
+                print(f"WARNING: Process pool unavailable ({e}); falling back to a thread pool.")
+        self.kind = "thread"
+        return ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="psv-convert", initializer=self._initializer
+        )
+
+    def start(self):
+        if self._pool is None:
+            self._pool = self._create_pool()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in the pool, or raise ExecutorBusyError if the queue is full."""
+        self.start()
+        if self.running + self.waiting >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise ExecutorBusyError(self.retry_after)
+
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.running += 1
+        pool = self._pool
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(pool, fn, *args)
+            self.completed += 1
+            return result
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); replace the pool for later requests.
+            self.failed += 1
+            if self._pool is pool:
+                print("ERROR: Conversion worker process died; restarting the process pool.")
+                self.shutdown()
+                self.start()
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        return {
+            "kind": self.kind or self.requested_kind,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,315 @@
+import asyncio
+import json
+import os
+import re
+import zipfile
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+from fastapi import HTTPException
+
+from metrics import current_trace, record_rejection, stage
+from uploads import UploadPayload
+from xlsx_reader import SheetNotFoundError, find_sheet_path
+
+# Resource guardrails.
+# 1. Request bodies are limited while they stream in (RequestSizeLimitMiddleware),
+#    before Starlette spools a multipart upload or request.body() buffers it.
+# 2. Workbooks (and batch .zip archives) are checked from the zip central
+#    directory before anything is parsed: entry count, total uncompressed size
+#    and the compression ratio of large entries. zipfile never inflates an entry
+#    past its declared size, so the declared sizes bound what parsing can use.
+# 3. Each conversion gets a cost in cells, estimated from the worksheet
+#    <dimension> of the sheets the converters read. Requests above
+#    PSV_MAX_REQUEST_CELLS are refused; the AdmissionController lets at most
+#    PSV_ADMISSION_BUDGET_CELLS run at once and queues the rest for up to
+#    PSV_ADMISSION_WAIT seconds before answering 503.
+# Every rejection is counted in psv_rejections_total{endpoint, reason}.
+
+MiB = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get("PSV_MAX_UPLOAD_BYTES", str(64 * MiB)))
+MAX_BATCH_BYTES = int(os.environ.get("PSV_MAX_BATCH_BYTES", str(1024 * MiB)))
+MAX_UNCOMPRESSED_BYTES = int(os.environ.get("PSV_MAX_UNCOMPRESSED_BYTES", str(256 * MiB)))
+MAX_COMPRESSION_RATIO = float(os.environ.get("PSV_MAX_COMPRESSION_RATIO", "100"))
+MAX_ZIP_ENTRIES = int(os.environ.get("PSV_MAX_ZIP_ENTRIES", "10000"))
+MAX_REQUEST_CELLS = int(os.environ.get("PSV_MAX_REQUEST_CELLS", "10000000"))
+ADMISSION_BUDGET_CELLS = int(os.environ.get("PSV_ADMISSION_BUDGET_CELLS", "20000000"))
+ADMISSION_MAX_WAIT = float(os.environ.get("PSV_ADMISSION_WAIT", "30"))
+ADMISSION_RETRY_AFTER = 5
+
+# Entries smaller than this are not ratio-checked: tiny XML parts compress extremely well.
+RATIO_CHECK_MIN_BYTES = MiB
+# The sheets whose size drives the cost of a conversion.
+COSTED_SHEETS = ("FORM", "PSV")
+# Sheet XML bytes per cell: ~12 for the smallest cells, ~64 for long inline values.
+# A declared <dimension> is clamped into that range (it is often stale or missing),
+# and sheets without one are costed at SHEET_BYTES_PER_CELL.
+MIN_BYTES_PER_CELL = 12
+MAX_BYTES_PER_CELL = 64
+SHEET_BYTES_PER_CELL = 30
+# Serialized record bodies (JSON/CSV) cost about this many bytes per cell.
+BODY_BYTES_PER_CELL = 30
+DIMENSION_SCAN_BYTES = 16 * 1024
+
+_DIMENSION_RE = re.compile(rb'<(?:\w+:)?dimension\b[^>]*\bref="\$?([A-Z]{1,3})\$?(\d+)(?::\$?([A-Z]{1,3})\$?(\d+))?"')
+
+
+class GuardrailError(Exception):
+    """A request refused by a guardrail; `reason` labels the rejection metric."""
+
+    def __init__(self, status_code, detail, reason, retry_after=None):
+        super().__init__(status_code, detail, reason, retry_after)
+        self.status_code = status_code
+        self.detail = detail
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def to_http(self):
+        headers = {"Retry-After": str(self.retry_after)} if self.retry_after else None
+        return HTTPException(status_code=self.status_code, detail=self.detail, headers=headers)
+
+
+@dataclass
+class WorkbookCost:
+    cells: int
+    uncompressed_bytes: int
+
+
+def _column_number(letters):
+    """Column number of bytes column letters (b"A" -> 1)."""
+    number = 0
+    for letter in letters:
+        number = number * 26 + letter - 64
+    return number
+
+
+def _dimension_cells(head):
+    """Cells spanned by the <dimension ref> at the start of a sheet XML, or None."""
+    match = _DIMENSION_RE.search(head)
+    if match is None:
+        return None
+    first_col, first_row, last_col, last_row = match.groups()
+    if last_col is None:
+        return 1
+    rows = int(last_row) - int(first_row) + 1
+    cols = _column_number(last_col) - _column_number(first_col) + 1
+    return max(rows, 1) * max(cols, 1)
+
+
+def check_zip(zf, max_uncompressed, label):
+    """
+    Refuse a zip whose central directory announces too many entries, too much data
+    or a decompression-bomb ratio.
+    Returns:
+        int: Total uncompressed bytes.
+    """
+    infos = zf.infolist()
+    if len(infos) > MAX_ZIP_ENTRIES:
+        raise GuardrailError(413, f"{label} has {len(infos)} zip entries; at most {MAX_ZIP_ENTRIES} are accepted.", "zip_entries")
+    total = 0
+    for info in infos:
+        total += info.file_size
+        if info.file_size >= RATIO_CHECK_MIN_BYTES and info.file_size > MAX_COMPRESSION_RATIO * max(info.compress_size, 1):
+            raise GuardrailError(
+                413,
+                f"{label}: '{info.filename}' expands {info.file_size / max(info.compress_size, 1):.0f}x "
+                f"(at most {MAX_COMPRESSION_RATIO:g}x is accepted).",
+                "zip_ratio",
+            )
+    if total > max_uncompressed:
+        raise GuardrailError(
+            413, f"{label} expands to {total} bytes; at most {max_uncompressed} are accepted.", "zip_size",
+        )
+    return total
+
+
+def _sheet_cells(zf, sheet_path):
+    info = zf.getinfo(sheet_path)
+    with zf.open(info) as f:
+        declared = _dimension_cells(f.read(DIMENSION_SCAN_BYTES))
+    if declared is None:
+        return info.file_size // SHEET_BYTES_PER_CELL
+    return min(max(declared, info.file_size // MAX_BYTES_PER_CELL), info.file_size // MIN_BYTES_PER_CELL)
+
+
+def inspect_workbook(source, label=None):
+    """
+    Check an uploaded workbook and estimate the cost of converting it.
+    Args:
+        source: UploadPayload or binary file object.
+        label (str): Name used in error messages.
+    Returns:
+        WorkbookCost
+    Raises:
+        GuardrailError: The workbook is a decompression bomb or too expensive to convert.
+    """
+    is_payload = isinstance(source, UploadPayload)
+    label = label or (source.filename if is_payload else None) or "The workbook"
+    stream = source.open() if is_payload else source
+    try:
+        try:
+            zf = zipfile.ZipFile(stream)
+        except zipfile.BadZipFile:
+            # Legacy .xls (or not a workbook at all; the converters report that): cost by size.
+            uncompressed = stream.seek(0, os.SEEK_END)
+            cells = uncompressed // MIN_BYTES_PER_CELL
+        else:
+            with zf:
+                uncompressed = check_zip(zf, MAX_UNCOMPRESSED_BYTES, label)
+                cells = 0
+                for sheet_name in COSTED_SHEETS:
+                    try:
+                        cells += _sheet_cells(zf, find_sheet_path(zf, sheet_name))
+                    except (SheetNotFoundError, KeyError):
+                        pass
+    finally:
+        if is_payload:
+            stream.close()
+    check_cost(cells, label)
+    return WorkbookCost(cells=cells, uncompressed_bytes=uncompressed)
+
+
+def check_cost(cells, label):
+    """Refuse a conversion estimated above PSV_MAX_REQUEST_CELLS."""
+    if cells > MAX_REQUEST_CELLS:
+        raise GuardrailError(
+            413, f"{label} is too large to convert (about {cells} cells; at most {MAX_REQUEST_CELLS} are accepted).", "cost",
+        )
+
+
+def check_archive(payload):
+    """
+    Check an uploaded batch .zip before its members are listed or extracted: its members
+    may not add up to more than a batch upload of the same workbooks (PSV_MAX_BATCH_BYTES)
+    and each must fit the upload limit. Members are checked as workbooks once extracted.
+    """
+    with payload.open() as f, zipfile.ZipFile(f) as zf:
+        check_zip(zf, MAX_BATCH_BYTES, payload.filename or "The archive")
+        for info in zf.infolist():
+            if info.file_size > MAX_UPLOAD_BYTES:
+                raise GuardrailError(
+                    413, f"'{info.filename}' in {payload.filename} is {info.file_size} bytes; at most {MAX_UPLOAD_BYTES} are accepted.",
+                    "upload_size",
+                )
+
+
+def body_cost(num_bytes):
+    """Cost in cells of a record body (JSON / CSV / Parquet)."""
+    return num_bytes // BODY_BYTES_PER_CELL
+
+
+class AdmissionController:
+    """
+    Cost budget of the conversions running in this process. A request waits (up to
+    max_wait seconds) until its cost fits next to the running ones; a request costing
+    more than the whole budget runs alone.
+    Args:
+        budget (int): Cells allowed in flight; 0 disables admission control.
+        max_wait (float): Seconds a request may wait for budget before a 503.
+    """
+
+    def __init__(self, budget=ADMISSION_BUDGET_CELLS, max_wait=ADMISSION_MAX_WAIT):
+        self.budget = budget
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._condition = None
+
+    @asynccontextmanager
+    async def admit(self, cost):
+        if self.budget <= 0 or cost <= 0:
+            yield
+            return
+        cost = min(cost, self.budget)
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            if self.in_flight + cost > self.budget:
+                self.waiting += 1
+                try:
+                    with stage("admission"):
+                        await asyncio.wait_for(
+                            self._condition.wait_for(lambda: self.in_flight + cost <= self.budget), self.max_wait
+                        )
+                except asyncio.TimeoutError:
+                    self.rejected += 1
+                    raise GuardrailError(
+                        503, "Server is busy converting other large files. Please retry later.", "admission",
+                        retry_after=ADMISSION_RETRY_AFTER,
+                    )
+                finally:
+                    self.waiting -= 1
+            self.in_flight += cost
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_flight -= cost
+                self._condition.notify_all()
+
+    def stats(self):
+        return {
+            "budget_cells": self.budget,
+            "in_flight_cells": self.in_flight,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "max_wait_seconds": self.max_wait,
+        }
+
+
+class _BodyTooLarge(HTTPException):
+    pass
+
+
+class RequestSizeLimitMiddleware:
+    """
+    ASGI middleware: refuses request bodies above a per-path limit with 413, from the
+    Content-Length header when there is one and otherwise as soon as the streamed body
+    passes the limit, so oversized uploads are never buffered or spooled in full.
+    Args:
+        limits (dict): {path: max bytes}; other paths get `default`.
+        registry (MetricsRegistry): Counts rejections of requests outside a Trace.
+    """
+
+    def __init__(self, app, default=MAX_UPLOAD_BYTES, limits=None, registry=None):
+        self.app = app
+        self.default = default
+        self.limits = limits or {}
+        self.registry = registry
+
+    def _reject(self, path):
+        if current_trace() is not None:
+            record_rejection("upload_size")
+        elif self.registry is not None:
+            self.registry.observe_rejection(path, "upload_size")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS"):
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        limit = self.limits.get(path, self.default)
+        detail = f"Request body too large; at most {limit} bytes are accepted."
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            self._reject(path)
+            await send({"type": "http.response.start", "status": 413, "headers": [(b"content-type", b"application/json")]})
+            await send({"type": "http.response.body", "body": json.dumps({"detail": detail}).encode("utf-8")})
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    self._reject(path)
+                    # Raised inside body parsing; FastAPI passes HTTPExceptions through as responses.
+                    raise _BodyTooLarge(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
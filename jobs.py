@@ -0,0 +1,452 @@
+import asyncio
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from fastapi.concurrency import run_in_threadpool
+
+from metrics import current_trace, record_error, tracing
+from sqlite_db import connect, isoformat
+
+# Asynchronous conversion jobs (POST /jobs/...).
+# Jobs, their uploads and their results are kept in a SQLite database and a
+# directory next to it, so queued work survives a restart. Every JobRunner
+# claims jobs under its own owner id and keeps a heartbeat on them; a running
+# job is queued again only once its owner is gone (exited, or silent for
+# JOB_STALE_SECONDS), so several server processes can share one job table.
+# JobRunner feeds queued jobs to the conversion executor; finished results are
+# deleted once their TTL has passed.
+
+JOBS_DIR = os.environ.get("PSV_JOBS_DIR") or str(Path(tempfile.gettempdir()) / "fastapi_excel_processor_jobs")
+JOB_TTL_SECONDS = int(os.environ.get("PSV_JOB_TTL", str(24 * 60 * 60)))
+JOB_MAX_QUEUED = int(os.environ.get("PSV_JOB_MAX_QUEUED", "1000"))
+JOB_SWEEP_INTERVAL = 60
+JOB_POLL_INTERVAL = 1.0
+JOB_HEARTBEAT_INTERVAL = 10
+JOB_STALE_SECONDS = int(os.environ.get("PSV_JOB_STALE_SECONDS", "60"))
+
+JOB_STATUSES = ("queued", "running", "done", "failed", "expired")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    filename TEXT,
+    status TEXT NOT NULL,
+    stage TEXT,
+    records_total INTEGER,
+    input_bytes INTEGER NOT NULL,
+    input_sha256 TEXT NOT NULL,
+    result_bytes INTEGER,
+    cache TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error_status INTEGER,
+    error_detail TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    expires_at REAL,
+    owner TEXT,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+# Columns added after the first release, for job tables created before them.
+_ADDED_COLUMNS = {"owner": "TEXT", "heartbeat_at": "REAL"}
+
+
+class QueueFullError(Exception):
+    """Raised when PSV_JOB_MAX_QUEUED jobs are already waiting."""
+
+
+def new_owner_id():
+    """Owner id of a JobRunner: host, pid and a random suffix (pids are reused)."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _owner_alive(owner):
+    """False only if the owner is known to be gone: a process of this host that no longer exists."""
+    try:
+        host, pid, _ = owner.rsplit(":", 2)
+        pid = int(pid)
+    except ValueError:
+        return False
+    if host != socket.gethostname():
+        return True  # Another host: only its heartbeat tells.
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    """
+    SQLite-backed job table plus a directory holding each job's input and result.
+    Every method opens its own connection, so the store can be used from any
+    thread (and ProgressReporter writes to it from worker processes).
+    Args:
+        jobs_dir (str): Directory of jobs.sqlite3 and the job files.
+        ttl_seconds (int): How long finished jobs keep their results.
+        max_queued (int): Queued jobs accepted before QueueFullError.
+    """
+
+    def __init__(self, jobs_dir, ttl_seconds=JOB_TTL_SECONDS, max_queued=JOB_MAX_QUEUED):
+        self.jobs_dir = Path(jobs_dir)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = str(self.jobs_dir / "jobs.sqlite3")
+        self.ttl_seconds = ttl_seconds
+        self.max_queued = max_queued
+        with connect(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, column_type in _ADDED_COLUMNS.items():
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {column_type}")
+
+    @classmethod
+    def from_env(cls):
+        return cls(JOBS_DIR)
+
+    def input_path(self, job_id):
+        return self.jobs_dir / f"{job_id}.input"
+
+    def result_path(self, job_id):
+        return self.jobs_dir / f"{job_id}.result"
+
+    def create(self, kind, payload):
+        """
+        Queue a conversion of an UploadPayload; its data is moved into the jobs directory.
+        Returns:
+            str: The job id.
+        Raises:
+            QueueFullError: Too many jobs are already queued.
+        """
+        job_id = uuid.uuid4().hex
+        input_path = self.input_path(job_id)
+        if payload.path is not None:
+            shutil.move(str(payload.path), input_path)
+        else:
+            input_path.write_bytes(payload.data)
+
+        with connect(self.db_path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            (queued,) = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()
+            if queued >= self.max_queued:
+                conn.execute("ROLLBACK")
+                input_path.unlink(missing_ok=True)
+                raise QueueFullError(queued)
+            conn.execute(
+                "INSERT INTO jobs (id, kind, filename, status, input_bytes, input_sha256, created_at) VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, payload.filename, payload.size, payload.sha256, time.time()),
+            )
+            conn.execute("COMMIT")
+        return job_id
+
+    def claim_next(self, owner):
+        """Mark the oldest queued job as running under `owner` and return it (a dict), or None."""
+        with connect(self.db_path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            started_at = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = 'running', stage = NULL, started_at = ?, attempts = attempts + 1,"
+                " owner = ?, heartbeat_at = ? WHERE id = ?",
+                (started_at, owner, started_at, row["id"]),
+            )
+            conn.execute("COMMIT")
+        job = dict(row)
+        job.update(status="running", started_at=started_at, attempts=row["attempts"] + 1, owner=owner, heartbeat_at=started_at)
+        return job
+
+    def _update(self, job_id, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with connect(self.db_path) as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def complete(self, job_id, output_bytes, cache_status):
+        """Store a job's result and mark it done."""
+        result_path = self.result_path(job_id)
+        fd, tmp_name = tempfile.mkstemp(prefix=".tmp_", dir=self.jobs_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(output_bytes)
+            os.replace(tmp_name, result_path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        finished_at = time.time()
+        with connect(self.db_path) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', stage = NULL, owner = NULL, result_bytes = ?, cache = ?,"
+                " finished_at = ?, expires_at = ? WHERE id = ?",
+                (len(output_bytes), cache_status, finished_at, finished_at + self.ttl_seconds, job_id),
+            )
+        self.input_path(job_id).unlink(missing_ok=True)
+
+    def fail(self, job_id, status_code, detail):
+        finished_at = time.time()
+        self._update(
+            job_id, status="failed", stage=None, owner=None, error_status=status_code, error_detail=detail,
+            finished_at=finished_at, expires_at=finished_at + self.ttl_seconds,
+        )
+        self.input_path(job_id).unlink(missing_ok=True)
+
+    def requeue(self, job_id):
+        """Put a running job back in the queue (e.g. the executor was busy)."""
+        self._update(job_id, status="queued", stage=None, started_at=None, owner=None)
+
+    def heartbeat(self, owner):
+        """Mark the running jobs of `owner` as still alive."""
+        with connect(self.db_path) as conn:
+            conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status = 'running'", (time.time(), owner))
+
+    def release(self, owner):
+        """Queue again the running jobs of `owner` (it is shutting down). Returns their number."""
+        with connect(self.db_path) as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = 'queued', stage = NULL, started_at = NULL, owner = NULL"
+                " WHERE owner = ? AND status = 'running'",
+                (owner,),
+            ).rowcount
+
+    def recover(self, stale_after=JOB_STALE_SECONDS):
+        """
+        Queue again the running jobs whose owner is gone: a process of this host that
+        has exited, or any owner without a heartbeat for `stale_after` seconds. Jobs of
+        live owners are left alone, so every server process may call this at any time.
+        Returns:
+            int: Jobs queued again.
+        """
+        stale_before = time.time() - stale_after
+        with connect(self.db_path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            orphans = [
+                (row["id"], row["owner"])
+                for row in conn.execute("SELECT id, owner, heartbeat_at FROM jobs WHERE status = 'running'")
+                if row["owner"] is None or row["heartbeat_at"] is None or row["heartbeat_at"] < stale_before
+                or not _owner_alive(row["owner"])
+            ]
+            conn.executemany(
+                "UPDATE jobs SET status = 'queued', stage = NULL, started_at = NULL, owner = NULL"
+                " WHERE id = ? AND status = 'running' AND owner IS ?",
+                orphans,
+            )
+            conn.execute("COMMIT")
+        return len(orphans)
+
+    def expire(self):
+        """Delete the files of finished jobs past their TTL. Returns the number of expired jobs."""
+        now = time.time()
+        with connect(self.db_path) as conn:
+            job_ids = [row["id"] for row in conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND expires_at <= ?", (now,)
+            )]
+            conn.executemany("UPDATE jobs SET status = 'expired' WHERE id = ?", [(job_id,) for job_id in job_ids])
+        for job_id in job_ids:
+            self.result_path(job_id).unlink(missing_ok=True)
+            self.input_path(job_id).unlink(missing_ok=True)
+        return len(job_ids)
+
+    def get(self, job_id):
+        """The job as a dict (with its queue position while queued), or None."""
+        with connect(self.db_path) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = dict(row)
+            if job["status"] == "queued":
+                (ahead,) = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?", (job["created_at"],)
+                ).fetchone()
+                job["queue_position"] = ahead + 1
+        return job
+
+    def stats(self):
+        """Job counts by status and the age of the oldest queued job, for capacity planning."""
+        with connect(self.db_path) as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            (oldest,) = conn.execute("SELECT MIN(created_at) FROM jobs WHERE status = 'queued'").fetchone()
+        stats = {status: counts.get(status, 0) for status in JOB_STATUSES}
+        stats.update(
+            oldest_queued_seconds=round(time.time() - oldest, 3) if oldest is not None else None,
+            max_queued=self.max_queued,
+            ttl_seconds=self.ttl_seconds,
+        )
+        return stats
+
+
+def job_view(job):
+    """Public JSON representation of a job row."""
+    view = {
+        "id": job["id"],
+        "kind": job["kind"],
+        "filename": job["filename"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "records": job["records_total"],
+        "input_bytes": job["input_bytes"],
+        "created_at": isoformat(job["created_at"]),
+        "started_at": isoformat(job["started_at"]),
+        "finished_at": isoformat(job["finished_at"]),
+        "expires_at": isoformat(job["expires_at"]),
+    }
+    if "queue_position" in job:
+        view["queue_position"] = job["queue_position"]
+    if job["status"] == "done":
+        view.update(result_bytes=job["result_bytes"], cache=job["cache"], result_url=f"/jobs/{job['id']}/result")
+    if job["status"] == "failed":
+        view["error"] = {"status_code": job["error_status"], "detail": job["error_detail"]}
+    return view
+
+
+class ProgressReporter:
+    """
+    Trace.on_update hook that writes a job's running stage and record count to the
+    job table. Picklable, so it travels to process-pool workers with the job.
+    """
+
+    def __init__(self, db_path, job_id):
+        self.db_path = db_path
+        self.job_id = job_id
+
+    def __call__(self, trace):
+        try:
+            with connect(self.db_path) as conn:
+                conn.execute(
+                    "UPDATE jobs SET stage = ?, records_total = ? WHERE id = ? AND status = 'running'",
+                    (trace.active_stage, trace.counts.get("records"), self.job_id),
+                )
+        except sqlite3.Error as e:
+            print(f"WARNING: Could not record progress of job {self.job_id}: {e}")
+
+
+def run_with_progress(fn, source, reporter):
+    """Run a pipeline function with the active Trace reporting to a ProgressReporter."""
+    trace = current_trace()
+    if trace is not None:
+        trace.on_update = reporter
+    return fn(source)
+
+
+class JobRunner:
+    """
+    Runs queued jobs on the event loop, `concurrency` at a time, and expires old results.
+    Args:
+        store (JobStore): The job table.
+        convert (coroutine function): convert(job) -> (output bytes, cache status). Errors
+            carrying `status_code` / `detail` (HTTPException, ConversionError) fail the
+            job with that status; 503 puts it back in the queue.
+        concurrency (int): Jobs converted at once.
+        registry (MetricsRegistry): Optional; each job is recorded under "/jobs/<kind>".
+        retry_after (int): Seconds to wait after a 503 before claiming jobs again.
+    Jobs are claimed under `owner` (new_owner_id() at start(), so a forked process gets
+    its own) and heartbeated while they run; the sweep also re-queues jobs of owners
+    that are gone.
+    """
+
+    def __init__(self, store, convert, concurrency, registry=None, retry_after=5):
+        self.store = store
+        self.convert = convert
+        self.concurrency = concurrency
+        self.registry = registry
+        self.retry_after = retry_after
+        self.owner = None
+        self._wakeup = None
+        self._tasks = []
+
+    def start(self):
+        self.owner = new_owner_id()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+        self._tasks.append(asyncio.create_task(self._sweep()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Hand the interrupted jobs back at once rather than waiting for them to go stale.
+        try:
+            await run_in_threadpool(self.store.release, self.owner)
+        except sqlite3.Error as e:
+            print(f"WARNING: Could not re-queue the interrupted jobs: {e}")
+
+    def notify(self):
+        """Wake idle workers after a job was queued."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _work(self):
+        while True:
+            job = await run_in_threadpool(self.store.claim_next, self.owner)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if not await self._run(job):
+                await asyncio.sleep(self.retry_after)
+
+    async def _run(self, job):
+        """Convert one claimed job. Returns False if it had to be queued again."""
+        start = time.perf_counter()
+        status = 200
+        with tracing() as trace:
+            try:
+                output_bytes, cache_status = await self.convert(job)
+                await run_in_threadpool(self.store.complete, job["id"], output_bytes, cache_status)
+            except asyncio.CancelledError:
+                status = None
+                raise
+            except Exception as e:
+                status = getattr(e, "status_code", 500)
+                if status == 503:
+                    await run_in_threadpool(self.store.requeue, job["id"])
+                    return False
+                record_error(e)
+                detail = getattr(e, "detail", None)
+                if detail is None:
+                    print(f"An unexpected error occurred in job {job['id']}: {e}")
+                    detail = f"An internal server error occurred: {e}"
+                await run_in_threadpool(self.store.fail, job["id"], status, detail)
+            finally:
+                if self.registry is not None and status is not None:
+                    self.registry.observe_request(f"/jobs/{job['kind']}", status, time.perf_counter() - start, trace)
+        return True
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+            try:
+                await run_in_threadpool(self.store.heartbeat, self.owner)
+            except sqlite3.Error as e:
+                print(f"WARNING: Job heartbeat failed: {e}")
+
+    async def _sweep(self):
+        while True:
+            try:
+                recovered = await run_in_threadpool(self.store.recover)
+                if recovered:
+                    print(f"Re-queued {recovered} job(s) of a stopped server process.")
+                    self.notify()
+                expired = await run_in_threadpool(self.store.expire)
+                if expired:
+                    print(f"Expired {expired} finished job(s).")
+            except Exception as e:
+                print(f"WARNING: Job expiry sweep failed: {e}")
+            await asyncio.sleep(JOB_SWEEP_INTERVAL)
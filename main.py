@@ -1,122 +1,845 @@
 import os
-import shutil
 import io
+import asyncio
+import functools
+import json
+import shutil
 import tempfile
+import threading
+import time
+import zipfile
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import List, Optional
+
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+
+from batch import ARCHIVE_SUFFIX, BATCH_MAX_FILES, OUTPUT_NAMES, list_batch_items, stream_batch
+from calc2data import header_layout_stats
+from calc_update import summary_counts
+from executor import ConversionExecutor, ExecutorBusyError
+from guardrails import (
+    MAX_BATCH_BYTES,
+    AdmissionController,
+    GuardrailError,
+    RequestSizeLimitMiddleware,
+    body_cost,
+    check_archive,
+    check_cost,
+    inspect_workbook,
+)
+from jobs import JobRunner, JobStore, ProgressReporter, QueueFullError, job_view, run_with_progress
+from metrics import MetricsMiddleware, MetricsRegistry, gauge_lines, merge_trace, record, record_error, record_rejection, stage, traced_call
+from pipeline import (
+    CALC_SHEET_TEMPLATE_CACHE,
+    DATA_SHEET_PATCH_TEMPLATE_CACHE,
+    DATA_SHEET_TEMPLATE_POOL,
+    DEFAULT_CALC_SHEET_TEMPLATE_PATH,
+    DEFAULT_DATA_SHEET_TEMPLATE_PATH,
+    ConversionError,
+    conversion_cache_key,
+    detect_conversion,
+    get_record_store,
+    run_calc2data,
+    run_data2calc,
+    run_data2calc_update,
+    run_records_calc2data,
+    run_records_data2calc,
+    run_sizing,
+    warm_templates,
+)
+from record_store import RECORD_QUERY_MAX_LIMIT
+from records import RECORD_MEDIA_TYPES, RecordFormatError, record_format
+from result_cache import ResultCache, etag_matches
+from uploads import UploadPayload, receive_upload
+
+# --- Configuration ---
+TEMP_DIR = Path(tempfile.gettempdir()) / "fastapi_excel_processor_temp"
+TEMP_DIR.mkdir(parents=True, exist_ok=True)
+
+# Conversions are CPU-bound; they run in a bounded process pool (see executor.py).
+CONVERSION_EXECUTOR = ConversionExecutor.from_env(initializer=warm_templates)
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import StreamingResponse
-import pandas as pd
+# Converted workbooks keyed by upload hash + template hash + converter version (see result_cache.py).
+RESULT_CACHE = ResultCache.from_env()
 
-from calc2data import convert_calc_to_data_sheet 
-from data2calc import convert_data_to_calc_sheet 
+# Stage timings, counts and errors of the conversion endpoints (see metrics.py).
+METRICS = MetricsRegistry()
+INSTRUMENTED_ENDPOINTS = ("/calc2data/", "/data2calc/", "/data2calc/update", "/sizing/", "/batch/", "/records/calc2data", "/records/data2calc")
+
+# Conversions admitted by estimated cost in cells (see guardrails.py).
+ADMISSION = AdmissionController()
+
+# Header layout cache lookups of the conversion workers, from their traces (see /debug/header-layouts).
+HEADER_LAYOUT_LOOKUPS = {"hits": 0, "misses": 0}
+
+CONVERSIONS = {"calc2data": run_calc2data, "data2calc": run_data2calc}
+EXCEL_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Times a batch item is resubmitted when the executor queue is full.
+BATCH_BUSY_RETRIES = 10
+
+# Asynchronous jobs persisted in SQLite (see jobs.py). The store is opened on first use
+# (get_job_store), so importing this module creates no jobs directory or database; the
+# runner (get_job_runner) is defined below _convert_job.
+JOB_CONCURRENCY = int(os.environ.get("PSV_JOB_WORKERS", "0")) or CONVERSION_EXECUTOR.max_workers
+_job_store = None
+_job_runner = None
+_jobs_lock = threading.Lock()
+
+def get_job_store():
+    """The job store of this process, opened on first use."""
+    global _job_store
+    if _job_store is None:
+        with _jobs_lock:
+            if _job_store is None:
+                _job_store = JobStore.from_env()
+    return _job_store
+
+def _runtime_gauges():
+    executor_stats = CONVERSION_EXECUTOR.stats()
+    cache_stats = RESULT_CACHE.stats()
+    job_stats = get_job_store().stats()
+    admission_stats = ADMISSION.stats()
+    return (
+        gauge_lines("psv_executor_running", "Conversions running in the executor.", executor_stats["running"])
+        + gauge_lines("psv_executor_waiting", "Conversions waiting for an executor slot.", executor_stats["waiting"])
+        + gauge_lines("psv_executor_rejected", "Conversions rejected because the queue was full.", executor_stats["rejected"])
+        + gauge_lines("psv_result_cache_bytes", "Bytes held by the in-memory result cache.", cache_stats["memory_bytes"])
+        + gauge_lines("psv_result_cache_hits", "Result cache hits (memory and disk).", cache_stats["memory_hits"] + cache_stats["disk_hits"])
+        + gauge_lines("psv_result_cache_misses", "Result cache misses.", cache_stats["misses"])
+        + gauge_lines("psv_jobs_queued", "Asynchronous jobs waiting to run.", job_stats["queued"])
+        + gauge_lines("psv_jobs_running", "Asynchronous jobs running.", job_stats["running"])
+        + gauge_lines("psv_jobs_oldest_queued_seconds", "Age of the oldest queued job.", job_stats["oldest_queued_seconds"] or 0)
+        + gauge_lines("psv_admission_in_flight_cells", "Estimated cells of the conversions admitted.", admission_stats["in_flight_cells"])
+        + gauge_lines("psv_admission_waiting", "Conversions waiting for admission budget.", admission_stats["waiting"])
+    )
+
+METRICS.add_collector(_runtime_gauges)
+
+# Set by prepare_prefork() when serve.py warmed this process before forking the HTTP workers.
+PREFORKED = False
+# True from the end of startup until shutdown begins (GET /ready).
+READY = False
+
+def prepare_prefork():
+    """
+    Warm the template caches in the parent of the pre-forked HTTP workers (see serve.py);
+    the workers inherit the parsed templates and skip warming at startup.
+    """
+    global PREFORKED
+    warm_templates()
+    PREFORKED = True
+
+@asynccontextmanager
+async def lifespan(app):
+    global READY
+    if not PREFORKED:
+        # Warm the parent first so forked workers start with parsed templates.
+        await run_in_threadpool(warm_templates)
+    CONVERSION_EXECUTOR.start()
+    # Fork the pool's worker processes now (from the warm process) rather than on the first request.
+    await CONVERSION_EXECUTOR.run(os.getpid)
+    # Only jobs whose server process is gone are re-queued, so every worker may do this.
+    job_runner = await run_in_threadpool(get_job_runner)
+    recovered = await run_in_threadpool(job_runner.store.recover)
+    if recovered:
+        print(f"Re-queued {recovered} job(s) interrupted by the last shutdown.")
+    job_runner.start()
+    READY = True
+    try:
+        yield
+    finally:
+        READY = False
+        await job_runner.stop()
+        CONVERSION_EXECUTOR.shutdown()
 
 app = FastAPI(
     title="PSV Excel Processing API",
     description="API for converting PSV data between Calculation Sheet and Data Sheet formats.",
     version="1.0.0",
+    lifespan=lifespan,
 )
+# Added first so MetricsMiddleware (added last, outermost) also counts the 413s.
+app.add_middleware(RequestSizeLimitMiddleware, limits={"/batch/": MAX_BATCH_BYTES}, registry=METRICS)
+app.add_middleware(MetricsMiddleware, registry=METRICS, endpoints=INSTRUMENTED_ENDPOINTS)
 
-# --- Configuration ---
-DEFAULT_DATA_SHEET_TEMPLATE_PATH = "Data Sheet.xlsm"
-DEFAULT_CALC_SHEET_TEMPLATE_PATH = "Calculation Sheet.xlsm"
+def _rejection(error):
+    """Count a GuardrailError on the active Trace and turn it into an HTTP error."""
+    record_rejection(error.reason)
+    return error.to_http()
 
-TEMP_DIR = Path(tempfile.gettempdir()) / "fastapi_excel_processor_temp"
-TEMP_DIR.mkdir(parents=True, exist_ok=True)
+async def _inspect_upload(upload, label=None):
+    """Guardrail checks of an uploaded workbook (see guardrails.py). Returns its cost in cells."""
+    try:
+        with stage("inspect"):
+            cost = await run_in_threadpool(inspect_workbook, upload, label)
+    except GuardrailError as e:
+        raise _rejection(e)
+    return cost.cells
+
+def _check_cost(cost, label):
+    """check_cost() with the rejection counted and turned into an HTTP error."""
+    try:
+        check_cost(cost, label)
+    except GuardrailError as e:
+        raise _rejection(e)
+
+def _count_header_layout_lookups(worker_trace):
+    counts = (worker_trace or {}).get("counts", {})
+    HEADER_LAYOUT_LOOKUPS["hits"] += counts.get("header_layout_hits", 0)
+    HEADER_LAYOUT_LOOKUPS["misses"] += counts.get("header_layout_misses", 0)
+
+async def _run_conversion(fn, *args, cost=0):
+    """
+    Run a pipeline function in the executor and translate its errors to HTTP errors.
+    `cost` (estimated cells) is admitted against the ADMISSION budget first.
+    """
+    try:
+        async with ADMISSION.admit(cost):
+            with stage("executor"):
+                result, worker_trace = await CONVERSION_EXECUTOR.run(traced_call, fn, *args)
+    except GuardrailError as e:
+        raise _rejection(e)
+    except ExecutorBusyError as e:
+        record_error(e)
+        record_rejection("executor_busy")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy converting other files. Please retry later.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except ConversionError as e:
+        _count_header_layout_lookups(getattr(e, "trace_export", None))
+        merge_trace(getattr(e, "trace_export", None))
+        record_error(e)
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except Exception as e:
+        _count_header_layout_lookups(getattr(e, "trace_export", None))
+        merge_trace(getattr(e, "trace_export", None))
+        raise
+    _count_header_layout_lookups(worker_trace)
+    merge_trace(worker_trace)
+    return result
+
+async def _cached_conversion(cache_key, fn, upload, cost=None, label=None):
+    """
+    Serve a conversion from RESULT_CACHE, or run it and cache the output.
+    Uploads are inspected (guardrails.py) only when they have to be converted,
+    unless their `cost` is already known.
+    Returns:
+        tuple: (output bytes, X-Cache header value)
+    """
+    if not RESULT_CACHE.enabled:
+        if cost is None:
+            cost = await _inspect_upload(upload, label)
+        return await _run_conversion(fn, upload, cost=cost), "BYPASS"
+
+    with stage("cache_lookup"):
+        output_bytes, _ = await run_in_threadpool(RESULT_CACHE.get, cache_key)
+    if output_bytes is not None:
+        return output_bytes, "HIT"
+
+    if cost is None:
+        cost = await _inspect_upload(upload, label)
+    output_bytes = await _run_conversion(fn, upload, cost=cost)
+    with stage("cache_store"):
+        await run_in_threadpool(RESULT_CACHE.put, cache_key, output_bytes)
+    return output_bytes, "MISS"
+
+def _not_modified(etag):
+    # The ETag is a content address of the output, so a match needs no conversion at all.
+    return Response(status_code=304, headers={"ETag": etag, "X-Cache": "HIT"})
+
+@app.get("/health", summary="Health check")
+def health():
+    """
+    Returns service liveness, conversion executor load and the admission budget.
+    """
+    return {"status": "ok", "executor": CONVERSION_EXECUTOR.stats(), "admission": ADMISSION.stats(), "jobs": get_job_store().stats()}
+
+@app.get("/ready", summary="Readiness check")
+def ready():
+    """
+    Returns 200 once this worker has its templates parsed and its executor and job
+    runner started, and 503 before that and while shutting down. Point load balancer
+    readiness probes here rather than at /health.
+    """
+    warm = CALC_SHEET_TEMPLATE_CACHE.sha256 is not None and (
+        DATA_SHEET_PATCH_TEMPLATE_CACHE.sha256 is not None or DATA_SHEET_TEMPLATE_POOL.sha256 is not None
+    )
+    body = {"status": "ready" if READY and warm else "starting", "pid": os.getpid(), "preforked": PREFORKED, "templates_warm": warm}
+    return JSONResponse(body, status_code=200 if READY and warm else 503)
+
+@app.get("/templates/stats", summary="Template cache statistics")
+def template_stats():
+    """
+    Returns hit/miss/reload counters of the template caches in the API process.
+    Process-pool workers keep their own caches.
+    """
+    return {
+        "data_sheet": DATA_SHEET_TEMPLATE_POOL.stats(),
+        "data_sheet_xml": DATA_SHEET_PATCH_TEMPLATE_CACHE.stats(),
+        "calc_sheet": CALC_SHEET_TEMPLATE_CACHE.stats(),
+    }
+
+@app.get("/metrics", summary="Prometheus metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Returns request counts, per-stage latency histograms, record counts, bytes in/out
+    and error classes of the conversion endpoints in the Prometheus text format.
+    """
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/cache/stats", summary="Conversion result cache statistics")
+def result_cache_stats():
+    """
+    Returns size, hit and eviction counters of the conversion result cache.
+    """
+    return RESULT_CACHE.stats()
+
+@app.get("/debug/header-layouts", summary="Calculation Sheet header layout cache")
+async def header_layouts_debug():
+    """
+    Returns the hit rate of the Calculation Sheet header cache over every conversion
+    worker of this server process, without taking an executor slot.
+    The resolved row layouts are listed when conversions run in threads of this process;
+    with a process pool each worker holds its own copy.
+    """
+    lookups = HEADER_LAYOUT_LOOKUPS["hits"] + HEADER_LAYOUT_LOOKUPS["misses"]
+    stats = {
+        "pid": os.getpid(),
+        "executor": CONVERSION_EXECUTOR.kind or CONVERSION_EXECUTOR.requested_kind,
+        "workers": CONVERSION_EXECUTOR.max_workers,
+        "hits": HEADER_LAYOUT_LOOKUPS["hits"],
+        "misses": HEADER_LAYOUT_LOOKUPS["misses"],
+        "hit_rate": HEADER_LAYOUT_LOOKUPS["hits"] / lookups if lookups else None,
+    }
+    if CONVERSION_EXECUTOR.kind == "thread":
+        local = header_layout_stats()
+        stats.update(entries=local["entries"], max_entries=local["max_entries"], layouts=local["layouts"])
+    return stats
 
 @app.post("/calc2data/", summary="Convert Calculation Sheet to Data Sheet")
-async def calc2data_endpoint(calc_sheet_file: UploadFile = File(..., description="The Calculation Sheet Excel file (.xlsm)")):
+async def calc2data_endpoint(
+    calc_sheet_file: UploadFile = File(..., description="The Calculation Sheet Excel file (.xlsm)"),
+    if_none_match: Optional[str] = Header(None),
+):
     """
     Processes an uploaded Calculation Sheet Excel file and fills a Data Sheet template.
     Returns the filled Data Sheet Excel file.
+    Repeated uploads are served from the result cache; send the returned ETag
+    in If-None-Match to get 304 Not Modified instead of the file.
     """
-    temp_calc_sheet_path = None
-    output_stream = io.BytesIO() 
+    upload = None
 
     try:
-        temp_calc_sheet_path = TEMP_DIR / f"uploaded_calc_{calc_sheet_file.filename}"
-        with temp_calc_sheet_path.open("wb") as buffer:
-            shutil.copyfileobj(calc_sheet_file.file, buffer)
+        # Parsed straight from memory; only uploads above PSV_UPLOAD_SPILL_BYTES touch TEMP_DIR.
+        with stage("upload"):
+            upload = await receive_upload(calc_sheet_file, TEMP_DIR)
+        record("bytes_in", upload.size)
 
-        try:
-            # Assumes 'PSV' is the sheet name in Calculation Sheet for calc2data conversion
-            calc_df = pd.read_excel(temp_calc_sheet_path, sheet_name="PSV", header=None)
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Error reading Calculation Sheet: {e}. Ensure 'PSV' sheet exists and format is correct.")
-
-        result_from_calc2data = convert_calc_to_data_sheet(calc_df, DEFAULT_DATA_SHEET_TEMPLATE_PATH, output_stream)
-        
-        if not result_from_calc2data:
-            raise HTTPException(status_code=500, detail="Excel conversion (Calc to Data) failed. Check server logs for details.")
-        
-        output_stream.seek(0)
+        cache_key = await run_in_threadpool(conversion_cache_key, "calc2data", upload.sha256)
+        etag = f'"{cache_key}"'
+        if etag_matches(if_none_match, etag) and await run_in_threadpool(RESULT_CACHE.contains, cache_key):
+            return _not_modified(etag)
+
+        output_bytes, cache_status = await _cached_conversion(cache_key, run_calc2data, upload)
+        record("bytes_out", len(output_bytes))
 
         return StreamingResponse(
-            output_stream, 
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", 
-            headers={"Content-Disposition": f"attachment; filename=Data_Sheet_filled_{Path(calc_sheet_file.filename).stem}.xlsm"}
+            io.BytesIO(output_bytes),
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers={
+                "Content-Disposition": f"attachment; filename=Data_Sheet_filled_{Path(calc_sheet_file.filename).stem}.xlsm",
+                "ETag": etag,
+                "X-Cache": cache_status,
+            },
         )
 
     except HTTPException as e:
-        raise e 
-    except FileNotFoundError:
+        raise e
+    except FileNotFoundError as e:
+        record_error(e)
         raise HTTPException(status_code=404, detail=f"Required template file not found at '{DEFAULT_DATA_SHEET_TEMPLATE_PATH}'.")
     except Exception as e:
-        print(f"An unexpected error occurred in /calc2data/: {e}") 
+        record_error(e)
+        print(f"An unexpected error occurred in /calc2data/: {e}")
         raise HTTPException(status_code=500, detail=f"An internal server error occurred: {e}")
     finally:
-        if temp_calc_sheet_path and temp_calc_sheet_path.exists():
-            temp_calc_sheet_path.unlink()
+        if upload is not None:
+            upload.cleanup()
 
 @app.post("/data2calc/", summary="Convert Data Sheet to Calculation Sheet")
-async def data2calc_endpoint(data_sheet_file: UploadFile = File(..., description="The Data Sheet Excel file (.xlsm)")):
+async def data2calc_endpoint(
+    data_sheet_file: UploadFile = File(..., description="The Data Sheet Excel file (.xlsm)"),
+    if_none_match: Optional[str] = Header(None),
+):
     """
     Processes an uploaded Data Sheet Excel file and fills a Calculation Sheet template.
     Returns the filled Calculation Sheet Excel file.
+    Repeated uploads are served from the result cache; send the returned ETag
+    in If-None-Match to get 304 Not Modified instead of the file.
     """
-    temp_data_sheet_path = None
-    output_stream = io.BytesIO() 
+    upload = None
 
     try:
-        temp_data_sheet_path = TEMP_DIR / f"uploaded_data_{data_sheet_file.filename}"
-        with temp_data_sheet_path.open("wb") as buffer:
-            shutil.copyfileobj(data_sheet_file.file, buffer)
-
-        try:
-            data_df = pd.read_excel(temp_data_sheet_path, sheet_name="FORM", header=None)
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Error reading Data Sheet: {e}. Ensure 'FORM' sheet exists and format is correct.")
-
-        try:
-            calc_sheet_template_df = pd.read_excel(DEFAULT_CALC_SHEET_TEMPLATE_PATH, sheet_name="PSV", header=None)
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Error reading Calculation Sheet template: {e}. Ensure '{DEFAULT_CALC_SHEET_TEMPLATE_PATH}' with sheet 'PSV' exists and is accessible.")
+        # Parsed straight from memory; only uploads above PSV_UPLOAD_SPILL_BYTES touch TEMP_DIR.
+        with stage("upload"):
+            upload = await receive_upload(data_sheet_file, TEMP_DIR)
+        record("bytes_in", upload.size)
 
-        result_df = convert_data_to_calc_sheet(data_df, calc_sheet_template_df)
-        
-        if not isinstance(result_df, pd.DataFrame):
-            raise HTTPException(status_code=500, detail="Excel conversion (Data to Calc) failed: Core logic did not return a DataFrame.")
-
-        try:
-            result_df.to_excel(output_stream, index=False, header=False, engine='openpyxl')
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error writing converted DataFrame to Excel stream: {e}")
+        cache_key = await run_in_threadpool(conversion_cache_key, "data2calc", upload.sha256)
+        etag = f'"{cache_key}"'
+        if etag_matches(if_none_match, etag) and await run_in_threadpool(RESULT_CACHE.contains, cache_key):
+            return _not_modified(etag)
 
-        output_stream.seek(0)
+        output_bytes, cache_status = await _cached_conversion(cache_key, run_data2calc, upload)
+        record("bytes_out", len(output_bytes))
 
         return StreamingResponse(
-            output_stream, 
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", 
-            headers={"Content-Disposition": f"attachment; filename=Calculation_Sheet_filled_{Path(data_sheet_file.filename).stem}.xlsx"}
+            io.BytesIO(output_bytes),
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers={
+                "Content-Disposition": f"attachment; filename=Calculation_Sheet_filled_{Path(data_sheet_file.filename).stem}.xlsx",
+                "ETag": etag,
+                "X-Cache": cache_status,
+            },
         )
 
     except HTTPException as e:
         raise e
-    except FileNotFoundError:
+    except FileNotFoundError as e:
+        record_error(e)
         raise HTTPException(status_code=404, detail=f"Required template file not found at '{DEFAULT_CALC_SHEET_TEMPLATE_PATH}'.")
     except Exception as e:
+        record_error(e)
         print(f"An unexpected error occurred in /data2calc/: {e}")
         raise HTTPException(status_code=500, detail=f"An internal server error occurred: {e}")
     finally:
-        if temp_data_sheet_path and temp_data_sheet_path.exists():
-            temp_data_sheet_path.unlink()
\ No newline at end of file
+        if upload is not None:
+            upload.cleanup()
+
+@app.post("/data2calc/update", summary="Update a filled Calculation Sheet from a revised Data Sheet")
+async def data2calc_update_endpoint(
+    calc_sheet_file: UploadFile = File(..., description="The filled Calculation Sheet to update (.xlsx/.xlsm)"),
+    data_sheet_file: UploadFile = File(..., description="The revised Data Sheet Excel file (.xlsm)"),
+    output: str = Query("workbook", description="'workbook' for the updated Calculation Sheet, 'summary' for the change summary only"),
+):
+    """
+    Matches the tag columns of the Calculation Sheet to the Data Sheet records by Tag No.
+    and occurrence of the tag (one record per relief case) and rewrites only the mapped
+    cells whose value changed; new records are appended as new columns and columns without
+    a record are reported but kept. Formulas, styles,
+    other sheets and the VBA project are left as they are.
+    Returns the updated workbook in the Calculation Sheet's own format with the change
+    counts in the X-Change-Summary header, or the full change summary (JSON) with output=summary.
+    """
+    if output not in ("workbook", "summary"):
+        raise HTTPException(status_code=400, detail=f"Invalid output '{output}'. Use 'workbook' or 'summary'.")
+    uploads = []
+
+    try:
+        with stage("upload"):
+            for upload_file in (calc_sheet_file, data_sheet_file):
+                uploads.append(await receive_upload(upload_file, TEMP_DIR))
+        calc_upload, data_upload = uploads
+        record("bytes_in", calc_upload.size + data_upload.size)
+
+        cost = await _inspect_upload(calc_upload) + await _inspect_upload(data_upload)
+        _check_cost(cost, "The Calculation Sheet and Data Sheet")
+        output_bytes, summary = await _run_conversion(
+            run_data2calc_update, calc_upload, data_upload, output == "workbook", cost=cost
+        )
+        if output == "summary":
+            return JSONResponse(summary)
+        record("bytes_out", len(output_bytes))
+
+        filename = Path(calc_sheet_file.filename or "Calculation_Sheet.xlsm").name
+        return Response(
+            output_bytes,
+            media_type=EXCEL_MEDIA_TYPE,
+            headers={
+                "Content-Disposition": f"attachment; filename=updated_{filename}",
+                "X-Change-Summary": json.dumps(summary_counts(summary)),
+            },
+        )
+
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        record_error(e)
+        print(f"An unexpected error occurred in /data2calc/update: {e}")
+        raise HTTPException(status_code=500, detail=f"An internal server error occurred: {e}")
+    finally:
+        for upload in uploads:
+            upload.cleanup()
+
+@app.post("/sizing/", summary="Size the PSVs of a Data Sheet or Calculation Sheet")
+async def sizing_endpoint(
+    file: UploadFile = File(..., description="A Data Sheet (.xlsm) or Calculation Sheet (.xlsx/.xlsm)"),
+    output: str = Query("json", description="Result format: 'json', 'csv' or 'parquet'"),
+):
+    """
+    Computes the API 520 required orifice area, the correction factors and the selected
+    standard orifice of every tag natively, as the Calculation Sheet's Calculation macro
+    would, without opening the workbook in Excel. The workbook type is detected from its
+    sheets; a Data Sheet is mapped onto Calculation Sheet rows first, as /data2calc/ does.
+    """
+    if output not in RECORD_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Invalid output '{output}'. Use one of: {', '.join(RECORD_MEDIA_TYPES)}.")
+    upload = None
+
+    try:
+        with stage("upload"):
+            upload = await receive_upload(file, TEMP_DIR)
+        record("bytes_in", upload.size)
+
+        cost = await _inspect_upload(upload)
+        output_bytes = await _run_conversion(run_sizing, upload, output, cost=cost)
+        record("bytes_out", len(output_bytes))
+        return Response(output_bytes, media_type=RECORD_MEDIA_TYPES[output])
+
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        record_error(e)
+        print(f"An unexpected error occurred in /sizing/: {e}")
+        raise HTTPException(status_code=500, detail=f"An internal server error occurred: {e}")
+    finally:
+        if upload is not None:
+            upload.cleanup()
+
+async def _convert_batch_item(item, mode, batch_dir):
+    """
+    Convert one workbook of a batch.
+    Returns:
+        tuple: (manifest entry, output bytes or None if the conversion failed)
+    """
+    start = time.perf_counter()
+    entry = {"source": item.source, "conversion": None if mode == "auto" else mode}
+    payload = None
+    try:
+        payload = await run_in_threadpool(item.load, batch_dir)
+        entry["input_bytes"] = payload.size
+        cost = None
+        if mode == "auto":
+            # Checked before detect_conversion() opens the workbook.
+            cost = await _inspect_upload(payload, item.source)
+            entry["conversion"] = await run_in_threadpool(detect_conversion, payload)
+
+        cache_key = await run_in_threadpool(conversion_cache_key, entry["conversion"], payload.sha256)
+        fn = CONVERSIONS[entry["conversion"]]
+        for attempt in range(BATCH_BUSY_RETRIES + 1):
+            try:
+                output_bytes, cache_status = await _cached_conversion(cache_key, fn, payload, cost=cost, label=item.source)
+                break
+            except HTTPException as e:
+                # Other requests filled the executor queue; wait our turn rather than fail the file.
+                if e.status_code != 503 or attempt == BATCH_BUSY_RETRIES:
+                    raise
+                await asyncio.sleep(CONVERSION_EXECUTOR.retry_after)
+    except HTTPException as e:
+        entry.update(status="error", error={"status_code": e.status_code, "detail": e.detail})
+        output_bytes = None
+    except ConversionError as e:
+        record_error(e)
+        entry.update(status="error", error={"status_code": e.status_code, "detail": e.detail})
+        output_bytes = None
+    except Exception as e:
+        record_error(e)
+        print(f"An unexpected error occurred in /batch/ for '{item.source}': {e}")
+        entry.update(status="error", error={"status_code": 500, "detail": f"An internal server error occurred: {e}"})
+        output_bytes = None
+    else:
+        record("bytes_out", len(output_bytes))
+        entry.update(status="ok", output_bytes=len(output_bytes), etag=f'"{cache_key}"', cache=cache_status)
+    finally:
+        if payload is not None:
+            payload.cleanup()
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+    return entry, output_bytes
+
+@app.post("/batch/", summary="Convert many workbooks in one request")
+async def batch_endpoint(
+    files: List[UploadFile] = File(..., description="Data Sheets and/or Calculation Sheets, or .zip archives of them"),
+    mode: str = Form("auto", description="'auto' (detect from the sheet names), 'calc2data' or 'data2calc'"),
+):
+    """
+    Converts every uploaded workbook (and every workbook inside uploaded .zip archives)
+    in parallel on the conversion executor.
+    Streams back a zip: each converted workbook is added as soon as it is ready,
+    followed by manifest.json with the status, output name, cache status and
+    timing of every input file. Failed files are reported in the manifest
+    instead of failing the batch.
+    """
+    if mode not in ("auto", *CONVERSIONS):
+        raise HTTPException(status_code=400, detail=f"Invalid mode '{mode}'. Use 'auto', 'calc2data' or 'data2calc'.")
+
+    batch_dir = Path(tempfile.mkdtemp(prefix="batch_", dir=TEMP_DIR))
+    cleanup = functools.partial(shutil.rmtree, batch_dir, ignore_errors=True)
+    streaming = False
+
+    try:
+        # Uploads are closed when this function returns, before the response is streamed,
+        # so they are moved to batch_dir first (spill threshold 0: nothing is held in memory).
+        with stage("upload"):
+            payloads = [await receive_upload(f, batch_dir, spill_threshold=0) for f in files]
+        record("bytes_in", sum(payload.size for payload in payloads))
+
+        try:
+            # Archives are checked from their central directory before anything is extracted.
+            for payload in payloads:
+                if (payload.filename or "").lower().endswith(ARCHIVE_SUFFIX):
+                    await run_in_threadpool(check_archive, payload)
+            items = await run_in_threadpool(list_batch_items, payloads)
+        except GuardrailError as e:
+            raise _rejection(e)
+        except zipfile.BadZipFile as e:
+            raise HTTPException(status_code=400, detail=f"Invalid zip archive: {e}")
+        if not items:
+            raise HTTPException(status_code=400, detail="No workbooks (.xlsx, .xlsm, .xls) found in the upload.")
+        if len(items) > BATCH_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"A batch may contain at most {BATCH_MAX_FILES} workbooks (got {len(items)}).")
+
+        # The stream removes batch_dir when it ends; in-flight conversions are capped at the
+        # worker count, so memory does not grow with the batch size.
+        response = StreamingResponse(
+            stream_batch(
+                items,
+                lambda item: _convert_batch_item(item, mode, batch_dir),
+                max_in_flight=CONVERSION_EXECUTOR.max_workers,
+                cleanup=cleanup,
+            ),
+            media_type="application/zip",
+            headers={"Content-Disposition": "attachment; filename=batch_results.zip"},
+        )
+        streaming = True
+        return response
+
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        record_error(e)
+        print(f"An unexpected error occurred in /batch/: {e}")
+        raise HTTPException(status_code=500, detail=f"An internal server error occurred: {e}")
+    finally:
+        if not streaming:
+            cleanup()
+
+async def _convert_job(job):
+    """Run a queued job through the result cache and the executor, reporting progress to the job store."""
+    job_store = get_job_store()
+    payload = UploadPayload(job["filename"], job["input_bytes"], job["input_sha256"], path=job_store.input_path(job["id"]))
+    cache_key = await run_in_threadpool(conversion_cache_key, job["kind"], payload.sha256)
+    fn = functools.partial(run_with_progress, CONVERSIONS[job["kind"]], reporter=ProgressReporter(job_store.db_path, job["id"]))
+    return await _cached_conversion(cache_key, fn, payload)
+
+def get_job_runner():
+    """The job runner of this process, created (with the job store) on first use."""
+    global _job_runner
+    job_store = get_job_store()
+    if _job_runner is None:
+        with _jobs_lock:
+            if _job_runner is None:
+                _job_runner = JobRunner(
+                    job_store, _convert_job, JOB_CONCURRENCY, registry=METRICS, retry_after=CONVERSION_EXECUTOR.retry_after
+                )
+    return _job_runner
+
+async def _submit_job(kind, upload_file):
+    payload = None
+    job_store = await run_in_threadpool(get_job_store)
+    try:
+        # Spilled straight into the jobs directory, where create() takes it over.
+        payload = await receive_upload(upload_file, job_store.jobs_dir, spill_threshold=0)
+        # Refused before it is queued; the job re-inspects it for its admission cost.
+        await run_in_threadpool(inspect_workbook, payload)
+        job_id = await run_in_threadpool(job_store.create, kind, payload)
+    except GuardrailError as e:
+        payload.cleanup()
+        METRICS.observe_rejection(f"/jobs/{kind}", e.reason)
+        raise e.to_http()
+    except QueueFullError:
+        METRICS.observe_rejection(f"/jobs/{kind}", "queue_full")
+        raise HTTPException(
+            status_code=503,
+            detail="Too many conversion jobs are queued. Please retry later.",
+            headers={"Retry-After": str(CONVERSION_EXECUTOR.retry_after)},
+        )
+    except Exception as e:
+        if payload is not None:
+            payload.cleanup()
+        print(f"An unexpected error occurred in /jobs/{kind}: {e}")
+        raise HTTPException(status_code=500, detail=f"An internal server error occurred: {e}")
+    get_job_runner().notify()
+    return JSONResponse(
+        {"id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}", "result_url": f"/jobs/{job_id}/result"},
+        status_code=202,
+        headers={"Location": f"/jobs/{job_id}"},
+    )
+
+@app.post("/jobs/calc2data", summary="Queue a Calculation Sheet to Data Sheet conversion", status_code=202)
+async def calc2data_job(
+    calc_sheet_file: UploadFile = File(..., description="The Calculation Sheet Excel file (.xlsm)"),
+):
+    """
+    Queues the conversion and returns its job id at once (202 Accepted).
+    Poll GET /jobs/{id} for status and progress, then download GET /jobs/{id}/result.
+    """
+    return await _submit_job("calc2data", calc_sheet_file)
+
+@app.post("/jobs/data2calc", summary="Queue a Data Sheet to Calculation Sheet conversion", status_code=202)
+async def data2calc_job(
+    data_sheet_file: UploadFile = File(..., description="The Data Sheet Excel file (.xlsm)"),
+):
+    """
+    Queues the conversion and returns its job id at once (202 Accepted).
+    Poll GET /jobs/{id} for status and progress, then download GET /jobs/{id}/result.
+    """
+    return await _submit_job("data2calc", data_sheet_file)
+
+@app.get("/jobs", summary="Job queue statistics")
+async def job_queue_stats():
+    """
+    Returns job counts by status (queue depth) and the age of the oldest queued job.
+    """
+    job_store = await run_in_threadpool(get_job_store)
+    return await run_in_threadpool(job_store.stats)
+
+@app.get("/jobs/{job_id}", summary="Job status and progress")
+async def job_status(job_id: str):
+    """
+    Returns the status (queued, running, done, failed, expired), the current stage,
+    the number of PSV records and, while queued, the position in the queue.
+    """
+    job_store = await run_in_threadpool(get_job_store)
+    job = await run_in_threadpool(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found.")
+    return job_view(job)
+
+@app.get("/jobs/{job_id}/result", summary="Download a job's converted workbook")
+async def job_result(job_id: str):
+    """
+    Returns the converted workbook of a finished job.
+    409 while the job is queued or running, 410 once its result has expired;
+    a failed job answers with the status code and detail of its error.
+    """
+    job_store = await run_in_threadpool(get_job_store)
+    job = await run_in_threadpool(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found.")
+    if job["status"] in ("queued", "running"):
+        raise HTTPException(status_code=409, detail=f"Job '{job_id}' is {job['status']}.")
+    if job["status"] == "expired":
+        raise HTTPException(status_code=410, detail=f"The result of job '{job_id}' has expired.")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=job["error_status"], detail=job["error_detail"])
+
+    result_name = OUTPUT_NAMES[job["kind"]].format(stem=Path(job["filename"] or "upload").stem)
+    return FileResponse(
+        job_store.result_path(job_id),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        filename=result_name,
+    )
+
+async def _convert_records(request, fn, input_format, output, workbook_format, workbook_name):
+    if output not in RECORD_MEDIA_TYPES and output != workbook_format:
+        raise HTTPException(
+            status_code=400, detail=f"Invalid output '{output}'. Use json, csv, parquet or {workbook_format}."
+        )
+    try:
+        input_format = record_format(request.headers.get("content-type"), input_format)
+    except RecordFormatError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    with stage("upload"):
+        body = await request.body()
+    record("bytes_in", len(body))
+    cost = body_cost(len(body))
+    _check_cost(cost, "The request body")
+    output_bytes = await _run_conversion(fn, body, input_format, output, cost=cost)
+    record("bytes_out", len(output_bytes))
+
+    if output == workbook_format:
+        return Response(
+            output_bytes, media_type=EXCEL_MEDIA_TYPE,
+            headers={"Content-Disposition": f"attachment; filename={workbook_name}"},
+        )
+    return Response(output_bytes, media_type=RECORD_MEDIA_TYPES[output])
+
+@app.post("/records/calc2data", summary="Convert Calculation Sheet records to Data Sheet records")
+async def calc2data_records(
+    request: Request,
+    output: str = Query("json", description="json, csv, parquet, or xlsm for a filled Data Sheet"),
+    input_format: Optional[str] = Query(None, alias="input", description="json, csv or parquet (default: from Content-Type)"),
+):
+    """
+    Takes PSV records as the body (JSON list or {"records": [...]}, CSV or Parquet), keyed by
+    Calculation Sheet property names such as "Tag No.", "Set Pressure" or their sheet aliases.
+    Returns the Data Sheet records the same conversion writes into the FORM sheet, or the
+    filled Data Sheet workbook with output=xlsm. No workbook is parsed.
+    """
+    return await _convert_records(request, run_records_calc2data, input_format, output, "xlsm", "Data_Sheet_filled.xlsm")
+
+@app.post("/records/data2calc", summary="Convert Data Sheet records to Calculation Sheet records")
+async def data2calc_records(
+    request: Request,
+    output: str = Query("json", description="json, csv, parquet, or xlsx for a filled Calculation Sheet"),
+    input_format: Optional[str] = Query(None, alias="input", description="json, csv or parquet (default: from Content-Type)"),
+):
+    """
+    Takes Data Sheet records as the body (JSON list or {"records": [...]}, CSV or Parquet), one
+    per FORM record pair, keyed by Data Sheet field names such as "Tag No.", "Phase", "Flow Rate".
+    Returns the Calculation Sheet records (one per tag, keyed by PSV sheet property), or the
+    filled Calculation Sheet workbook with output=xlsx. No workbook is parsed.
+    """
+    return await _convert_records(request, run_records_data2calc, input_format, output, "xlsx", "Calculation_Sheet_filled.xlsx")
+
+def _record_store():
+    """The record store, opened on first use (blocking: call it in the threadpool)."""
+    store = get_record_store()
+    if store is None:
+        raise HTTPException(status_code=404, detail="The record store is switched off (PSV_RECORD_STORE).")
+    return store
+
+@app.get("/store/records", summary="Query stored PSV records")
+async def stored_records(
+    tag_no: Optional[str] = Query(None, description="Tag No."),
+    dwg_no: Optional[str] = Query(None, description="Dwg No."),
+    psv_type: Optional[str] = Query(None, description="PSV Type (C, B, P)"),
+    phase: Optional[str] = Query(None, description="Phase (V, L, S)"),
+    revision: Optional[str] = Query(None, description="Rev. No. of the Data Sheet record"),
+    workbook_id: Optional[int] = Query(None, description="Only records of this stored workbook"),
+    latest: bool = Query(False, description="Only the records (one per relief case) of each tag's most recently stored workbook"),
+    limit: int = Query(100, ge=1, le=RECORD_QUERY_MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Looks up the records saved by earlier /calc2data/ and /data2calc/ conversions (also
+    through /batch/ and /jobs/) without parsing any workbook. Filters are case-insensitive
+    exact matches and can be combined; results are newest first, with the total match count
+    for paging.
+    """
+    store = await run_in_threadpool(_record_store)
+    filters = {"tag_no": tag_no, "dwg_no": dwg_no, "psv_type": psv_type, "phase": phase, "revision": revision, "workbook_id": workbook_id}
+    total, records = await run_in_threadpool(store.query, filters, latest, limit, offset)
+    return {"total": total, "limit": limit, "offset": offset, "records": records}
+
+@app.get("/store/workbooks", summary="Workbooks in the record store")
+async def stored_workbooks(
+    limit: int = Query(100, ge=1, le=RECORD_QUERY_MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+):
+    """Lists the stored workbooks (one per distinct upload and conversion), newest first."""
+    store = await run_in_threadpool(_record_store)
+    total, workbooks = await run_in_threadpool(store.workbooks, limit, offset)
+    return {"total": total, "limit": limit, "offset": offset, "workbooks": workbooks}
+
+@app.get("/store/stats", summary="Record store statistics")
+async def record_store_stats():
+    store = await run_in_threadpool(_record_store)
+    return await run_in_threadpool(store.stats)
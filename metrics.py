@@ -0,0 +1,343 @@
+import contextvars
+import math
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Stage-level instrumentation.
+# Code marks its stages with `with stage("name"):` and reports quantities with
+# record(); both are no-ops unless a Trace is active. Conversions run in worker
+# processes, so traced_call() runs them under a Trace and ships it back with the
+# result; the API process merges it into the request's Trace, which feeds the
+# Server-Timing header and the Prometheus histograms served on /metrics.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+BYTE_BUCKETS = tuple(2 ** n for n in range(16, 32, 2))  # 64 KiB .. 1 GiB
+
+# PSV_TRACEMALLOC=1 records the peak allocation of the heavy stages below;
+# a comma-separated list of stage names selects stages explicitly.
+HEAVY_STAGES = ("read", "extract_records", "render", "cell_writes", "save", "map_properties", "write_excel")
+_tracemalloc_setting = os.environ.get("PSV_TRACEMALLOC", "0").strip()
+if _tracemalloc_setting in ("", "0"):
+    TRACEMALLOC_STAGES = frozenset()
+elif _tracemalloc_setting == "1":
+    TRACEMALLOC_STAGES = frozenset(HEAVY_STAGES)
+else:
+    TRACEMALLOC_STAGES = frozenset(s.strip() for s in _tracemalloc_setting.split(",") if s.strip())
+
+
+class Trace:
+    """Timings, counters and error classes collected for one request."""
+
+    def __init__(self):
+        self.stages = []        # (stage name, seconds), in completion order
+        self.counts = {}
+        self.peak_alloc = {}    # stage name -> peak traced bytes
+        self.errors = []
+        self.rejections = []    # guardrail reasons (see guardrails.py)
+        self.active_stage = None
+        self.on_update = None   # optional callable(trace), e.g. to report job progress
+
+    def begin_stage(self, name):
+        self.active_stage = name
+        if self.on_update is not None:
+            self.on_update(self)
+
+    def add_stage(self, name, seconds):
+        self.stages.append((name, seconds))
+        if self.on_update is not None:
+            self.on_update(self)
+
+    def add_count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + value
+        if self.on_update is not None:
+            self.on_update(self)
+
+    def export(self):
+        return {"stages": self.stages, "counts": self.counts, "peak_alloc": self.peak_alloc, "errors": self.errors, "rejections": self.rejections}
+
+    def merge(self, exported):
+        """Fold in a Trace exported by another process."""
+        if not exported:
+            return
+        self.stages.extend(exported["stages"])
+        for name, value in exported["counts"].items():
+            self.add_count(name, value)
+        for name, value in exported["peak_alloc"].items():
+            self.peak_alloc[name] = max(value, self.peak_alloc.get(name, 0))
+        self.errors.extend(exported["errors"])
+        self.rejections.extend(exported.get("rejections", []))
+
+    def stage_totals(self):
+        totals = {}
+        for name, seconds in self.stages:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def server_timing(self, total_seconds=None):
+        """Server-Timing header value, durations in milliseconds."""
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stage_totals().items()]
+        if total_seconds is not None:
+            parts.append(f"total;dur={total_seconds * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current_trace = contextvars.ContextVar("psv_trace", default=None)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def stage(name):
+    """Time a stage of the active Trace (and its peak allocation, if enabled)."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    track_alloc = name in TRACEMALLOC_STAGES
+    if track_alloc:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+    trace.begin_stage(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_stage(name, time.perf_counter() - start)
+        if track_alloc:
+            _, peak = tracemalloc.get_traced_memory()
+            trace.peak_alloc[name] = max(peak - base, trace.peak_alloc.get(name, 0))
+
+
+def record(name, value):
+    """Add to a counter of the active Trace (records, bytes_in, bytes_out ...)."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_count(name, value)
+
+
+def record_rejection(reason):
+    """Note a request refused by a guardrail (upload_size, zip_ratio, cost, admission ...) on the active Trace."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.rejections.append(reason)
+
+
+def record_error(error):
+    """Note the class of an error (exception or class name) on the active Trace."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.errors.append(error if isinstance(error, str) else type(error).__name__)
+
+
+@contextmanager
+def tracing(trace=None):
+    """Make trace (or a new Trace) the active one within the block."""
+    trace = trace if trace is not None else Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def traced_call(fn, *args):
+    """
+    Run fn(*args) under a fresh Trace, e.g. inside an executor worker.
+    Returns:
+        tuple: (result, exported trace). On failure the exported trace is
+        attached to the exception as `trace_export`.
+    """
+    with tracing() as trace:
+        try:
+            result = fn(*args)
+        except Exception as e:
+            e.trace_export = trace.export()
+            raise
+    return result, trace.export()
+
+
+def merge_trace(exported):
+    """Fold a trace exported by traced_call() into the active Trace, if any."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.merge(exported)
+
+
+# --- Prometheus exposition ---
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+
+    def inc(self, value=1, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        self._values[key] = self._values.get(key, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(zip(self.label_names, key))} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._values = {}   # label values -> [bucket counts, sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (bucket_counts, total, count) in sorted(self._values.items()):
+            labels = list(zip(self.label_names, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Request metrics of the API process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter("psv_requests_total", "HTTP requests by endpoint and status code.", ("endpoint", "status"))
+        self.request_seconds = Histogram("psv_request_duration_seconds", "End-to-end request latency.", ("endpoint",))
+        self.stage_seconds = Histogram("psv_stage_duration_seconds", "Latency of one processing stage.", ("endpoint", "stage"))
+        self.records = Histogram("psv_records_per_request", "PSV records converted per request.", ("endpoint",), COUNT_BUCKETS)
+        self.bytes_in = Counter("psv_bytes_in_total", "Uploaded bytes.", ("endpoint",))
+        self.bytes_out = Counter("psv_bytes_out_total", "Bytes of converted workbooks returned.", ("endpoint",))
+        self.errors = Counter("psv_errors_total", "Errors by class.", ("endpoint", "error_class"))
+        self.rejections = Counter("psv_rejections_total", "Requests refused by the resource guardrails.", ("endpoint", "reason"))
+        self.peak_alloc = Histogram(
+            "psv_stage_peak_alloc_bytes", "Peak traced allocation of a stage (PSV_TRACEMALLOC).", ("endpoint", "stage"), BYTE_BUCKETS
+        )
+        self._collectors = []
+
+    def add_collector(self, collector):
+        """Register a callable returning extra exposition lines (e.g. gauges) at scrape time."""
+        self._collectors.append(collector)
+
+    def observe_request(self, endpoint, status, seconds, trace):
+        with self._lock:
+            self.requests.inc(endpoint=endpoint, status=str(status))
+            self.request_seconds.observe(seconds, endpoint=endpoint)
+            for name, stage_seconds in trace.stage_totals().items():
+                self.stage_seconds.observe(stage_seconds, endpoint=endpoint, stage=name)
+            for name, peak in trace.peak_alloc.items():
+                self.peak_alloc.observe(peak, endpoint=endpoint, stage=name)
+            if "records" in trace.counts:
+                self.records.observe(trace.counts["records"], endpoint=endpoint)
+            if trace.counts.get("bytes_in"):
+                self.bytes_in.inc(trace.counts["bytes_in"], endpoint=endpoint)
+            if trace.counts.get("bytes_out"):
+                self.bytes_out.inc(trace.counts["bytes_out"], endpoint=endpoint)
+            for error_class in trace.errors:
+                self.errors.inc(endpoint=endpoint, error_class=error_class)
+            for reason in trace.rejections:
+                self.rejections.inc(endpoint=endpoint, reason=reason)
+
+    def observe_rejection(self, endpoint, reason):
+        """Count a rejection of a request that is not traced."""
+        with self._lock:
+            self.rejections.inc(endpoint=endpoint, reason=reason)
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for metric in (
+                self.requests, self.request_seconds, self.stage_seconds, self.records,
+                self.bytes_in, self.bytes_out, self.errors, self.rejections, self.peak_alloc,
+            ):
+                lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                print(f"WARNING: Metrics collector failed: {e}")
+        return "\n".join(lines) + "\n"
+
+
+def gauge_lines(name, help_text, value, labels=()):
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name}{_format_labels(labels)} {_format_value(value)}"]
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: runs each HTTP request under a Trace, adds the Server-Timing
+    header and records the request in the registry. Only paths in `endpoints`
+    are recorded, so scrapes and health checks do not skew the histograms.
+    """
+
+    def __init__(self, app, registry, endpoints):
+        self.app = app
+        self.registry = registry
+        self.endpoints = set(endpoints)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.endpoints:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        with tracing() as trace:
+            async def send_with_timing(message):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    header = trace.server_timing(time.perf_counter() - start).encode("latin-1")
+                    message = dict(message, headers=list(message.get("headers", [])) + [(b"server-timing", header)])
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_timing)
+            except Exception as e:
+                record_error(e)
+                raise
+            finally:
+                self.registry.observe_request(scope["path"], status, time.perf_counter() - start, trace)
@@ -0,0 +1,497 @@
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import zipfile
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from calc2data import (
+    DATA_SHEET_FORM_START_ROW,
+    build_write_plan,
+    convert_calc_to_data_sheet,
+    extract_psv_records,
+    load_data_sheet_patch_template,
+    load_data_sheet_template,
+    resolve_property_rows,
+    restore_form_block,
+    snapshot_form_block,
+)
+from calc_update import plan_update
+from data2calc import CALC_SHEET_MAPPING, convert_data_to_calc_sheet, map_calc_sheet_block
+from metrics import record, stage
+from record_store import RECORD_STORE_ENABLED, RecordStore
+from records import (
+    DATA_SHEET_FIELDS,
+    RecordFormatError,
+    calc_record_fields,
+    calc_sheet_records,
+    data_sheet_frame,
+    data_sheet_records,
+    parse_records,
+    psv_records_frame,
+    render_records,
+)
+from sizing import load_sizing_tables, psv_sheet_inputs, sheet_inputs, size_psvs
+from template_cache import TemplateCache, WorkbookTemplatePool
+from uploads import UploadPayload
+from xlsx_reader import SheetNotFoundError, find_sheet_path, read_form_sheet, read_psv_sheet, read_sheet
+from xlsx_writer import SheetPatchTemplate, UnsupportedTemplateError
+
+# --- Configuration ---
+DEFAULT_DATA_SHEET_TEMPLATE_PATH = "Data Sheet.xlsm"
+DEFAULT_CALC_SHEET_TEMPLATE_PATH = "Calculation Sheet.xlsm"
+TEMPLATE_POOL_MAX_IDLE = int(os.environ.get("PSV_TEMPLATE_POOL_MAX_IDLE", "2"))
+# Read uploads with the lean single-sheet reader (xlsx_reader.py) instead of pd.read_excel.
+USE_LEAN_READER = os.environ.get("PSV_LEAN_READER", "1") != "0"
+# Write the Data Sheet by patching the FORM sheet XML (xlsx_writer.py) instead of saving through openpyxl.
+USE_XML_WRITER = os.environ.get("PSV_XML_WRITER", "1") != "0"
+
+# Bump whenever a change to the converters alters their output for the same input,
+# so results cached under the old version are no longer served.
+CONVERTER_VERSION = "2"  # 2: /data2calc/ keeps a last record whose second row was trimmed
+
+# --- Template Caches ---
+# Templates are parsed once per process and every conversion works on its own isolated copy.
+DATA_SHEET_TEMPLATE_POOL = WorkbookTemplatePool(
+    DEFAULT_DATA_SHEET_TEMPLATE_PATH,
+    loader=load_data_sheet_template,
+    snapshot=snapshot_form_block,
+    restore=restore_form_block,
+    max_idle=TEMPLATE_POOL_MAX_IDLE,
+)
+# The compiled patch template is immutable, so every request shares the same instance.
+DATA_SHEET_PATCH_TEMPLATE_CACHE = TemplateCache(
+    DEFAULT_DATA_SHEET_TEMPLATE_PATH,
+    loader=load_data_sheet_patch_template,
+    copier=lambda template: template,
+)
+CALC_SHEET_TEMPLATE_CACHE = TemplateCache(
+    DEFAULT_CALC_SHEET_TEMPLATE_PATH,
+    loader=lambda f: read_sheet(f, "PSV") if USE_LEAN_READER else pd.read_excel(f, sheet_name="PSV", header=None),
+    copier=lambda df: df.copy(),
+)
+# Orifice and KSH tables for native sizing; read-only, so shared like the patch template.
+SIZING_TABLES_CACHE = TemplateCache(
+    DEFAULT_CALC_SHEET_TEMPLATE_PATH,
+    loader=load_sizing_tables,
+    copier=lambda tables: tables,
+)
+
+# Normalized records of every converted workbook (see record_store.py), opened by
+# get_record_store() on first use so importing this module creates no database.
+_record_store = None
+_record_store_lock = threading.Lock()
+
+
+class ConversionError(Exception):
+    """A conversion failure that maps onto an HTTP status code."""
+
+    def __init__(self, status_code, detail):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def get_record_store():
+    """The record store of this process, or None when it is switched off (PSV_RECORD_STORE=off)."""
+    global _record_store
+    if _record_store is None and RECORD_STORE_ENABLED:
+        with _record_store_lock:
+            if _record_store is None:
+                _record_store = RecordStore.from_env()
+    return _record_store
+
+
+def warm_templates():
+    """Pre-load the template caches of the current process."""
+    data_sheet_cache = DATA_SHEET_PATCH_TEMPLATE_CACHE if USE_XML_WRITER else DATA_SHEET_TEMPLATE_POOL
+    for cache in (data_sheet_cache, CALC_SHEET_TEMPLATE_CACHE, SIZING_TABLES_CACHE):
+        try:
+            cache.warm()
+        except Exception as e:
+            print(f"WARNING: Could not pre-load template '{cache.path}': {e}")
+    # Uploads keep the template's property rows, so its PSV header layout is resolved up front.
+    try:
+        resolve_property_rows(CALC_SHEET_TEMPLATE_CACHE.get().to_numpy(dtype=object)[:, 1])
+    except Exception as e:
+        print(f"WARNING: Could not resolve the PSV header layout of '{CALC_SHEET_TEMPLATE_CACHE.path}': {e}")
+
+
+def conversion_cache_key(kind, upload_sha256):
+    """
+    Content address of a conversion result.
+    Args:
+        kind (str): 'calc2data' or 'data2calc'.
+        upload_sha256 (str): SHA-256 of the uploaded workbook.
+    Returns:
+        str: Hex digest of upload hash + template hash + converter version.
+    """
+    if kind == "calc2data":
+        template_cache = DATA_SHEET_PATCH_TEMPLATE_CACHE if USE_XML_WRITER else DATA_SHEET_TEMPLATE_POOL
+        variant = "xml" if USE_XML_WRITER else "openpyxl"
+    elif kind == "data2calc":
+        template_cache = CALC_SHEET_TEMPLATE_CACHE
+        variant = "openpyxl"
+    else:
+        raise ValueError(f"Unknown conversion '{kind}'")
+    material = "\x1f".join([kind, upload_sha256, template_cache.current_sha256(), CONVERTER_VERSION, variant])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def _open_source(source):
+    """Accept an UploadPayload, a path or a binary file object; a file opened here is closed on exit."""
+    if isinstance(source, UploadPayload):
+        with source.open() as f:
+            yield f
+    else:
+        yield source
+
+def _source_bytes(source):
+    if isinstance(source, UploadPayload):
+        return source.read_bytes()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return f.read()
+    return source.read()
+
+def _source_identity(source):
+    """(file name, SHA-256) of a conversion source."""
+    if isinstance(source, UploadPayload):
+        return source.filename, source.sha256
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.basename(source), hashlib.sha256(_source_bytes(source)).hexdigest()
+    position = source.tell()
+    digest = hashlib.sha256(source.read()).hexdigest()
+    source.seek(position)
+    return getattr(source, "name", None), digest
+
+def _store_records(kind, source, records_df):
+    """Save the records of a successful conversion to the record store; never fails the conversion."""
+    if not RECORD_STORE_ENABLED or records_df is None or records_df.empty:
+        return
+    try:
+        with stage("store"):
+            filename, sha256 = _source_identity(source)
+            get_record_store().save(kind, sha256, filename, records_df)
+    except (sqlite3.Error, OSError) as e:
+        print(f"WARNING: Could not store the records of '{kind}' conversion: {e}")
+
+def _read_sheet_block(source, sheet_name, lean_reader):
+    """Read the sheet block a converter needs, with the lean reader when possible."""
+    if USE_LEAN_READER:
+        try:
+            with _open_source(source) as f:
+                return lean_reader(f)
+        except zipfile.BadZipFile:
+            pass  # Not an OOXML package (e.g. legacy .xls); let pandas pick an engine.
+    with _open_source(source) as f:
+        return pd.read_excel(f, sheet_name=sheet_name, header=None)
+
+def detect_conversion(source):
+    """
+    Tell which conversion an uploaded workbook needs from its sheet names.
+    Args:
+        source: UploadPayload, path or binary file object of the workbook.
+    Returns:
+        str: 'data2calc' for a Data Sheet ('FORM' sheet), 'calc2data' for a Calculation Sheet ('PSV' sheet).
+    """
+    try:
+        with _open_source(source) as f, zipfile.ZipFile(f) as zf:
+            sheet_names = []
+            for sheet_name in ("FORM", "PSV"):
+                try:
+                    find_sheet_path(zf, sheet_name)
+                    sheet_names.append(sheet_name)
+                except SheetNotFoundError:
+                    pass
+    except zipfile.BadZipFile:
+        try:
+            with _open_source(source) as f:
+                sheet_names = pd.ExcelFile(f).sheet_names
+        except Exception as e:
+            raise ConversionError(400, f"Could not open workbook: {e}")
+    except Exception as e:
+        raise ConversionError(400, f"Could not open workbook: {e}")
+
+    if "FORM" in sheet_names:
+        return "data2calc"
+    if "PSV" in sheet_names:
+        return "calc2data"
+    raise ConversionError(400, "Workbook has neither a 'FORM' sheet (Data Sheet) nor a 'PSV' sheet (Calculation Sheet).")
+
+
+def run_calc2data(calc_sheet):
+    """
+    Convert an uploaded Calculation Sheet into a filled Data Sheet.
+    Args:
+        calc_sheet: UploadPayload, path or binary file object of the Calculation Sheet.
+    Returns:
+        bytes: The filled Data Sheet workbook (.xlsm).
+    """
+    try:
+        # Assumes 'PSV' is the sheet name in Calculation Sheet for calc2data conversion
+        with stage("read"):
+            calc_df = _read_sheet_block(calc_sheet, "PSV", read_psv_sheet)
+    except Exception as e:
+        raise ConversionError(400, f"Error reading Calculation Sheet: {e}. Ensure 'PSV' sheet exists and format is correct.")
+
+    psv_records_df = None
+    if RECORD_STORE_ENABLED:
+        try:
+            with stage("extract_records"):
+                psv_records_df = extract_psv_records(calc_df)
+        except Exception:
+            pass  # The converter extracts them again and reports the problem.
+    output_bytes = _write_data_sheet(calc_df, psv_records_df=psv_records_df)
+    _store_records("calc2data", calc_sheet, psv_records_df)
+    return output_bytes
+
+
+def _write_data_sheet(calc_df, psv_records_df=None):
+    """Fill the Data Sheet template from a PSV sheet block (or extracted records); returns the .xlsm bytes."""
+    patch_template = None
+    if USE_XML_WRITER:
+        try:
+            with stage("template"):
+                patch_template = DATA_SHEET_PATCH_TEMPLATE_CACHE.get()
+        except UnsupportedTemplateError as e:
+            print(f"WARNING: Data Sheet template cannot be patched directly, using openpyxl: {e}")
+
+    output_stream = io.BytesIO()
+    if patch_template is not None:
+        result_from_calc2data = convert_calc_to_data_sheet(
+            calc_df, DEFAULT_DATA_SHEET_TEMPLATE_PATH, output_stream=output_stream,
+            patch_template=patch_template, psv_records_df=psv_records_df,
+        )
+    else:
+        with DATA_SHEET_TEMPLATE_POOL.checkout() as template_wb:
+            result_from_calc2data = convert_calc_to_data_sheet(
+                calc_df, DEFAULT_DATA_SHEET_TEMPLATE_PATH, output_stream=output_stream,
+                template_workbook=template_wb, psv_records_df=psv_records_df,
+            )
+
+    if not result_from_calc2data:
+        raise ConversionError(500, "Excel conversion (Calc to Data) failed. Check server logs for details.")
+    return output_stream.getvalue()
+
+
+def run_data2calc(data_sheet):
+    """
+    Convert an uploaded Data Sheet into a filled Calculation Sheet.
+    Args:
+        data_sheet: UploadPayload, path or binary file object of the Data Sheet.
+    Returns:
+        bytes: The filled Calculation Sheet workbook (.xlsx).
+    """
+    try:
+        with stage("read"):
+            data_df = _read_sheet_block(data_sheet, "FORM", read_form_sheet)
+    except Exception as e:
+        raise ConversionError(400, f"Error reading Data Sheet: {e}. Ensure 'FORM' sheet exists and format is correct.")
+
+    calc_sheet_template_df = _calc_sheet_template()
+    result_df = _convert_to_calc_sheet(data_df, calc_sheet_template_df)
+    output_bytes = _write_calc_sheet(result_df)
+    if RECORD_STORE_ENABLED:
+        _store_records("data2calc", data_sheet, _data_sheet_store_records(data_df, result_df, calc_sheet_template_df))
+    return output_bytes
+
+
+def _data_sheet_store_records(data_df, result_df, calc_sheet_template_df):
+    """
+    Records of a converted Data Sheet for the record store: the Calculation Sheet
+    records of the FORM record area (not its header rows) plus their Rev. No.
+    """
+    records_df = calc_sheet_records(result_df, calc_sheet_template_df)
+    # The converter keeps the FORM row pairs (rows 2k, 2k + 1) whose Tag No. is filled, in order.
+    first_rows = data_df.iloc[::2]
+    tags = first_rows.iloc[:, 0] if data_df.shape[1] else pd.Series(dtype=object)
+    kept = (tags.notna() & (tags.astype(str).str.strip() != "")).to_numpy()
+    in_record_area = np.arange(len(first_rows))[kept] >= (DATA_SHEET_FORM_START_ROW - 1) // 2
+    records_df = records_df[in_record_area[:len(records_df)]].reset_index(drop=True)
+
+    revision_col = next(col for (col, offset), name in DATA_SHEET_FIELDS.items() if name == "Rev. No.") - 1
+    if data_df.shape[1] > revision_col:
+        revisions = first_rows.iloc[:, revision_col].to_numpy(dtype=object)[kept][in_record_area]
+        records_df["Rev. No."] = pd.Series(revisions[:len(records_df)], dtype=object)
+    return records_df
+
+
+def _calc_sheet_template():
+    try:
+        with stage("template"):
+            return CALC_SHEET_TEMPLATE_CACHE.get()
+    except Exception as e:
+        raise ConversionError(400, f"Error reading Calculation Sheet template: {e}. Ensure '{DEFAULT_CALC_SHEET_TEMPLATE_PATH}' with sheet 'PSV' exists and is accessible.")
+
+
+def _convert_to_calc_sheet(data_df, calc_sheet_template_df):
+    result_df = convert_data_to_calc_sheet(data_df, calc_sheet_template_df)
+
+    if not isinstance(result_df, pd.DataFrame):
+        raise ConversionError(500, "Excel conversion (Data to Calc) failed: Core logic did not return a DataFrame.")
+    return result_df
+
+
+def _write_calc_sheet(result_df):
+    output_stream = io.BytesIO()
+    try:
+        with stage("write_excel"):
+            result_df.to_excel(output_stream, index=False, header=False, engine='openpyxl')
+    except Exception as e:
+        raise ConversionError(500, f"Error writing converted DataFrame to Excel stream: {e}")
+    return output_stream.getvalue()
+
+
+def run_data2calc_update(calc_sheet, data_sheet, render=True):
+    """
+    Bring an existing filled Calculation Sheet up to date with a revised Data Sheet.
+    Tag columns are matched by Tag No. and occurrence of the tag (one record per relief
+    case): mapped cells whose value changed are rewritten, new records are appended as new
+    columns and columns without a record are only reported. Every other cell, formula, style and the VBA project are kept.
+    Args:
+        calc_sheet: UploadPayload, path or binary file object of the filled Calculation Sheet (.xlsx/.xlsm).
+        data_sheet: UploadPayload, path or binary file object of the revised Data Sheet.
+        render (bool): False to compute the change summary only.
+    Returns:
+        tuple: (updated workbook bytes in the Calculation Sheet's own format, or None
+        when render is False; change summary dict, see calc_update.plan_update)
+    """
+    try:
+        with stage("read"):
+            workbook_bytes = _source_bytes(calc_sheet)
+            calc_df = read_psv_sheet(io.BytesIO(workbook_bytes))
+    except zipfile.BadZipFile:
+        raise ConversionError(400, "The Calculation Sheet must be an .xlsx or .xlsm workbook to be updated in place.")
+    except Exception as e:
+        raise ConversionError(400, f"Error reading Calculation Sheet: {e}. Ensure 'PSV' sheet exists and format is correct.")
+    try:
+        with stage("read"):
+            data_df = _read_sheet_block(data_sheet, "FORM", read_form_sheet)
+    except Exception as e:
+        raise ConversionError(400, f"Error reading Data Sheet: {e}. Ensure 'FORM' sheet exists and format is correct.")
+
+    # Only the record area is keyed by Tag No.; the header rows above it are not records.
+    data_df = data_df.iloc[DATA_SHEET_FORM_START_ROW - 1:]
+    tag_block = map_calc_sheet_block(data_df, max(calc_df.shape[0], max(CALC_SHEET_MAPPING) + 1))
+    with stage("diff"):
+        cells, summary = plan_update(calc_df, tag_block, calc_record_fields(calc_df))
+    record("cells_written", summary["cells_written"])
+    if not render:
+        return None, summary
+
+    try:
+        with stage("render"):
+            patch_template = SheetPatchTemplate(workbook_bytes, "PSV", first_row=1, precompress=False)
+            output_bytes = patch_template.render(cells)
+    except UnsupportedTemplateError as e:
+        raise ConversionError(400, f"The Calculation Sheet cannot be updated in place: {e}")
+    return output_bytes, summary
+
+
+def _parse_records(body, input_format):
+    try:
+        with stage("parse_records"):
+            return parse_records(body, input_format)
+    except RecordFormatError as e:
+        raise ConversionError(e.status_code, str(e))
+
+
+def _render_records(df, output_format):
+    try:
+        with stage("render_records"):
+            return render_records(df, output_format)
+    except RecordFormatError as e:
+        raise ConversionError(e.status_code, str(e))
+
+
+def run_records_calc2data(body, input_format, output_format):
+    """
+    Convert Calculation Sheet records into Data Sheet records, without any workbook on the way in.
+    Args:
+        body (bytes): Records as JSON, CSV or Parquet (see records.py).
+        input_format (str): 'json', 'csv' or 'parquet'.
+        output_format (str): A record format, or 'xlsm' for a filled Data Sheet workbook.
+    Returns:
+        bytes: The Data Sheet records (or workbook).
+    """
+    try:
+        psv_records_df = psv_records_frame(_parse_records(body, input_format))
+    except RecordFormatError as e:
+        raise ConversionError(e.status_code, str(e))
+    if psv_records_df.empty:
+        raise ConversionError(400, "No records with a 'Tag No.' were sent.")
+
+    if output_format == "xlsm":
+        return _write_data_sheet(None, psv_records_df=psv_records_df)
+    record("records", len(psv_records_df))
+    with stage("write_plan"):
+        write_plan = build_write_plan(psv_records_df)
+    return _render_records(data_sheet_records(write_plan), output_format)
+
+
+def run_records_data2calc(body, input_format, output_format):
+    """
+    Convert Data Sheet records into Calculation Sheet records, without any workbook on the way in.
+    Args:
+        body (bytes): Records as JSON, CSV or Parquet (see records.py).
+        input_format (str): 'json', 'csv' or 'parquet'.
+        output_format (str): A record format, or 'xlsx' for a filled Calculation Sheet workbook.
+    Returns:
+        bytes: The Calculation Sheet records (or workbook).
+    """
+    try:
+        data_df = data_sheet_frame(_parse_records(body, input_format))
+    except RecordFormatError as e:
+        raise ConversionError(e.status_code, str(e))
+
+    calc_sheet_template_df = _calc_sheet_template()
+    result_df = _convert_to_calc_sheet(data_df, calc_sheet_template_df)
+    if output_format == "xlsx":
+        return _write_calc_sheet(result_df)
+    return _render_records(calc_sheet_records(result_df, calc_sheet_template_df), output_format)
+
+
+def run_sizing(source, output_format):
+    """
+    Size the PSVs of an uploaded workbook natively, without recalculating it in Excel.
+    A Calculation Sheet is sized from its PSV sheet inputs; a Data Sheet is first mapped
+    onto Calculation Sheet rows exactly as /data2calc/ would fill them.
+    Args:
+        source: UploadPayload, path or binary file object of a Data Sheet or Calculation Sheet.
+        output_format (str): 'json', 'csv' or 'parquet'.
+    Returns:
+        bytes: One sizing record per tag (see sizing.size_psvs).
+    """
+    kind = detect_conversion(source)
+    if kind == "calc2data":
+        try:
+            with stage("read"):
+                calc_df = _read_sheet_block(source, "PSV", read_psv_sheet)
+        except Exception as e:
+            raise ConversionError(400, f"Error reading Calculation Sheet: {e}. Ensure 'PSV' sheet exists and format is correct.")
+        inputs = psv_sheet_inputs(calc_df)
+    else:
+        try:
+            with stage("read"):
+                data_df = _read_sheet_block(source, "FORM", read_form_sheet)
+        except Exception as e:
+            raise ConversionError(400, f"Error reading Data Sheet: {e}. Ensure 'FORM' sheet exists and format is correct.")
+        calc_sheet_template_df = _calc_sheet_template()
+        tag_block = map_calc_sheet_block(data_df.iloc[DATA_SHEET_FORM_START_ROW - 1:], calc_sheet_template_df.shape[0])
+        inputs = sheet_inputs(calc_sheet_template_df.iloc[:, 0].tolist(), tag_block)
+
+    try:
+        with stage("template"):
+            tables = SIZING_TABLES_CACHE.get()
+    except Exception as e:
+        raise ConversionError(400, f"Error reading sizing tables: {e}. Ensure '{DEFAULT_CALC_SHEET_TEMPLATE_PATH}' with sheets 'OrificeSize' and 'KSH' exists and is accessible.")
+    record("records", len(inputs["TagNo"]))
+    with stage("size"):
+        result_df = size_psvs(inputs, tables)
+    return _render_records(result_df, output_format)
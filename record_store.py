@@ -0,0 +1,266 @@
+import json
+import math
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from sqlite_db import connect, isoformat
+
+# Indexed store of converted PSV records (the /store/ endpoints).
+# Every successful workbook conversion saves its normalized records (the
+# standardized properties of each tag) to a SQLite database, once per distinct
+# upload. Single tags can then be looked up by Tag No., Dwg No., PSV Type,
+# phase or revision across every workbook ever converted, without parsing any
+# of them again.
+
+RECORD_STORE_PATH = os.environ.get("PSV_RECORD_STORE") or str(
+    Path(tempfile.gettempdir()) / "fastapi_excel_processor_records" / "records.sqlite3"
+)
+RECORD_STORE_DISABLED = ("0", "off", "none")
+RECORD_STORE_ENABLED = RECORD_STORE_PATH.strip().lower() not in RECORD_STORE_DISABLED
+# Planner statistics are refreshed when a store is opened and then at most this often (seconds).
+RECORD_STORE_ANALYZE_INTERVAL = float(os.environ.get("PSV_RECORD_STORE_ANALYZE_SECONDS", "600"))
+RECORD_QUERY_MAX_LIMIT = 1000
+
+# Record field -> indexed column.
+INDEXED_FIELDS = {
+    "Tag No.": "tag_no",
+    "Dwg No.": "dwg_no",
+    "PSV Type": "psv_type",
+    "Phase": "phase",
+    "Rev. No.": "revision",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workbooks (
+    id INTEGER PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    filename TEXT,
+    records INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    UNIQUE (sha256, kind)
+);
+CREATE TABLE IF NOT EXISTS psv_records (
+    id INTEGER PRIMARY KEY,
+    workbook_id INTEGER NOT NULL REFERENCES workbooks (id),
+    position INTEGER NOT NULL,
+    tag_no TEXT NOT NULL COLLATE NOCASE,
+    dwg_no TEXT COLLATE NOCASE,
+    psv_type TEXT COLLATE NOCASE,
+    phase TEXT COLLATE NOCASE,
+    revision TEXT COLLATE NOCASE,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS latest_workbooks (
+    tag_no TEXT PRIMARY KEY COLLATE NOCASE,
+    workbook_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS psv_records_tag_no ON psv_records (tag_no);
+CREATE INDEX IF NOT EXISTS psv_records_dwg_no ON psv_records (dwg_no);
+CREATE INDEX IF NOT EXISTS psv_records_psv_type ON psv_records (psv_type);
+CREATE INDEX IF NOT EXISTS psv_records_phase ON psv_records (phase);
+CREATE INDEX IF NOT EXISTS psv_records_revision ON psv_records (revision);
+CREATE INDEX IF NOT EXISTS psv_records_workbook ON psv_records (workbook_id);
+"""
+
+
+def _plain(value):
+    """JSON-friendly record value: numpy scalars unwrapped, NaN as None, timestamps as ISO text."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or (isinstance(value, float) and math.isnan(value)) or value is pd.NaT:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value
+
+
+def _key(value):
+    """Indexed column value: stripped text, None when empty."""
+    value = _plain(value)
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value).strip()
+    return text or None
+
+
+class RecordStore:
+    """
+    SQLite table of PSV records, one row per tag per stored workbook.
+    Every method opens its own connection, so conversions in worker processes
+    and queries in the server can use the store at the same time.
+    Args:
+        db_path (str): Path of the SQLite database (created if missing).
+        analyze_interval (float): Seconds between refreshes of the planner statistics.
+    """
+
+    def __init__(self, db_path, analyze_interval=RECORD_STORE_ANALYZE_INTERVAL):
+        self.db_path = str(db_path)
+        self.analyze_interval = analyze_interval
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        with connect(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._migrate(conn)
+            self._analyze(conn)
+
+    @classmethod
+    def from_env(cls):
+        """The store at PSV_RECORD_STORE, or None if it is switched off (PSV_RECORD_STORE=off)."""
+        if not RECORD_STORE_ENABLED:
+            return None
+        return cls(RECORD_STORE_PATH)
+
+    def _migrate(self, conn):
+        """Replace the per-record latest_records table of older stores with latest_workbooks."""
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'latest_records'").fetchone() is None:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "INSERT OR REPLACE INTO latest_workbooks (tag_no, workbook_id)"
+            " SELECT tag_no, MAX(workbook_id) FROM psv_records GROUP BY tag_no"
+        )
+        conn.execute("DROP TABLE latest_records")
+        conn.execute("COMMIT")
+
+    def _analyze(self, conn):
+        """Refresh the planner statistics so it picks the most selective index."""
+        conn.execute("PRAGMA analysis_limit = 1000")
+        conn.execute("ANALYZE")
+        self.analyzed_at = time.monotonic()
+
+    def save(self, kind, sha256, filename, records_df):
+        """
+        Store the records of one converted workbook. A workbook already stored for the
+        same conversion (same upload hash) is left as it is.
+        Args:
+            kind (str): 'calc2data' or 'data2calc'.
+            sha256 (str): Hash of the uploaded workbook.
+            filename (str): Uploaded file name.
+            records_df (pd.DataFrame): One row per tag, standardized property names.
+        Returns:
+            int: Records stored (0 if the workbook was already there).
+        """
+        columns = list(records_df.columns)
+        rows = []
+        for position, values in enumerate(records_df.itertuples(index=False, name=None)):
+            record = {name: _plain(value) for name, value in zip(columns, values)}
+            keys = {column: _key(record.get(field)) for field, column in INDEXED_FIELDS.items()}
+            if keys["tag_no"] is None:
+                continue
+            rows.append((
+                position, keys["tag_no"], keys["dwg_no"], keys["psv_type"], keys["phase"], keys["revision"],
+                json.dumps(record, ensure_ascii=False, default=str),
+            ))
+
+        with connect(self.db_path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO workbooks (sha256, kind, filename, records, stored_at) VALUES (?, ?, ?, ?, ?)",
+                (sha256, kind, filename, len(rows), time.time()),
+            )
+            if cursor.rowcount == 0:
+                conn.execute("COMMIT")
+                return 0
+            workbook_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO psv_records (workbook_id, position, tag_no, dwg_no, psv_type, phase, revision, data)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(workbook_id, *row) for row in rows],
+            )
+            # A tag has one record per relief case; the latest ones are all those of its newest workbook.
+            conn.execute(
+                "INSERT INTO latest_workbooks (tag_no, workbook_id) SELECT tag_no, workbook_id FROM psv_records"
+                " WHERE workbook_id = ? GROUP BY tag_no ON CONFLICT (tag_no) DO UPDATE SET workbook_id = excluded.workbook_id",
+                (workbook_id,),
+            )
+            conn.execute("COMMIT")
+            if time.monotonic() - self.analyzed_at >= self.analyze_interval:
+                self._analyze(conn)
+        return len(rows)
+
+    def query(self, filters=None, latest=False, limit=100, offset=0):
+        """
+        Stored records matching every given filter (case-insensitive equality), newest first.
+        Args:
+            filters (dict): {column: value} on tag_no, dwg_no, psv_type, phase, revision, workbook_id.
+            latest (bool): Only the records (one per relief case) of each tag's most recently stored workbook.
+            limit (int): Page size (at most RECORD_QUERY_MAX_LIMIT).
+            offset (int): Records to skip.
+        Returns:
+            tuple: (total number of matches, list of record dicts)
+        """
+        conditions, params = [], []
+        for column, value in (filters or {}).items():
+            if value is None:
+                continue
+            if column not in ("workbook_id", *INDEXED_FIELDS.values()):
+                raise ValueError(f"Unknown filter '{column}'")
+            conditions.append(f"r.{column} = ?")
+            params.append(value)
+        source = (
+            "psv_records r JOIN latest_workbooks l ON l.tag_no = r.tag_no AND l.workbook_id = r.workbook_id"
+            if latest else "psv_records r"
+        )
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        limit = max(0, min(limit, RECORD_QUERY_MAX_LIMIT))
+
+        with connect(self.db_path) as conn:
+            (total,) = conn.execute(f"SELECT COUNT(*) FROM {source} {where}", params).fetchone()
+            rows = conn.execute(
+                f"SELECT r.*, w.kind, w.sha256, w.filename, w.stored_at FROM {source}"
+                f" JOIN workbooks w ON w.id = r.workbook_id {where} ORDER BY r.id DESC LIMIT ? OFFSET ?",
+                (*params, limit, max(0, offset)),
+            ).fetchall()
+        return total, [record_view(row) for row in rows]
+
+    def workbooks(self, limit=100, offset=0):
+        """Stored workbooks, newest first. Returns (total, list of workbook dicts)."""
+        limit = max(0, min(limit, RECORD_QUERY_MAX_LIMIT))
+        with connect(self.db_path) as conn:
+            (total,) = conn.execute("SELECT COUNT(*) FROM workbooks").fetchone()
+            rows = conn.execute(
+                "SELECT * FROM workbooks ORDER BY id DESC LIMIT ? OFFSET ?", (limit, max(0, offset))
+            ).fetchall()
+        return total, [workbook_view(row) for row in rows]
+
+    def stats(self):
+        with connect(self.db_path) as conn:
+            (workbooks,) = conn.execute("SELECT COUNT(*) FROM workbooks").fetchone()
+            (records,) = conn.execute("SELECT COUNT(*) FROM psv_records").fetchone()
+            (tags,) = conn.execute("SELECT COUNT(*) FROM latest_workbooks").fetchone()
+        return {"workbooks": workbooks, "records": records, "tags": tags, "db_path": self.db_path}
+
+
+def workbook_view(row):
+    """Public JSON representation of a workbook row."""
+    return {
+        "id": row["id"],
+        "kind": row["kind"],
+        "filename": row["filename"],
+        "sha256": row["sha256"],
+        "records": row["records"],
+        "stored_at": isoformat(row["stored_at"]),
+    }
+
+
+def record_view(row):
+    """Public JSON representation of a stored record joined with its workbook."""
+    return {
+        "tag_no": row["tag_no"],
+        "workbook": {
+            "id": row["workbook_id"],
+            "kind": row["kind"],
+            "filename": row["filename"],
+            "sha256": row["sha256"],
+            "stored_at": isoformat(row["stored_at"]),
+        },
+        "record": json.loads(row["data"]),
+    }
@@ -0,0 +1,240 @@
+import io
+import json
+import math
+
+import numpy as np
+import pandas as pd
+
+from calc2data import DATA_SHEET_WRITE_MAPPING, normalize_header, standardize_header
+from data2calc import CALC_SHEET_MAPPING
+
+# PSV records as JSON / CSV / Parquet (the /records/ endpoints).
+# Calculation Sheet records use the standardized property names of
+# CALC_SHEET_HEADER_MAPPING ("Tag No.", "Set Pressure", ...), so they are
+# exactly what extract_psv_records() reads from a PSV sheet. Data Sheet records
+# name the cells of one FORM record pair (DATA_SHEET_FIELDS). The converters
+# then run unchanged on the records; Excel is only one of the output renderers.
+
+RECORD_MEDIA_TYPES = {
+    "json": "application/json",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+CONTENT_TYPE_FORMATS = {
+    "application/json": "json",
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/vnd.apache.parquet": "parquet",
+    "application/x-parquet": "parquet",
+}
+
+# Data Sheet FORM cells of one record pair: (excel column, row offset in pair) -> field name.
+# Names follow the FORM header row and, where the converters treat a cell as a
+# Calculation Sheet property, that property's standardized name.
+DATA_SHEET_FIELDS = {
+    (1, 0): "Tag No.",
+    (1, 1): "Dwg No.",
+    (4, 0): "Relief Case",
+    (7, 0): "Relief Condition",
+    (10, 0): "Phase",
+    (10, 1): "Fluid",
+    (11, 0): "Flow Rate",
+    (12, 0): "Normal Pressure",
+    (13, 0): "Mechanical Design Pressure",
+    (14, 0): "Set Pressure",
+    (15, 0): "Const./Variable Superimposed Back Pressure",
+    (16, 0): "Built-up Back Pressure",
+    (17, 0): "Flare System",
+    (17, 1): "PSV Type",
+    (18, 0): "Allowable Overpressure",
+    (19, 0): "Normal Temperature",
+    (20, 0): "Mechanical Design Temperature",
+    (21, 0): "Relief Temperature",
+    (22, 0): "Viscosity",
+    (23, 0): "Molecular Weight",
+    (23, 1): "Specific Gravity",
+    (24, 0): "Gas Z",
+    (24, 1): "Cp/Cv",
+    (25, 0): "Rev. No.",
+    (27, 0): "Remark",
+}
+DATA_SHEET_FIELD_INDEX = {normalize_header(name): coord for coord, name in DATA_SHEET_FIELDS.items()}
+DATA_SHEET_WIDTH = max(col for col, _ in DATA_SHEET_FIELDS)
+
+
+class RecordFormatError(ValueError):
+    """The request body or the requested format cannot be handled."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def record_format(content_type, explicit=None):
+    """Input format from an explicit ?input= value or the Content-Type header."""
+    if explicit:
+        fmt = explicit.lower()
+    else:
+        fmt = CONTENT_TYPE_FORMATS.get((content_type or "").split(";")[0].strip().lower())
+    if fmt not in RECORD_MEDIA_TYPES:
+        raise RecordFormatError(
+            f"Unsupported record format '{explicit or content_type}'. Send JSON, CSV or Parquet "
+            "(Content-Type application/json, text/csv or application/vnd.apache.parquet, or ?input=).",
+            status_code=415,
+        )
+    return fmt
+
+
+def _numeric_cells(values):
+    """CSV cells as Excel would hold them: numbers as numbers, "" as missing."""
+    numbers = pd.to_numeric(values, errors="coerce")
+    result = values.astype(object).where(numbers.isna(), numbers.astype(object))
+    return result.where(values != "", None)
+
+
+def parse_records(body, fmt):
+    """
+    Parse a record list.
+    JSON: a list of objects, or {"records": [...]}. CSV: header row plus one row per record.
+    Returns:
+        pd.DataFrame: One row per record, object columns named as sent.
+    """
+    try:
+        if fmt == "json":
+            data = json.loads(body)
+            if isinstance(data, dict):
+                data = data.get("records")
+            if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+                raise RecordFormatError('JSON body must be a list of record objects or {"records": [...]}.')
+            return pd.DataFrame.from_records(data).astype(object)
+        if fmt == "csv":
+            df = pd.read_csv(io.BytesIO(body), dtype=str, keep_default_na=False)
+            return pd.DataFrame({col: _numeric_cells(df[col]) for col in df.columns}, dtype=object)
+        return pd.read_parquet(io.BytesIO(body)).astype(object)
+    except ImportError:
+        raise RecordFormatError("Parquet support needs the 'pyarrow' package (see requirements.txt).", status_code=415)
+    except RecordFormatError:
+        raise
+    except Exception as e:
+        raise RecordFormatError(f"Could not parse {fmt.upper()} records: {e}")
+
+
+def _plain(value):
+    """Python scalar for JSON: numpy numbers unwrapped, NaN/None as null."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value
+
+
+def render_records(df, fmt):
+    """Serialize a record DataFrame as JSON ({"records": [...]}), CSV or Parquet bytes."""
+    if fmt == "json":
+        records = [
+            {col: _plain(value) for col, value in zip(df.columns, row)}
+            for row in df.itertuples(index=False, name=None)
+        ]
+        return json.dumps({"records": records}, ensure_ascii=False, default=str).encode("utf-8")
+    if fmt == "csv":
+        return df.to_csv(index=False).encode("utf-8")
+    # Parquet columns need one type: columns mixing numbers and text are written as text.
+    table = {}
+    for col in df.columns:
+        values = [_plain(v) for v in df[col]]
+        types = {type(v) for v in values if v is not None}
+        if len(types) > 1 and not types <= {int, float}:
+            values = [None if v is None else str(v) for v in values]
+        table[col] = values
+    try:
+        stream = io.BytesIO()
+        pd.DataFrame(table).to_parquet(stream, index=False)
+    except ImportError:
+        raise RecordFormatError("Parquet support needs the 'pyarrow' package (see requirements.txt).", status_code=415)
+    return stream.getvalue()
+
+
+# --- Calculation Sheet records ---
+def psv_records_frame(df):
+    """
+    Calculation Sheet records as extract_psv_records() returns them: columns
+    standardized (aliases accepted), Tag No. as stripped text, untagged records dropped.
+    """
+    columns = {}
+    for col in df.columns:
+        standardized_name = standardize_header(str(col).strip())
+        if standardized_name:
+            # Later columns mapping to the same property win, as later sheet rows do.
+            columns[standardized_name] = df[col].to_numpy(dtype=object)
+    if "Tag No." not in columns:
+        raise RecordFormatError("Records need a 'Tag No.' field.")
+
+    tags = pd.Series(columns["Tag No."], dtype=object)
+    tag_strs = tags.astype(str).str.strip()
+    keep = (tags.notna() & (tag_strs != "")).to_numpy()
+    columns["Tag No."] = tag_strs.to_numpy(dtype=object)
+    return pd.DataFrame({name: values[keep] for name, values in columns.items()}, dtype=object)
+
+
+def data_sheet_records(write_plan):
+    """Data Sheet records from a calc2data build_write_plan() result."""
+    fields = {}
+    for coord, (_, _, values) in zip(DATA_SHEET_WRITE_MAPPING, write_plan):
+        if coord in DATA_SHEET_FIELDS:
+            fields[DATA_SHEET_FIELDS[coord]] = values
+    ordered = [name for name in DATA_SHEET_FIELDS.values() if name in fields]
+    return pd.DataFrame({name: fields[name] for name in ordered}, dtype=object)
+
+
+# --- Data Sheet records ---
+def data_sheet_frame(df):
+    """
+    Lay Data Sheet records out as FORM record pairs (two rows per record, from row 0),
+    the shape convert_data_to_calc_sheet() reads. Field names are matched like
+    Calculation Sheet labels; unknown fields are ignored.
+    """
+    num_records = len(df)
+    values = np.full((2 * num_records, DATA_SHEET_WIDTH), "", dtype=object)
+    matched = False
+    for col in df.columns:
+        coord = DATA_SHEET_FIELD_INDEX.get(normalize_header(col))
+        if coord is None:
+            standardized_name = standardize_header(str(col).strip())
+            coord = DATA_SHEET_FIELD_INDEX.get(normalize_header(standardized_name)) if standardized_name else None
+        if coord is None:
+            continue
+        matched = matched or coord == (1, 0)
+        column = df[col].to_numpy(dtype=object)
+        column = np.where(pd.isna(column), "", column)
+        excel_col, offset = coord
+        values[offset::2, excel_col - 1] = column
+    if not matched:
+        raise RecordFormatError("Records need a 'Tag No.' field.")
+    return pd.DataFrame(values)
+
+
+def calc_record_fields(calc_sheet_template_df):
+    """
+    {Calculation Sheet row index: record field} for the rows data2calc fills, named by
+    the standardized property of their column-B label (the raw label if it has none).
+    """
+    labels = calc_sheet_template_df.iloc[:, 1].tolist() if calc_sheet_template_df.shape[1] > 1 else []
+    fields = {}
+    for row in CALC_SHEET_MAPPING:
+        if row >= len(labels):
+            continue
+        label = str(labels[row]).strip() if pd.notna(labels[row]) else f"Row {row + 1}"
+        fields[row] = standardize_header(label) or label
+    return fields
+
+
+def calc_sheet_records(result_df, calc_sheet_template_df):
+    """Calculation Sheet records from a convert_data_to_calc_sheet() result."""
+    fields = calc_record_fields(calc_sheet_template_df)
+    tag_block = result_df.iloc[:, calc_sheet_template_df.shape[1]:].to_numpy(dtype=object)
+    columns = {}
+    for row, name in fields.items():
+        columns[name] = tag_block[row]
+    return pd.DataFrame(columns, dtype=object)
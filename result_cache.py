@@ -0,0 +1,204 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+class ResultCache:
+    """
+    Content-addressed cache of conversion outputs.
+
+    Entries are keyed by a hex digest (see pipeline.conversion_cache_key) and held
+    in an in-memory LRU bounded by total bytes. With disk_dir set, entries are also
+    written to disk, where they survive restarts and are evicted oldest-used first.
+    Args:
+        max_bytes (int): Memory tier budget; 0 disables the memory tier.
+        max_entry_bytes (int): Larger outputs are not kept in memory (default: max_bytes // 4).
+        disk_dir (str): Directory of the optional disk tier.
+        disk_max_bytes (int): Disk tier budget.
+    """
+
+    def __init__(self, max_bytes, max_entry_bytes=None, disk_dir=None, disk_max_bytes=0):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 4 if max_entry_bytes is None else max_entry_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()   # key -> size, least recently used first
+        self._disk_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.disk_dir is not None:
+            self._scan_disk()
+
+    @classmethod
+    def from_env(cls):
+        """Build a cache from PSV_RESULT_CACHE_BYTES / _DIR / _DISK_BYTES."""
+        return cls(
+            max_bytes=int(os.environ.get("PSV_RESULT_CACHE_BYTES", str(256 * 1024 * 1024))),
+            disk_dir=os.environ.get("PSV_RESULT_CACHE_DIR") or None,
+            disk_max_bytes=int(os.environ.get("PSV_RESULT_CACHE_DISK_BYTES", str(2 * 1024 * 1024 * 1024))),
+        )
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 or self.disk_dir is not None
+
+    # --- Disk tier ---
+    def _disk_path(self, key):
+        return self.disk_dir / key[:2] / f"{key}.bin"
+
+    def _scan_disk(self):
+        """Index existing disk entries by last use (mtime)."""
+        self.disk_dir.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for path in self.disk_dir.glob("*/*.bin"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime_ns, path.stem, st.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                size = self._disk.pop(key, None)
+                if size is not None:
+                    self._disk_bytes -= size
+            return None
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+        return data
+
+    def _write_disk(self, key, data):
+        if len(data) > self.disk_max_bytes:
+            return
+        path = self._disk_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(prefix=".tmp_", dir=path.parent)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+        evicted = []
+        with self._lock:
+            self._disk_bytes -= self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            while self._disk_bytes > self.disk_max_bytes and len(self._disk) > 1:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                self.evictions += 1
+                evicted.append(old_key)
+        for old_key in evicted:
+            self._disk_path(old_key).unlink(missing_ok=True)
+
+    # --- Memory tier ---
+    def _put_memory(self, key, data):
+        if len(data) > self.max_entry_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            self._memory[key] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.max_bytes:
+                _, old = self._memory.popitem(last=False)
+                self._memory_bytes -= len(old)
+                self.evictions += 1
+
+    def contains(self, key):
+        """True if an output is cached under key (no hit/miss counted)."""
+        with self._lock:
+            return key in self._memory or key in self._disk
+
+    def get(self, key):
+        """
+        Look up a cached output.
+        Returns:
+            tuple: (bytes, "memory" | "disk"), or (None, None) on a miss.
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return data, "memory"
+            on_disk = key in self._disk
+
+        if on_disk:
+            data = self._read_disk(key)
+            if data is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._put_memory(key, data)
+                return data, "disk"
+
+        with self._lock:
+            self.misses += 1
+        return None, None
+
+    def put(self, key, data):
+        """Store a conversion output in every enabled tier."""
+        if self.max_bytes > 0:
+            self._put_memory(key, data)
+        if self.disk_dir is not None:
+            try:
+                self._write_disk(key, data)
+            except OSError as e:
+                print(f"WARNING: Could not write result cache entry to disk: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "max_bytes": self.max_bytes,
+                "disk_dir": str(self.disk_dir) if self.disk_dir is not None else None,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "disk_max_bytes": self.disk_max_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else None,
+            }
+
+
+def etag_matches(if_none_match, etag):
+    """
+    True if an If-None-Match header value lists etag explicitly (weak comparison).
+    "*" matches nothing: the conversion endpoints are POSTs, and "*" cannot say the
+    client already holds this result.
+    """
+    if not if_none_match:
+        return False
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == wanted:
+            return True
+    return False
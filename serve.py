@@ -0,0 +1,150 @@
+"""
+Serve the API from pre-forked, warm worker processes.
+
+The parent imports the application (pandas, numpy, openpyxl and the converters),
+parses the templates (the Data Sheet FORM patch template with its merged ranges,
+the Calculation Sheet PSV block and its header layout, the sizing tables), then
+binds the socket and forks the HTTP workers.
+The workers share all of that copy-on-write and answer their first request warm;
+GET /ready turns 200 in each worker once its executor and job runner are running.
+Workers that exit unexpectedly are forked again from the warm parent.
+
+Run from the repository root (the templates are looked up in the working directory):
+
+    python serve.py --host 0.0.0.0 --port 8000 --workers 4
+
+Unless PSV_WORKERS is set, each HTTP worker gets an equal share of the CPUs for
+its conversion process pool, so the host is not oversubscribed.
+"""
+import argparse
+import gc
+import os
+import signal
+import sys
+import time
+
+# Seconds between checks for exited workers, and before forking a replacement.
+SUPERVISE_INTERVAL = 0.5
+RESTART_DELAY = 1.0
+# Seconds workers get to finish in-flight requests after SIGTERM before they are killed.
+SHUTDOWN_TIMEOUT = 30
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("PSV_HTTP_WORKERS", "0")) or os.cpu_count() or 1,
+                        help="HTTP worker processes (default: PSV_HTTP_WORKERS or the CPU count)")
+    parser.add_argument("--log-level", default="info")
+    return parser.parse_args(argv)
+
+
+class Prefork:
+    """
+    Forks `workers` uvicorn servers from this (already warm) process on a shared socket
+    and keeps them running until SIGTERM or SIGINT.
+    """
+
+    def __init__(self, config, workers):
+        self.config = config
+        self.workers = workers
+        self.sockets = [config.bind_socket()]
+        self.children = {}
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            # Child: default signal handling for uvicorn, then serve until told to stop.
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            import uvicorn
+
+            status = 0
+            try:
+                uvicorn.Server(self.config).run(sockets=self.sockets)
+            except BaseException as e:
+                print(f"ERROR: Worker {os.getpid()} failed: {e}")
+                status = 1
+            finally:
+                os._exit(status)
+        self.children[pid] = time.monotonic()
+        return pid
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+        # SIGINT from a terminal already reaches every worker (same process group);
+        # forwarding it would make uvicorn force-exit instead of shutting down cleanly.
+        if signum == signal.SIGTERM:
+            for pid in self.children:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+    def _reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            started = self.children.pop(pid, None)
+            if started is not None and not self.stopping:
+                print(f"WARNING: Worker {pid} exited (status {os.waitstatus_to_exitcode(status)}) "
+                      f"after {time.monotonic() - started:.0f}s; forking a replacement.")
+                time.sleep(RESTART_DELAY)
+                self.spawn()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        # Move everything allocated so far out of the collector's reach: collections in
+        # the workers would otherwise write to (and so copy) the shared pages.
+        gc.collect()
+        gc.freeze()
+        for _ in range(self.workers):
+            self.spawn()
+        while not self.stopping:
+            self._reap()
+            time.sleep(SUPERVISE_INTERVAL)
+
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in self.children:
+            print(f"WARNING: Worker {pid} did not stop in {SHUTDOWN_TIMEOUT}s; killing it.")
+            os.kill(pid, signal.SIGKILL)
+        for sock in self.sockets:
+            sock.close()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.workers < 1:
+        print("ERROR: --workers must be at least 1.")
+        return 2
+    if not os.environ.get("PSV_WORKERS"):
+        # Read by main.py's executor at import time.
+        os.environ["PSV_WORKERS"] = str(max(1, (os.cpu_count() or 1) // args.workers))
+
+    start = time.perf_counter()
+    import uvicorn
+
+    import main as application
+
+    application.prepare_prefork()
+    config = uvicorn.Config(application.app, host=args.host, port=args.port, log_level=args.log_level)
+    config.load()
+    print(f"Imported and warmed in {time.perf_counter() - start:.2f}s; forking {args.workers} worker(s) "
+          f"on http://{args.host}:{args.port} (parent pid {os.getpid()}).")
+    Prefork(config, args.workers).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
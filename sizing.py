@@ -0,0 +1,319 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from xlsx_reader import PSV_FIRST_TAG_COL, PSV_TAG_ROW, read_sheet
+
+# Native PSV orifice sizing (POST /sizing/).
+# A vectorized port of the "Calculate Orifice Area" part of the Calculation
+# Sheet's VBA `Calculation` macro and the API RP 520 functions it calls
+# (ACritical, ASteam, ALiqCertification, FindEffArea, Kb/Kw curves). Every tag
+# is sized at once with NumPy array operations. Inputs are the PSV sheet rows,
+# found by their column-A range names (W, Pset, T, ...), in the sheet's own
+# units (lb/hr, lb/ft3, psig, degF). The unit chain follows the macro exactly,
+# including its psi -> bar -> "kg/cm2" conversions, so results match a
+# recalculated workbook. Inlet/outlet line sizing is not ported.
+
+# Params sheet defaults (Kd1, Kd2, Kd3, MABPforBellows) and the macro's PresRatio.
+KD_GAS = 0.975
+KD_STEAM = 0.975
+KD_LIQUID = 0.65
+MABP_FOR_BELLOWS = 0.4
+PRES_RATIO = 1.02
+
+ORIFICE_SHEET_NAME = "OrificeSize"
+KSH_SHEET_NAME = "KSH"
+ORIFICE_FIRST_ROW = 2       # Row 3 of OrificeSize holds the first orifice
+KSH_HEADER_ROW = 2          # Row 3 of KSH holds the temperatures (degF)
+KSH_LAST_ROW = 30           # The macro interpolates rows 4..31 only
+
+SIZING_INPUTS = (
+    "TagNo", "NoPSV", "PSVType", "RatioOfMaxBP", "WithRupDisk", "CalculationMode", "State",
+    "W", "Density", "mu", "M", "Z", "k", "Pset", "AllowOverPres", "T", "MaxBP",
+)
+SIZING_TEXT_INPUTS = ("TagNo", "PSVType", "WithRupDisk", "CalculationMode", "State")
+SIZING_RESULT_COLUMNS = (
+    "Tag No.", "State", "Orifice Area Required", "Kd", "Kb", "Kc", "KN", "KSH", "Kw", "Kv", "Kp",
+    "Orifice Area Selected", "Orifice",
+)
+
+
+@dataclass(frozen=True)
+class SizingTables:
+    """Lookup tables of a Calculation Sheet (OrificeSize and KSH sheets)."""
+    orifice_areas: np.ndarray         # in2, ascending
+    orifice_designations: np.ndarray  # 'X', 'D', 'E', ...
+    ksh_pressures: np.ndarray         # psig
+    ksh_temperatures: np.ndarray      # degF
+    ksh_values: np.ndarray            # (pressures, temperatures); empty cells read as 0 like the macro
+
+
+def _val(values):
+    """VBA Val() of a whole column: numbers as float, anything else 0."""
+    numbers = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce")
+    return numbers.fillna(0).to_numpy(dtype=np.float64)
+
+
+def _text(values):
+    text = pd.Series(values, dtype=object).fillna("").astype(str).str.strip()
+    return text.to_numpy(dtype=object)
+
+
+def load_sizing_tables(source):
+    """
+    Read the orifice and superheat correction tables from a Calculation Sheet.
+    Args:
+        source: Path or binary file object of the workbook.
+    Returns:
+        SizingTables
+    """
+    orifice = read_sheet(source, ORIFICE_SHEET_NAME).iloc[ORIFICE_FIRST_ROW:, :2]
+    areas = _val(orifice.iloc[:, 0])
+    # The macro stops at the first empty area.
+    count = int(np.argmax(areas == 0)) if (areas == 0).any() else len(areas)
+
+    if hasattr(source, "seek"):
+        source.seek(0)
+    ksh = read_sheet(source, KSH_SHEET_NAME)
+    temperatures = _val(ksh.iloc[KSH_HEADER_ROW, 1:])
+    rows = ksh.iloc[KSH_HEADER_ROW + 1:KSH_LAST_ROW + 1]
+    return SizingTables(
+        orifice_areas=areas[:count],
+        orifice_designations=_text(orifice.iloc[:count, 1]),
+        ksh_pressures=_val(rows.iloc[:, 0]),
+        ksh_temperatures=temperatures,
+        ksh_values=np.column_stack([_val(rows.iloc[:, j]) for j in range(1, ksh.shape[1])]),
+    )
+
+
+def sheet_inputs(names, block):
+    """
+    Sizing inputs from PSV sheet rows.
+    Args:
+        names: Column-A range names of the sheet rows.
+        block (np.ndarray): (rows, tags) values of the tag columns.
+    Returns:
+        dict: {range name: column array}, "" for rows the sheet lacks.
+    """
+    row_of_name = {}
+    for row, name in enumerate(names):
+        if isinstance(name, str) and name.strip() in SIZING_INPUTS:
+            row_of_name.setdefault(name.strip(), row)
+    num_tags = block.shape[1]
+    inputs = {}
+    for name in SIZING_INPUTS:
+        row = row_of_name.get(name)
+        values = block[row] if row is not None and row < block.shape[0] else np.full(num_tags, "", dtype=object)
+        inputs[name] = _text(values) if name in SIZING_TEXT_INPUTS else _val(values)
+    return inputs
+
+
+def psv_sheet_inputs(calc_df):
+    """Sizing inputs of every tagged column of a PSV sheet block (read_psv_sheet)."""
+    block = calc_df.iloc[:, PSV_FIRST_TAG_COL:].to_numpy(dtype=object)
+    if calc_df.shape[0] > PSV_TAG_ROW:
+        tags = _text(block[PSV_TAG_ROW])
+        block = block[:, tags != ""]
+    return sheet_inputs(calc_df.iloc[:, 0].tolist(), block)
+
+
+# --- API RP 520 kernels (imperial units, as the macro's A* functions) ---
+def gas_coefficient(k):
+    """C from the ratio of specific heats (API 520 Figure 32), as the macro's c()."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        c = 520 * np.sqrt(k * (2 / (k + 1)) ** ((k + 1) / (k - 1)))
+    return np.where(k <= 1, 315.0, np.where(k < 2, c, 400.0))
+
+
+def critical_flow_area(W, P1, T, M, k, Z, Kd, Kb, Kc):
+    """API 520 eq. 3-2: W lb/hr, P1 psia, T degR -> in2."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return W / (gas_coefficient(k) * Kd * P1 * Kb * Kc) * np.sqrt(T * Z / M)
+
+
+def steam_kn(P1):
+    """Napier correction factor KN (P1 psia)."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        kn = (0.1906 * P1 - 1000) / (0.2292 * P1 - 1061)
+    return np.where((P1 > 1500) & (P1 <= 3200), kn, 1.0)
+
+
+def _bracket(table, values):
+    """Index i with table[i] <= value <= table[i + 1] (the lower one on a boundary), -1 outside."""
+    index = np.searchsorted(table, values, side="left") - 1
+    index = np.where(values == table[0], 0, index)
+    return np.where((values >= table[0]) & (values <= table[-1]), index, -1)
+
+
+def steam_ksh(P, T, tables):
+    """Superheat correction factor KSH: bilinear in the KSH table, 1 outside it (P psig, T degF)."""
+    pressures, temperatures, values = tables.ksh_pressures, tables.ksh_temperatures, tables.ksh_values
+    i, j = _bracket(pressures, P), _bracket(temperatures, T)
+    inside = (i >= 0) & (j >= 0)
+    i, j = np.clip(i, 0, len(pressures) - 2), np.clip(j, 0, len(temperatures) - 2)
+    p1, p2 = pressures[i], pressures[i + 1]
+    t1, t2 = temperatures[j], temperatures[j + 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ksh1 = (values[i + 1, j] - values[i, j]) / (p2 - p1) * (P - p1) + values[i, j]
+        ksh2 = (values[i + 1, j + 1] - values[i, j + 1]) / (p2 - p1) * (P - p1) + values[i, j + 1]
+        ksh = (ksh2 - ksh1) / (t2 - t1) * (T - t1) + ksh1
+    return np.where(inside, ksh, 1.0)
+
+
+def steam_area(W, P1, Kd, Kb, Kc, KN, KSH):
+    """API 520 eq. 3-8: W lb/hr, P1 psia -> in2."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return W / (51.5 * P1 * Kd * Kb * Kc * KN * KSH)
+
+
+def liquid_area(Q, P1, P2, G, Kd, Kw, Kc, Kv):
+    """API 520 eq. 3-9: Q gpm, P1/P2 psig -> in2."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return Q / (38 * Kd * Kw * Kc * Kv) * np.sqrt(G / (P1 - P2))
+
+
+def effective_area(area, tables):
+    """
+    Smallest orifice whose area, less 5 %, exceeds the required area (the macro's FindEffArea).
+    Returns:
+        tuple: (selected area, designation); 0 and "" where no orifice is large enough.
+    """
+    areas = tables.orifice_areas
+    index = np.searchsorted(areas * 0.95, area, side="right")
+    found = (index < len(areas)) & (area != 0)
+    index = np.minimum(index, len(areas) - 1)
+    selected = np.where(found, areas[index], 0.0)
+    designation = np.where(found, tables.orifice_designations[index], "").astype(object)
+    return selected, designation
+
+
+def liquid_viscosity_area(Q, P1, P2, G, mu, Kd, Kw, Kc, tables, max_iterations=100, tolerance=0.001):
+    """
+    Liquid area with the viscosity correction Kv solved by the macro's fixed-point iteration
+    (Reynolds number on the next larger standard orifice), for all tags at once.
+    Returns:
+        tuple: (area, Kv)
+    """
+    area = liquid_area(Q, P1, P2, G, Kd, Kw, Kc, 1.0)
+    kv = np.ones(len(area))
+    active = np.isfinite(area) & (area != 0)
+    for _ in range(max_iterations):
+        if not active.any():
+            break
+        with np.errstate(divide="ignore", invalid="ignore"):
+            reynolds = Q[active] * (2800 * G[active]) / (mu[active] * np.sqrt(effective_area(area[active], tables)[0]))
+            kv[active] = 1 / (0.9935 + 2.878 / reynolds ** 0.5 + 342.75 / reynolds ** 1.5)
+        new_area = liquid_area(Q[active], P1[active], P2[active], G[active], Kd, Kw[active], Kc[active], kv[active])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            converged = np.abs((new_area - area[active]) / area[active]) < tolerance
+        area[active] = new_area
+        active[np.flatnonzero(active)[converged | ~np.isfinite(new_area)]] = False
+    return area, kv
+
+
+# --- Back pressure correction curves (x = back pressure / set pressure in %) ---
+def kb_bellows_10(x):
+    """Kb for balanced bellows valves at 10 % overpressure."""
+    return np.where(
+        (x >= 0) & (x <= 30), 1.0,
+        np.where((x > 30) & (x <= 40), 1 + (0.865 - 1) / 10 * (x - 30),
+                 np.where((x > 40) & (x <= 50), 0.865 + (0.69 - 0.865) / 10 * (x - 40), 0.69)),
+    )
+
+
+def kb_bellows_16(x):
+    """Kb for balanced bellows valves at 16 % overpressure."""
+    return np.where(x <= 37.5, 1.0, 1 + (0.905 - 1) / 12.5 * (x - 37.5))
+
+
+def kw_bellows(x):
+    """Kw for balanced bellows valves in liquid service."""
+    return np.where(x <= 17.5, 1.0, 1 + (0.675 - 1) / 32.5 * (x - 17.5))
+
+
+def size_psvs(inputs, tables):
+    """
+    Required and selected orifice area of every tag.
+    Args:
+        inputs (dict): sheet_inputs() / psv_sheet_inputs() result.
+        tables (SizingTables): Orifice and KSH tables.
+    Returns:
+        pd.DataFrame: One row per tag with SIZING_RESULT_COLUMNS. Areas are in2 per valve;
+        required area and K factors are empty (None) where a tag cannot be sized.
+    """
+    state = pd.Series(inputs["State"]).str.upper().to_numpy(dtype=object)
+    psv_type = pd.Series(inputs["PSVType"]).str.upper().to_numpy(dtype=object)
+    mode = np.where(inputs["CalculationMode"] == "", "D", inputs["CalculationMode"])
+    num_psv = np.rint(inputs["NoPSV"])
+    num_psv = np.where(num_psv == 0, 1.0, num_psv)
+    W = inputs["W"] * 0.453592                          # lb/hr -> kg/hr
+    density = inputs["Density"] * 16.018463             # lb/ft3 -> kg/m3
+    set_pressure = inputs["Pset"] * 0.068947            # psig -> bar
+    overpressure = inputs["AllowOverPres"]
+    T = (inputs["T"] - 32) / 1.8                        # degF -> degC
+    max_bp = inputs["MaxBP"] * 0.068947
+
+    kc = np.where(pd.Series(inputs["WithRupDisk"]).str.upper().to_numpy(dtype=object) == "Y", 0.9, 1.0)
+    default_ratio = np.select([psv_type == "C", np.isin(psv_type, ["B", "P"])], [0.1, MABP_FOR_BELLOWS], inputs["RatioOfMaxBP"])
+    ratio = np.where((inputs["RatioOfMaxBP"] == 0) | (mode == "D"), default_ratio, inputs["RatioOfMaxBP"])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bp_percent = set_pressure * ratio / set_pressure * 100
+    bellows = psv_type == "B"
+    kb = np.where(bellows & (overpressure == 10), kb_bellows_10(bp_percent),
+                  np.where(bellows & (overpressure == 16), kb_bellows_16(bp_percent), 1.0))
+    kw = np.where(bellows, kw_bellows(bp_percent), 1.0)
+
+    # The macro passes bar values into functions that convert "kg/cm2" to psi (x 14.22).
+    relieving = set_pressure * PRES_RATIO * (1 + overpressure / 100)
+    P1_abs = (relieving + 1.033) * 14.22
+    W_lb = W / num_psv * 2.20462
+    T_abs = (T + 273.15) * 1.8
+
+    gas = state == "V"
+    steam = state == "S"
+    liquid = state == "L"
+    n = len(state)
+    area = np.zeros(n)
+    kn = np.full(n, np.nan)
+    ksh = np.full(n, np.nan)
+    kv = np.full(n, np.nan)
+
+    area[gas] = critical_flow_area(
+        W_lb[gas], P1_abs[gas], T_abs[gas], inputs["M"][gas], inputs["k"][gas], inputs["Z"][gas], KD_GAS, kb[gas], kc[gas],
+    )
+    kn[steam] = steam_kn(P1_abs[steam])
+    ksh[steam] = steam_ksh(P1_abs[steam], T_abs[steam] - 460, tables)
+    area[steam] = steam_area(W_lb[steam], P1_abs[steam], KD_STEAM, kb[steam], kc[steam], kn[steam], ksh[steam])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Q = W / density / num_psv * 4.4033
+    area[liquid], kv[liquid] = liquid_viscosity_area(
+        Q[liquid], relieving[liquid] * 14.22, max_bp[liquid] * 14.22, density[liquid] / 1000, inputs["mu"][liquid],
+        KD_LIQUID, kw[liquid], kc[liquid], tables,
+    )
+
+    # A failing VBA expression (division by zero, root of a negative) sizes nothing.
+    failed = ~np.isfinite(area)
+    area[failed] = 0.0
+    selected, designation = effective_area(area, tables)
+
+    def factor(values, applies):
+        return np.where(applies, np.where(failed, 0.0, values), np.nan)
+
+    sized = gas | steam | liquid
+    result = pd.DataFrame({
+        "Tag No.": inputs["TagNo"],
+        "State": inputs["State"],
+        "Orifice Area Required": np.where(area > 0, area, np.nan),
+        "Kd": factor(np.select([gas, steam, liquid], [KD_GAS, KD_STEAM, KD_LIQUID], np.nan), sized),
+        "Kb": factor(kb, gas | steam),
+        "Kc": factor(kc, sized),
+        "KN": factor(kn, steam),
+        "KSH": factor(ksh, steam),
+        "Kw": factor(kw, liquid),
+        "Kv": factor(kv, liquid),
+        "Kp": np.full(n, np.nan),
+        "Orifice Area Selected": np.where(selected > 0, selected, np.nan),
+        "Orifice": np.where(selected > 0, designation, None),
+    }, columns=list(SIZING_RESULT_COLUMNS))
+    return result.astype(object).where(result.notna(), None)
@@ -0,0 +1,21 @@
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Helpers shared by the SQLite-backed stores (jobs.py, record_store.py).
+
+
+@contextmanager
+def connect(db_path):
+    """Autocommit connection, closed on exit; use BEGIN IMMEDIATE for multi-statement updates."""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def isoformat(ts):
+    """ISO 8601 UTC text of a Unix timestamp, None for None."""
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat() if ts is not None else None
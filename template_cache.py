@@ -0,0 +1,190 @@
+import hashlib
+import io
+import os
+import threading
+from contextlib import contextmanager
+
+
+class TemplateFile:
+    """
+    A template file held in memory and re-read only when it changes.
+
+    The file is re-checked on every access by (mtime, size); only when that
+    changes is it re-hashed, and only when the SHA-256 differs is it reloaded
+    (and `generation` bumped). Subclasses decide how parsed instances are served.
+    Args:
+        path (str): Template file path.
+        loader (callable): Builds the parsed template from a binary file object.
+    """
+
+    def __init__(self, path, loader):
+        self.path = path
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._stat_key = None
+        self._raw_bytes = None
+        self.sha256 = None
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def _refresh(self):
+        """Reload the raw template bytes if the file changed. Must hold self._lock."""
+        st = os.stat(self.path)
+        stat_key = (st.st_mtime_ns, st.st_size)
+        if stat_key == self._stat_key:
+            return False
+
+        with open(self.path, "rb") as f:
+            raw_bytes = f.read()
+        sha256 = hashlib.sha256(raw_bytes).hexdigest()
+        self._stat_key = stat_key
+        if sha256 == self.sha256:
+            return False
+
+        if self.sha256 is not None:
+            self.reloads += 1
+        self._raw_bytes = raw_bytes
+        self.sha256 = sha256
+        self.generation += 1
+        self._on_reload()
+        return True
+
+    def _on_reload(self):
+        pass
+
+    def load_fresh(self):
+        """Parse a brand-new instance from the cached template bytes."""
+        return self._loader(io.BytesIO(self._raw_bytes))
+
+    def current_sha256(self):
+        """SHA-256 of the template file as it is on disk now (re-hashed only when it changed)."""
+        with self._lock:
+            self._refresh()
+            return self.sha256
+
+    def stats(self):
+        return {
+            "path": str(self.path),
+            "sha256": self.sha256,
+            "generation": self.generation,
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+        }
+
+
+class TemplateCache(TemplateFile):
+    """
+    Parse a template file once and hand out cheap isolated copies of it.
+    Args:
+        path (str): Template file path.
+        loader (callable): Builds the parsed template from a binary file object.
+        copier (callable): Returns an isolated copy of the parsed template.
+    """
+
+    def __init__(self, path, loader, copier):
+        super().__init__(path, loader)
+        self._copier = copier
+        self._parsed = None
+
+    def _on_reload(self):
+        self._parsed = None
+
+    def warm(self):
+        """Load and parse the template ahead of the first request."""
+        with self._lock:
+            self._refresh()
+            if self._parsed is None:
+                self._parsed = self.load_fresh()
+
+    def get(self):
+        """Return an isolated copy of the parsed template."""
+        with self._lock:
+            self._refresh()
+            if self._parsed is None:
+                self.misses += 1
+                self._parsed = self.load_fresh()
+            else:
+                self.hits += 1
+            parsed = self._parsed
+        return self._copier(parsed)
+
+
+class WorkbookTemplatePool(TemplateFile):
+    """
+    Pool of pre-loaded openpyxl workbooks for a macro-enabled template.
+
+    openpyxl workbooks cannot be deep-copied or pickled (the VBA archive holds a
+    lock), so instead of copying, each request checks out a workbook for exclusive
+    use and it is restored to its pristine state before going back to the pool.
+    Args:
+        path (str): Template file path.
+        loader (callable): Builds a workbook from a binary file object.
+        snapshot (callable): Captures the template state a conversion will modify.
+        restore (callable): Restores a workbook from its snapshot.
+        max_idle (int): Maximum number of idle workbooks kept warm.
+    """
+
+    def __init__(self, path, loader, snapshot, restore, max_idle=2):
+        super().__init__(path, loader)
+        self._snapshot = snapshot
+        self._restore = restore
+        self.max_idle = max_idle
+        self._idle = []
+
+    def _on_reload(self):
+        self._idle = []
+
+    def _load_entry(self):
+        wb = self.load_fresh()
+        return wb, self._snapshot(wb)
+
+    def warm(self):
+        with self._lock:
+            self._refresh()
+            generation = self.generation
+            if self._idle:
+                return
+        entry = self._load_entry()
+        with self._lock:
+            if generation == self.generation and len(self._idle) < self.max_idle:
+                self._idle.append(entry)
+
+    @contextmanager
+    def checkout(self):
+        """Borrow a workbook; it is reset and returned to the pool afterwards."""
+        with self._lock:
+            self._refresh()
+            generation = self.generation
+            entry = self._idle.pop() if self._idle else None
+            if entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is None:
+            entry = self._load_entry()
+
+        wb, snapshot = entry
+        try:
+            yield wb
+        finally:
+            try:
+                self._restore(wb, snapshot)
+                restored = True
+            except Exception as e:
+                print(f"WARNING: Could not restore pooled template workbook, discarding it: {e}")
+                restored = False
+            if restored:
+                with self._lock:
+                    if generation == self.generation and len(self._idle) < self.max_idle:
+                        self._idle.append(entry)
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats["idle"] = len(self._idle)
+        stats["max_idle"] = self.max_idle
+        return stats
@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# The templates are looked up relative to the working directory.
+os.chdir(ROOT)
+
+# main.py reads these at import: convert in threads, keep jobs and records out of the shared temp dirs.
+os.environ.setdefault("PSV_EXECUTOR", "thread")
+os.environ.setdefault("PSV_WORKERS", "1")
+os.environ.setdefault("PSV_RECORD_STORE", "off")
+os.environ.setdefault("PSV_JOBS_DIR", tempfile.mkdtemp(prefix="psv_test_jobs_"))
+os.environ.pop("PSV_RESULT_CACHE_DIR", None)
@@ -0,0 +1,122 @@
+import io
+import os
+import sys
+
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import main  # noqa: E402
+from generate_workbooks import generate  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def workbooks(tmp_path_factory):
+    data_path, calc_path = generate(10, tmp_path_factory.mktemp("workbooks"))
+    with open(data_path, "rb") as f, open(calc_path, "rb") as g:
+        return f.read(), g.read()
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as c:
+        yield c
+
+
+def _calc2data(client, calc_sheet, **headers):
+    return client.post("/calc2data/", files={"calc_sheet_file": ("calc.xlsm", io.BytesIO(calc_sheet))}, headers=headers)
+
+
+def test_if_none_match_star_converts(client, workbooks):
+    response = _calc2data(client, workbooks[1] + b"\0", **{"If-None-Match": "*"})
+    assert response.status_code == 200
+    assert response.content
+
+
+def test_if_none_match_cached_etag_is_not_modified(client, workbooks):
+    first = _calc2data(client, workbooks[1])
+    assert first.status_code == 200
+    second = _calc2data(client, workbooks[1], **{"If-None-Match": first.headers["ETag"]})
+    assert second.status_code == 304
+
+
+def test_if_none_match_uncached_etag_converts(client, workbooks, monkeypatch):
+    etag = _calc2data(client, workbooks[1]).headers["ETag"]
+    monkeypatch.setattr(main.RESULT_CACHE, "contains", lambda key: False)
+    response = _calc2data(client, workbooks[1], **{"If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_cache_hit_skips_inspection(client, workbooks, monkeypatch):
+    calc_sheet = workbooks[1] + b"\0\0"
+    assert _calc2data(client, calc_sheet).headers["X-Cache"] == "MISS"
+    inspected = []
+    monkeypatch.setattr(main, "inspect_workbook", lambda *args: inspected.append(args))
+    response = _calc2data(client, calc_sheet)
+    assert response.headers["X-Cache"] == "HIT"
+    assert inspected == []
+
+
+def _rejections(client, endpoint, reason):
+    prefix = f'psv_rejections_total{{endpoint="{endpoint}",reason="{reason}"}} '
+    for line in client.get("/metrics").text.splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return 0.0
+
+
+def test_update_over_cost_budget_is_rejected(client, workbooks, monkeypatch):
+    data_sheet, calc_sheet = workbooks
+    # Each workbook fits on its own; together they do not.
+    cost = main.inspect_workbook(io.BytesIO(data_sheet)).cells + main.inspect_workbook(io.BytesIO(calc_sheet)).cells
+    monkeypatch.setattr("guardrails.MAX_REQUEST_CELLS", cost - 1)
+    before = _rejections(client, "/data2calc/update", "cost")
+
+    response = client.post(
+        "/data2calc/update",
+        files={"calc_sheet_file": ("calc.xlsm", io.BytesIO(calc_sheet)), "data_sheet_file": ("data.xlsm", io.BytesIO(data_sheet))},
+    )
+
+    assert response.status_code == 413
+    assert "too large to convert" in response.json()["detail"]
+    assert _rejections(client, "/data2calc/update", "cost") == before + 1
+
+
+def test_header_layouts_debug_bypasses_executor(client, workbooks, monkeypatch):
+    _calc2data(client, workbooks[1] + b"\0\0\0")
+    before = main.CONVERSION_EXECUTOR.stats()["completed"]
+    monkeypatch.setattr(main.ADMISSION, "admit", None)
+    stats = client.get("/debug/header-layouts").json()
+    assert main.CONVERSION_EXECUTOR.stats()["completed"] == before
+    assert stats["hits"] + stats["misses"] >= 1
+    assert stats["layouts"]
+
+
+def test_records_calc2data_parquet_round_trip(client):
+    records = pd.DataFrame({
+        "Tag No.": ["PSV-1", "PSV-2"],
+        "Relief Case": ["Blocked Outlet", "External Fire"],
+        "State": ["V", "L"],
+        "Set Pressure": [150.0, 75.5],
+    })
+    body = io.BytesIO()
+    records.to_parquet(body, index=False)
+
+    response = client.post(
+        "/records/calc2data?output=parquet",
+        content=body.getvalue(),
+        headers={"Content-Type": "application/vnd.apache.parquet"},
+    )
+    assert response.status_code == 200, response.text
+    as_json = client.post("/records/calc2data", json=records.to_dict(orient="records"))
+    assert as_json.status_code == 200
+
+    result = pd.read_parquet(io.BytesIO(response.content))
+    expected = pd.DataFrame(as_json.json()["records"])
+    assert list(result.columns) == list(expected.columns)
+    assert result.astype(object).where(result.notna(), None).values.tolist() == (
+        expected.astype(object).where(expected.notna(), None).values.tolist()
+    )
+    assert result["Tag No."].tolist() == ["PSV-1", "PSV-2"]
@@ -0,0 +1,42 @@
+import io
+import zipfile
+
+import pytest
+
+import pipeline
+from batch import list_batch_items
+from guardrails import check_archive
+from uploads import UploadPayload, read_payload
+
+
+@pytest.fixture
+def opened_files(monkeypatch):
+    opened = []
+    original = UploadPayload.open
+
+    def tracking_open(self):
+        f = original(self)
+        opened.append(f)
+        return f
+
+    monkeypatch.setattr(UploadPayload, "open", tracking_open)
+    return opened
+
+
+def test_spilled_archive_files_are_closed(tmp_path, opened_files):
+    with open("Calculation Sheet.xlsm", "rb") as f:
+        workbook = f.read()
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        zf.writestr("calc.xlsm", workbook)
+    archive = read_payload("batch.zip", io.BytesIO(buffer.getvalue()), tmp_path, spill_threshold=0)
+    assert archive.path is not None
+
+    check_archive(archive)
+    (item,) = list_batch_items([archive])
+    member = item.load(tmp_path)
+    assert pipeline.detect_conversion(member) == "calc2data"
+
+    assert opened_files and all(f.closed for f in opened_files)
+    member.cleanup()
+    archive.cleanup()
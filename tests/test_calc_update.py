@@ -0,0 +1,94 @@
+import io
+import os
+import sys
+import zipfile
+
+import openpyxl
+import pytest
+
+from calc_update import UPDATED_ROWS
+from pipeline import run_data2calc_update
+from xlsx_reader import PSV_FIRST_TAG_COL, PSV_TAG_ROW, read_psv_sheet
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from generate_workbooks import calc_sheet_bytes, data_sheet_bytes, make_records  # noqa: E402
+
+# The bundled Data Sheet: 96 records (one per relief case) of 34 tags.
+BUNDLED_RECORDS = 96
+
+
+@pytest.fixture(scope="module")
+def filled_calc_sheet():
+    output_bytes, summary = run_data2calc_update("Calculation Sheet.xlsm", "Data Sheet.xlsm")
+    return output_bytes, summary
+
+
+def _tag_columns(workbook_bytes):
+    calc_df = read_psv_sheet(io.BytesIO(workbook_bytes))
+    return [tag for tag in calc_df.iloc[PSV_TAG_ROW, PSV_FIRST_TAG_COL:] if tag != ""]
+
+
+def test_fills_one_column_per_relief_case(filled_calc_sheet):
+    output_bytes, summary = filled_calc_sheet
+    assert summary["records"] == BUNDLED_RECORDS
+    assert len(summary["added"]) == BUNDLED_RECORDS
+    tags = _tag_columns(output_bytes)
+    assert len(tags) == BUNDLED_RECORDS
+    assert len(set(tags)) < BUNDLED_RECORDS
+    assert [a["occurrence"] for a in summary["added"] if a["tag"] == tags[0]] == list(range(1, tags.count(tags[0]) + 1))
+
+
+def test_rerun_with_the_same_data_sheet_changes_nothing(filled_calc_sheet):
+    _, summary = run_data2calc_update(io.BytesIO(filled_calc_sheet[0]), "Data Sheet.xlsm", render=False)
+    assert summary["records"] == BUNDLED_RECORDS
+    assert (summary["added"], summary["removed"], summary["changed"]) == ([], [], [])
+    assert summary["unchanged"] == BUNDLED_RECORDS
+    assert summary["cells_written"] == 0
+
+
+@pytest.fixture(scope="module")
+def revision():
+    """A filled Calculation Sheet and a revised Data Sheet: first record dropped, one flow rate changed, one tag new."""
+    records = make_records(10)
+    revised = [dict(r) for r in records[1:]]
+    revised[2]["flow_rate"] += 100
+    revised.append(dict(records[0], tag="PSV-09999"))
+    calc_sheet = calc_sheet_bytes(records)
+    output_bytes, summary = run_data2calc_update(io.BytesIO(calc_sheet), io.BytesIO(data_sheet_bytes(revised)))
+    return records, calc_sheet, output_bytes, summary
+
+
+def test_update_round_trip(revision):
+    records, _, output_bytes, summary = revision
+    assert summary["records"] == 11
+    assert [a["tag"] for a in summary["added"]] == ["PSV-09999"]
+    assert [r["tag"] for r in summary["removed"]] == [records[0]["tag"]]
+    (changed,) = summary["changed"]
+    assert (changed["tag"], changed["column"]) == (records[3]["tag"], PSV_FIRST_TAG_COL + 1 + 3)
+    assert changed["changes"] == [{"property": "Flow Rate", "row": 14, "old": records[3]["flow_rate"], "new": records[3]["flow_rate"] + 100}]
+    assert summary["unchanged"] == 8
+    # The changed cell, plus the Tag No. and every mapped row of the appended column.
+    assert summary["cells_written"] == 1 + 1 + len(UPDATED_ROWS)
+
+    ws = openpyxl.load_workbook(io.BytesIO(output_bytes), keep_vba=True)["PSV"]
+    tag_cols = [c for c in range(PSV_FIRST_TAG_COL + 1, ws.max_column + 1) if ws.cell(PSV_TAG_ROW + 1, c).value]
+    assert [ws.cell(PSV_TAG_ROW + 1, c).value for c in tag_cols] == [r["tag"] for r in records] + ["PSV-09999"]
+    assert ws.cell(14, changed["column"]).value == records[3]["flow_rate"] + 100
+    # The removed record's column is reported, not deleted, and left as it was.
+    assert ws.cell(14, PSV_FIRST_TAG_COL + 1).value == records[0]["flow_rate"]
+
+
+def test_update_keeps_every_other_part_byte_identical(revision):
+    _, calc_sheet, output_bytes, _ = revision
+    with zipfile.ZipFile(io.BytesIO(calc_sheet)) as before, zipfile.ZipFile(io.BytesIO(output_bytes)) as after:
+        assert after.namelist() == before.namelist()
+        assert "xl/vbaProject.bin" in after.namelist()
+        differing = [name for name in after.namelist() if after.read(name) != before.read(name)]
+    assert differing == ["xl/worksheets/sheet2.xml"]  # The PSV sheet
+
+
+def test_unchanged_rerun_writes_nothing():
+    records = make_records(10)
+    output_bytes, summary = run_data2calc_update(io.BytesIO(calc_sheet_bytes(records)), io.BytesIO(data_sheet_bytes(records)))
+    assert summary["cells_written"] == 0
+    assert summary["unchanged"] == 10
@@ -0,0 +1,19 @@
+import cli
+
+
+def test_unchanged_failed_input_still_fails_the_run(tmp_path, capsys):
+    input_dir, output_dir = tmp_path / "in", tmp_path / "out"
+    input_dir.mkdir()
+    (input_dir / "bad.xlsx").write_bytes(b"not a workbook")
+
+    assert cli.main([str(input_dir), str(output_dir), "--workers", "1"]) == 1
+    assert "1 failed" in capsys.readouterr().out
+
+    # Not retried, but still reported as failed.
+    assert cli.main([str(input_dir), str(output_dir), "--workers", "1"]) == 1
+    out = capsys.readouterr().out
+    assert "FAILED     bad.xlsx" in out
+    assert "0 converted, 0 unchanged, 1 failed (1 unchanged since failing)" in out
+
+    (input_dir / "bad.xlsx").unlink()
+    assert cli.main([str(input_dir), str(output_dir), "--workers", "1"]) == 0
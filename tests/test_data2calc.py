@@ -0,0 +1,84 @@
+import math
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data2calc
+from data2calc import CALC_SHEET_MAPPING, _RecordRows
+from xlsx_reader import read_form_sheet, read_psv_sheet
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from generate_workbooks import generate  # noqa: E402
+
+
+def _same(a, b):
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return type(a) is type(b) and a == b
+
+
+def _assert_matches_scalar(column_func, scalar_func, values):
+    values = np.array(values, dtype=object)
+    expected = [scalar_func(v) for v in values]
+    actual = column_func(values).tolist()
+    mismatches = [(v, e, a) for v, e, a in zip(values, expected, actual) if not _same(e, a)]
+    assert not mismatches
+
+
+BACK_PRESSURES = [
+    "1.5 / 2", "0/0", " 3 ", "1e2/ -4.5", ".5/+1.", "1/2/3", "nan", "nan / 1", np.nan, None, 7, 2.5,
+    "", "/", "1 /", "F.V./1", "2 barg / 1", "0x10", "1_000", "١٢", "inf", "Infinity / 2", "1 / -inf", True,
+]
+
+
+@pytest.mark.parametrize("column_func, scalar_func", [
+    (data2calc.get_sum_bp_column, data2calc.get_sum_bp),
+    (data2calc.get_left_bp_column, data2calc.get_left_bp),
+])
+def test_split_bp_column_matches_scalar(column_func, scalar_func):
+    _assert_matches_scalar(column_func, scalar_func, BACK_PRESSURES)
+    _assert_matches_scalar(column_func, scalar_func, [])
+
+
+def test_lookups_match_scalar():
+    values = ["VAPOR", "GAS", "STEAM", "LIQUID", "liquid", "C", "B", "P", "", " C", np.nan, None, 1, 0.1]
+    _assert_matches_scalar(data2calc.get_state_column, data2calc.get_state, values)
+    _assert_matches_scalar(data2calc.get_ratio_column, data2calc.get_ratio, values)
+    remarks = values + ["With Rupture Disk", "rupture disks", "rupture  disk", b"rupture disk"]
+    _assert_matches_scalar(data2calc.get_rupture_disk_column, data2calc.get_rupture_disk, remarks)
+
+
+def test_liquid_density_matches_scalar():
+    states = ["LIQUID", "LIQUID", "LIQUID", "LIQUID", "VAPOR", "STEAM", np.nan, "LIQUID"]
+    densities = [0.85, 1, np.nan, None, 0.85, 0.5, 0.9, "0.7"]
+    rows1 = np.full((len(states), 27), np.nan, dtype=object)
+    rows2 = np.full((len(states), 27), np.nan, dtype=object)
+    rows1[:, 9] = states
+    rows2[:, 22] = densities
+
+    actual = data2calc._liquid_density(_RecordRows(rows1), _RecordRows(rows2)).tolist()
+
+    # The per-record expression of the original row-by-row conversion.
+    expected = [
+        r2[22] * 1000 if data2calc.get_state(r1[9]) == "L" and pd.notnull(r2[22]) else ""
+        for r1, r2 in zip(rows1, rows2)
+    ]
+    assert all(_same(e, a) for e, a in zip(expected, actual)), (expected, actual)
+
+
+def test_generated_data_sheet_converts_to_generated_calc_sheet(tmp_path):
+    data_path, calc_path = generate(20, tmp_path)
+    calc_df = read_psv_sheet(calc_path)
+    expected = calc_df.iloc[:, 3:].to_numpy(dtype=object)
+
+    # The FORM header rows above row 9 pair up into records of their own; the tags come last.
+    block = data2calc.map_calc_sheet_block(read_form_sheet(data_path), calc_df.shape[0])[:, -expected.shape[1]:]
+
+    def blank(value):
+        return "" if value is None or (isinstance(value, float) and math.isnan(value)) else value
+
+    for row in CALC_SHEET_MAPPING:
+        assert [blank(v) for v in block[row]] == [blank(v) for v in expected[row]], row
@@ -0,0 +1,93 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from jobs import JobStore, job_view, new_owner_id
+from uploads import UploadPayload
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(tmp_path / "jobs")
+
+
+def _queue(store, name="calc.xlsm"):
+    return store.create("calc2data", UploadPayload(name, 3, "0" * 64, data=b"abc"))
+
+
+def _dead_owner():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    owner = new_owner_id().split(":")
+    return f"{owner[0]}:{process.pid}:deadbeef"
+
+
+def test_recover_leaves_jobs_of_live_owners_running(store):
+    job_id = _queue(store)
+    store.claim_next(new_owner_id())
+
+    assert store.recover() == 0
+    assert store.get(job_id)["status"] == "running"
+
+
+def test_recover_requeues_jobs_of_exited_owners(store):
+    job_id = _queue(store)
+    store.claim_next(_dead_owner())
+
+    assert store.recover() == 1
+    job = store.get(job_id)
+    assert job["status"] == "queued"
+    assert job["owner"] is None
+
+
+def test_recover_requeues_jobs_without_heartbeat(store):
+    job_id = _queue(store)
+    owner = "other-host:1234:abcdef01"
+    store.claim_next(owner)
+
+    assert store.recover(stale_after=60) == 0
+    store._update(job_id, heartbeat_at=time.time() - 120)
+    assert store.recover(stale_after=60) == 1
+    assert store.get(job_id)["status"] == "queued"
+
+
+def test_heartbeat_keeps_remote_owner_alive(store):
+    job_id = _queue(store)
+    owner = "other-host:1234:abcdef01"
+    store.claim_next(owner)
+    store._update(job_id, heartbeat_at=time.time() - 120)
+
+    store.heartbeat(owner)
+    assert store.recover(stale_after=60) == 0
+
+
+def test_release_requeues_only_own_jobs(store):
+    mine, theirs = _queue(store, "a.xlsm"), _queue(store, "b.xlsm")
+    me, sibling = new_owner_id(), new_owner_id()
+    assert store.claim_next(me)["id"] == mine
+    assert store.claim_next(sibling)["id"] == theirs
+
+    assert store.release(me) == 1
+    assert store.get(mine)["status"] == "queued"
+    assert store.get(theirs)["status"] == "running"
+
+
+def test_job_view_reports_record_count(store):
+    job_id = _queue(store)
+    store._update(job_id, records_total=12)
+    view = job_view(store.get(job_id))
+    assert view["records"] == 12
+    assert "progress" not in view
+
+
+def test_main_opens_the_job_store_on_first_use(tmp_path):
+    jobs_dir = tmp_path / "jobs"
+    script = (
+        "import os, main; assert not os.path.exists(os.environ['PSV_JOBS_DIR']);"
+        "assert main.get_job_runner().store is main.get_job_store();"
+        "assert os.path.exists(os.path.join(os.environ['PSV_JOBS_DIR'], 'jobs.sqlite3'))"
+    )
+    subprocess.run([sys.executable, "-c", script], check=True, env=dict(os.environ, PSV_JOBS_DIR=str(jobs_dir)))
@@ -0,0 +1,68 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pandas as pd
+
+from record_store import RecordStore
+
+
+def _records(tag):
+    return pd.DataFrame([{"Tag No.": tag, "Phase": "V"}])
+
+
+def test_save_analyzes_only_after_the_interval(tmp_path, monkeypatch):
+    store = RecordStore(tmp_path / "records.sqlite3", analyze_interval=3600)
+    opened_at = store.analyzed_at
+    store.save("calc2data", "a" * 64, "a.xlsm", _records("PSV-1"))
+    assert store.analyzed_at == opened_at
+
+    store.analyze_interval = 0
+    store.save("calc2data", "b" * 64, "b.xlsm", _records("PSV-2"))
+    assert store.analyzed_at > opened_at
+    assert store.query({"tag_no": "psv-2"})[0] == 1
+
+
+def test_pipeline_opens_the_store_on_first_use(tmp_path):
+    db_path = tmp_path / "records.sqlite3"
+    script = (
+        "import os, pipeline; assert not os.path.exists(os.environ['PSV_RECORD_STORE']);"
+        "assert pipeline.get_record_store() is pipeline.get_record_store();"
+        "assert os.path.exists(os.environ['PSV_RECORD_STORE'])"
+    )
+    subprocess.run([sys.executable, "-c", script], check=True, env=dict(os.environ, PSV_RECORD_STORE=str(db_path)))
+
+
+def _cases(tag, *relief_cases):
+    return pd.DataFrame([{"Tag No.": tag, "Relief Case": case} for case in relief_cases])
+
+
+def _latest_cases(store, tag):
+    total, records = store.query({"tag_no": tag}, latest=True)
+    assert total == len(records)
+    return sorted(r["record"]["Relief Case"] for r in records)
+
+
+def test_latest_keeps_every_relief_case_of_the_newest_workbook(tmp_path):
+    store = RecordStore(tmp_path / "records.sqlite3")
+    store.save("data2calc", "a" * 64, "rev A.xlsm", pd.concat([_cases("PSV-1", "Blocked Outlet", "External Fire"), _cases("PSV-2", "Fire")]))
+    store.save("data2calc", "b" * 64, "rev B.xlsm", _cases("PSV-2", "Blocked Outlet", "Power Failure"))
+
+    assert _latest_cases(store, "psv-1") == ["Blocked Outlet", "External Fire"]
+    assert _latest_cases(store, "PSV-2") == ["Blocked Outlet", "Power Failure"]
+    assert store.query({"tag_no": "PSV-2"})[0] == 3
+    assert store.stats()["tags"] == 2
+
+
+def test_older_store_is_migrated(tmp_path):
+    db_path = tmp_path / "records.sqlite3"
+    store = RecordStore(db_path)
+    store.save("data2calc", "a" * 64, "rev A.xlsm", _cases("PSV-1", "Blocked Outlet", "External Fire"))
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("DELETE FROM latest_workbooks")
+        conn.execute("CREATE TABLE latest_records (tag_no TEXT PRIMARY KEY COLLATE NOCASE, record_id INTEGER NOT NULL)")
+    conn.close()
+
+    store = RecordStore(db_path)
+    assert _latest_cases(store, "PSV-1") == ["Blocked Outlet", "External Fire"]
@@ -0,0 +1,24 @@
+from result_cache import ResultCache, etag_matches
+
+ETAG = '"abc123"'
+
+
+def test_etag_matches_explicit_tags_only():
+    assert etag_matches('"abc123"', ETAG)
+    assert etag_matches('W/"abc123"', ETAG)
+    assert etag_matches('"other", "abc123"', ETAG)
+    assert not etag_matches('"other"', ETAG)
+    assert not etag_matches(None, ETAG)
+
+
+def test_etag_star_is_not_a_match():
+    assert not etag_matches("*", ETAG)
+
+
+def test_contains_does_not_count_lookups(tmp_path):
+    cache = ResultCache(max_bytes=1024 * 1024, disk_dir=str(tmp_path))
+    assert not cache.contains("k")
+    cache.put("k", b"data")
+    assert cache.contains("k")
+    stats = cache.stats()
+    assert stats["memory_hits"] == stats["disk_hits"] == stats["misses"] == 0
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+import sizing
+
+# Check cases cached on the Formula sheet of the bundled Calculation Sheet (in2).
+FORMULA_GAS_AREA = 7.654837225554768
+FORMULA_STEAM_AREA = 2.6573875439224253
+FORMULA_LIQUID_AREA = 14.00369445266731
+
+
+@pytest.fixture(scope="module")
+def tables():
+    return sizing.load_sizing_tables("Calculation Sheet.xlsm")
+
+
+def test_formula_sheet_gas():
+    assert sizing.gas_coefficient(np.array([1.06]))[0] == pytest.approx(322.31752446551116)
+    area = sizing.critical_flow_area(64152.23737999999, 83.51406, 810.27, 102, np.array([1.06]), 1, 0.975, 1, 0.9)
+    assert area[0] == pytest.approx(FORMULA_GAS_AREA, rel=1e-9)
+
+
+def test_formula_sheet_steam():
+    assert sizing.steam_area(8966.18954, 67.340232, 0.975, 1, 1, 1, 0.997853) == pytest.approx(FORMULA_STEAM_AREA, rel=1e-9)
+
+
+def test_formula_sheet_liquid():
+    area = sizing.liquid_area(1959.1074294, 62.568000000000005, 17.064, 0.697, 0.65, 0.775, 0.9, 1.005)
+    assert area == pytest.approx(FORMULA_LIQUID_AREA, rel=1e-9)
+
+
+def test_size_psvs_gas_row_matches_formula_sheet(tables):
+    # The Formula sheet gas case in PSV sheet units. Relieving pressure in the macro's
+    # chain: psig x 0.068947 -> bar x 1.02 x 1.1 = 4.84, read as kg/cm2 and + 1.033 = 5.873 kg/cm2A.
+    values = {
+        "TagNo": "PSV-1", "NoPSV": 1, "PSVType": "C", "WithRupDisk": "Y", "CalculationMode": "D", "State": "V",
+        "W": 29099 / 0.453592, "M": 102, "Z": 1, "k": 1.06,
+        "Pset": 4.84 / (0.068947 * 1.02 * 1.1), "AllowOverPres": 10, "T": 177 * 1.8 + 32, "MaxBP": 0,
+    }
+    block = np.array([[value] for value in values.values()], dtype=object)
+
+    row = sizing.size_psvs(sizing.sheet_inputs(list(values), block), tables).iloc[0]
+
+    assert row["Orifice Area Required"] == pytest.approx(FORMULA_GAS_AREA, rel=1e-6)
+    assert (row["Kd"], row["Kb"], row["Kc"]) == (0.975, 1.0, 0.9)
+    assert row["KN"] is None and row["Kv"] is None
+    assert (row["Orifice Area Selected"], row["Orifice"]) == (11.05, "Q")
@@ -0,0 +1,44 @@
+import asyncio
+import hashlib
+import io
+
+import pytest
+
+from uploads import read_payload, receive_upload
+
+
+class _AsyncUpload:
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.stream = io.BytesIO(data)
+
+    async def read(self, size):
+        return self.stream.read(size)
+
+
+DATA = b"0123456789" * 1000
+
+
+@pytest.mark.parametrize("spill_threshold", [len(DATA), 100])
+def test_receive_and_read_agree(tmp_path, spill_threshold):
+    received = asyncio.run(receive_upload(_AsyncUpload("a.xlsm", DATA), tmp_path, spill_threshold))
+    read = read_payload("a.xlsm", io.BytesIO(DATA), tmp_path, spill_threshold)
+    for payload in (received, read):
+        assert payload.size == len(DATA)
+        assert payload.sha256 == hashlib.sha256(DATA).hexdigest()
+        assert payload.read_bytes() == DATA
+        assert (payload.path is not None) == (spill_threshold < len(DATA))
+        payload.cleanup()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_failed_read_removes_spill_file(tmp_path):
+    class Broken(io.BytesIO):
+        def read(self, size=-1):
+            if self.tell() >= 200:
+                raise OSError("broken stream")
+            return super().read(100)
+
+    with pytest.raises(OSError):
+        read_payload("a.xlsm", Broken(DATA), tmp_path, 100)
+    assert list(tmp_path.iterdir()) == []
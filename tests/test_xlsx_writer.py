@@ -0,0 +1,79 @@
+import io
+import os
+import sys
+import zipfile
+
+import openpyxl
+import pandas as pd
+import pytest
+
+from calc2data import (
+    CALC_SHEET_SHEET_NAME,
+    DATA_SHEET_SHEET_NAME,
+    convert_calc_to_data_sheet,
+    load_data_sheet_patch_template,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_SHEET_TEMPLATE = os.path.join(ROOT, "Data Sheet.xlsm")
+
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+from generate_workbooks import generate  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def outputs(tmp_path_factory):
+    """The same Calculation Sheet converted by the XML-patching writer and by openpyxl."""
+    _, calc_path = generate(40, tmp_path_factory.mktemp("workbooks"))
+    calc_sheet_raw_df = pd.read_excel(calc_path, sheet_name=CALC_SHEET_SHEET_NAME, header=None)
+    with open(DATA_SHEET_TEMPLATE, "rb") as f:
+        template_bytes = f.read()
+
+    patch_template = load_data_sheet_patch_template(io.BytesIO(template_bytes))
+    patched = convert_calc_to_data_sheet(calc_sheet_raw_df, None, output_stream=io.BytesIO(), patch_template=patch_template)
+    saved = convert_calc_to_data_sheet(calc_sheet_raw_df, DATA_SHEET_TEMPLATE, output_stream=io.BytesIO())
+    assert patched and saved
+    return template_bytes, patch_template, patched.getvalue(), saved.getvalue()
+
+
+def _form(workbook_bytes):
+    return openpyxl.load_workbook(io.BytesIO(workbook_bytes), keep_vba=True)[DATA_SHEET_SHEET_NAME]
+
+
+def _values(ws):
+    return {
+        (cell.row, cell.column): cell.value
+        for row in ws.iter_rows()
+        for cell in row
+        if cell.value is not None
+    }
+
+
+def test_form_values_match_openpyxl_writer(outputs):
+    template_bytes, _, patched, saved = outputs
+    patched_values = _values(_form(patched))
+    assert patched_values == _values(_form(saved))
+    assert patched_values != _values(_form(template_bytes))
+
+
+def test_merged_ranges_and_drawings_are_kept(outputs):
+    template_bytes, patch_template, patched, _ = outputs
+    template_ws = _form(template_bytes)
+    patched_ws = _form(patched)
+    assert template_ws.merged_cells.ranges
+    assert sorted(map(str, patched_ws.merged_cells.ranges)) == sorted(map(str, template_ws.merged_cells.ranges))
+
+    with zipfile.ZipFile(io.BytesIO(patched)) as zf:
+        sheet_xml = zf.read(patch_template.sheet_path).decode("utf-8")
+        assert "<drawing " in sheet_xml
+        assert "xl/drawings/drawing1.xml" in zf.namelist()
+        assert "xl/media/image1.png" in zf.namelist()
+
+
+def test_untouched_zip_members_are_byte_identical(outputs):
+    template_bytes, patch_template, patched, _ = outputs
+    with zipfile.ZipFile(io.BytesIO(template_bytes)) as template_zf, zipfile.ZipFile(io.BytesIO(patched)) as patched_zf:
+        assert patched_zf.testzip() is None
+        assert patched_zf.namelist() == template_zf.namelist()
+        changed = [name for name in template_zf.namelist() if patched_zf.read(name) != template_zf.read(name)]
+    assert changed == [patch_template.sheet_path]
@@ -0,0 +1,140 @@
+import hashlib
+import io
+import os
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+# Uploads up to this size stay in memory; larger ones are spilled to a unique temp file.
+UPLOAD_SPILL_THRESHOLD = int(os.environ.get("PSV_UPLOAD_SPILL_BYTES", str(32 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class UploadPayload:
+    """
+    A received upload, either held in memory or spilled to a private temp file.
+    The SHA-256 digest is computed while receiving so later stages can reuse it.
+    """
+    filename: str
+    size: int
+    sha256: str
+    data: Optional[bytes] = None
+    path: Optional[Path] = None
+
+    def open(self):
+        """Return a binary file object over the upload (no copy for in-memory payloads)."""
+        if self.data is not None:
+            # BytesIO shares the bytes buffer until it is written to.
+            return io.BytesIO(self.data)
+        return open(self.path, "rb")
+
+    def read_bytes(self):
+        if self.data is not None:
+            return self.data
+        return self.path.read_bytes()
+
+    def cleanup(self):
+        if self.path is not None and self.path.exists():
+            self.path.unlink()
+
+
+class _PayloadBuilder:
+    """
+    Accumulates the chunks of one payload: hashes them, keeps them in memory up to
+    `spill_threshold` bytes and writes them to a private temp file past that.
+    """
+
+    def __init__(self, filename, temp_dir, spill_threshold=None):
+        self.filename = filename
+        self.temp_dir = temp_dir
+        self.spill_threshold = UPLOAD_SPILL_THRESHOLD if spill_threshold is None else spill_threshold
+        self.hasher = hashlib.sha256()
+        self.chunks = []
+        self.spill_file = None
+        self.spill_path = None
+        self.size = 0
+
+    def writes_to_disk(self, chunk):
+        """Whether add(chunk) does file I/O (and so should run off the event loop)."""
+        return self.spill_file is not None or self.size + len(chunk) > self.spill_threshold
+
+    def add(self, chunk):
+        self.hasher.update(chunk)
+        self.size += len(chunk)
+
+        if self.spill_file is None and self.size > self.spill_threshold:
+            fd, name = tempfile.mkstemp(prefix="upload_", suffix=Path(self.filename or "").suffix, dir=self.temp_dir)
+            self.spill_path = Path(name)
+            self.spill_file = os.fdopen(fd, "wb")
+            self.spill_file.writelines(self.chunks)
+            self.chunks = None
+
+        if self.spill_file is not None:
+            self.spill_file.write(chunk)
+        else:
+            self.chunks.append(chunk)
+
+    def discard(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_path.unlink(missing_ok=True)
+
+    def finish(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            return UploadPayload(self.filename, self.size, self.hasher.hexdigest(), path=self.spill_path)
+        return UploadPayload(self.filename, self.size, self.hasher.hexdigest(), data=b"".join(self.chunks))
+
+
+async def receive_upload(upload_file, temp_dir, spill_threshold=None):
+    """
+    Read an UploadFile into an UploadPayload, hashing it as it streams in.
+    Args:
+        upload_file (UploadFile): The incoming upload.
+        temp_dir (Path): Directory for spilled uploads.
+        spill_threshold (int): Bytes kept in memory before spilling to disk.
+    Returns:
+        UploadPayload: The received upload.
+    """
+    builder = _PayloadBuilder(upload_file.filename, temp_dir, spill_threshold)
+    try:
+        while True:
+            chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if builder.writes_to_disk(chunk):
+                await run_in_threadpool(builder.add, chunk)
+            else:
+                builder.add(chunk)
+    except BaseException:
+        builder.discard()
+        raise
+    return builder.finish()
+
+
+def read_payload(filename, stream, temp_dir, spill_threshold=None):
+    """
+    Blocking counterpart of receive_upload for file objects (e.g. zip archive members).
+    Args:
+        filename (str): Name reported for the payload.
+        stream: Binary file object to read to the end.
+        temp_dir (Path): Directory for spilled payloads.
+        spill_threshold (int): Bytes kept in memory before spilling to disk.
+    Returns:
+        UploadPayload: The payload.
+    """
+    builder = _PayloadBuilder(filename, temp_dir, spill_threshold)
+    try:
+        while True:
+            chunk = stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            builder.add(chunk)
+    except BaseException:
+        builder.discard()
+        raise
+    return builder.finish()
@@ -0,0 +1,275 @@
+import posixpath
+import zipfile
+from xml.etree.ElementTree import iterparse, fromstring
+
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format, is_timedelta_format
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_excel, from_ISO8601
+
+# Lean single-sheet reader for .xlsx/.xlsm workbooks.
+# Only the target worksheet XML (plus shared strings and number formats) is read,
+# cells are streamed row by row and nothing outside the requested block is kept.
+# Values follow pd.read_excel(..., header=None) with the openpyxl engine exactly.
+
+MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+DOC_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+ROW_TAG = MAIN_NS + "row"
+CELL_TAG = MAIN_NS + "c"
+VALUE_TAG = MAIN_NS + "v"
+INLINE_STRING_TAG = MAIN_NS + "is"
+TEXT_TAG = MAIN_NS + "t"
+RUN_TAG = MAIN_NS + "r"
+
+FORM_SHEET_NAME = "FORM"
+FORM_MAX_COL = 27           # Data Sheet columns A..AA are all the converters use
+PSV_SHEET_NAME = "PSV"
+PSV_TAG_ROW = 1             # Row 2 of the Calculation Sheet holds the Tag Nos.
+PSV_FIRST_TAG_COL = 3       # ... from column D onwards
+
+
+class SheetNotFoundError(ValueError):
+    pass
+
+
+def _column_index(cell_ref):
+    """0-based column index from a cell reference such as 'AB12'."""
+    col = 0
+    for ch in cell_ref:
+        if "A" <= ch <= "Z":
+            col = col * 26 + (ord(ch) - 64)
+        else:
+            break
+    return col - 1
+
+
+def _rels_targets(zf, rels_path, base_dir):
+    """{relationship id: (type, zip path)} for a .rels part."""
+    try:
+        root = fromstring(zf.read(rels_path))
+    except KeyError:
+        return {}
+    targets = {}
+    for rel in root.iter(PKG_REL_NS + "Relationship"):
+        target = rel.get("Target", "")
+        if target.startswith("/"):
+            path = target.lstrip("/")
+        else:
+            path = posixpath.normpath(posixpath.join(base_dir, target))
+        targets[rel.get("Id")] = (rel.get("Type", ""), path)
+    return targets
+
+
+def _text_content(node):
+    """Plain text of a <si>/<is> node, like openpyxl's Text.content (phonetic runs excluded)."""
+    snippets = []
+    for child in node:
+        if child.tag == TEXT_TAG:
+            if child.text is not None:
+                snippets.append(child.text)
+        elif child.tag == RUN_TAG:
+            t = child.find(TEXT_TAG)
+            if t is not None and t.text is not None:
+                snippets.append(t.text)
+    return "".join(snippets)
+
+
+def _read_shared_strings(zf, path):
+    if path is None or path not in zf.namelist():
+        return []
+    strings = []
+    with zf.open(path) as f:
+        for _, node in iterparse(f):
+            if node.tag == MAIN_NS + "si":
+                strings.append(_text_content(node).replace("x005F_", ""))
+                node.clear()
+    return strings
+
+
+def _read_date_styles(zf, path):
+    """Style ids whose number format is a date / timedelta format."""
+    if path is None or path not in zf.namelist():
+        return set(), set()
+    root = fromstring(zf.read(path))
+    custom = {}
+    num_fmts = root.find(MAIN_NS + "numFmts")
+    if num_fmts is not None:
+        for fmt in num_fmts.iter(MAIN_NS + "numFmt"):
+            custom[int(fmt.get("numFmtId"))] = fmt.get("formatCode")
+
+    date_styles, timedelta_styles = set(), set()
+    cell_xfs = root.find(MAIN_NS + "cellXfs")
+    if cell_xfs is not None:
+        for idx, xf in enumerate(cell_xfs.iter(MAIN_NS + "xf")):
+            num_fmt_id = int(xf.get("numFmtId", 0))
+            fmt = custom.get(num_fmt_id, BUILTIN_FORMATS.get(num_fmt_id))
+            if fmt is None:
+                continue
+            if is_date_format(fmt):
+                date_styles.add(idx)
+            if is_timedelta_format(fmt):
+                timedelta_styles.add(idx)
+    return date_styles, timedelta_styles
+
+
+def find_sheet_path(zf, sheet_name, workbook=None, rels=None):
+    """Zip path of the worksheet named sheet_name (e.g. 'xl/worksheets/sheet1.xml')."""
+    if workbook is None:
+        workbook = fromstring(zf.read("xl/workbook.xml"))
+    if rels is None:
+        rels = _rels_targets(zf, "xl/_rels/workbook.xml.rels", "xl")
+    for sheet in workbook.iter(MAIN_NS + "sheet"):
+        if sheet.get("name") == sheet_name:
+            sheet_path = rels.get(sheet.get(DOC_REL_NS + "id"), (None, None))[1]
+            if sheet_path is not None:
+                return sheet_path
+            break
+    raise SheetNotFoundError(f"Worksheet named '{sheet_name}' not found")
+
+
+class _WorkbookParts:
+    """Locations and lookup tables needed to decode one worksheet."""
+
+    def __init__(self, zf, sheet_name):
+        workbook = fromstring(zf.read("xl/workbook.xml"))
+        rels = _rels_targets(zf, "xl/_rels/workbook.xml.rels", "xl")
+        self.sheet_path = find_sheet_path(zf, sheet_name, workbook, rels)
+
+        workbook_pr = workbook.find(MAIN_NS + "workbookPr")
+        date1904 = workbook_pr is not None and workbook_pr.get("date1904") in ("1", "true")
+        self.epoch = CALENDAR_MAC_1904 if date1904 else CALENDAR_WINDOWS_1900
+
+        by_type = {rel_type.rsplit("/", 1)[-1]: path for rel_type, path in rels.values()}
+        self.shared_strings = _read_shared_strings(zf, by_type.get("sharedStrings"))
+        self.date_styles, self.timedelta_styles = _read_date_styles(zf, by_type.get("styles"))
+
+
+def _convert_cell(cell, parts):
+    """Decode one <c> element to the value pd.read_excel would produce ("" for empty)."""
+    data_type = cell.get("t", "n")
+    if data_type == "inlineStr":
+        node = cell.find(INLINE_STRING_TAG)
+        return "" if node is None else _text_content(node)
+
+    value = cell.findtext(VALUE_TAG) or None
+    if value is None:
+        return ""
+    if data_type == "n":
+        number = float(value) if ("." in value or "E" in value or "e" in value) else int(value)
+        style_id = int(cell.get("s", 0))
+        if style_id in parts.date_styles:
+            try:
+                return from_excel(number, parts.epoch, timedelta=style_id in parts.timedelta_styles)
+            except (OverflowError, ValueError):
+                return np.nan
+        as_int = int(number)
+        return as_int if as_int == number else float(number)
+    if data_type == "s":
+        return parts.shared_strings[int(value)]
+    if data_type == "b":
+        return bool(int(value))
+    if data_type == "str":
+        return value
+    if data_type == "d":
+        return from_ISO8601(value)
+    if data_type == "e":
+        return np.nan
+    return value
+
+
+def read_sheet_rows(source, sheet_name, max_col=None, column_limit_row=None, column_limit_start=0):
+    """
+    Stream one worksheet into row lists shaped like pandas' openpyxl reader output.
+    Args:
+        source: Path or binary file object of an .xlsx/.xlsm workbook.
+        sheet_name (str): Worksheet to read.
+        max_col (int): Keep only the first max_col columns.
+        column_limit_row (int): If given, once this 0-based row is read, drop every
+            column after its last non-empty cell (at or after column_limit_start).
+    Returns:
+        list: Rows of equal width, "" for empty cells, trailing empty rows/columns trimmed.
+    """
+    with zipfile.ZipFile(source) as zf:
+        parts = _WorkbookParts(zf, sheet_name)
+        data = []
+        with zf.open(parts.sheet_path) as sheet_xml:
+            for _, node in iterparse(sheet_xml):
+                if node.tag != ROW_TAG:
+                    continue
+                row_ref = node.get("r")
+                row_idx = int(row_ref) - 1 if row_ref else len(data)
+                while len(data) < row_idx:
+                    data.append([])
+
+                values = {}
+                col_idx = -1
+                for cell in node.iter(CELL_TAG):
+                    cell_ref = cell.get("r")
+                    col_idx = _column_index(cell_ref) if cell_ref else col_idx + 1
+                    if max_col is not None and col_idx >= max_col:
+                        continue
+                    value = _convert_cell(cell, parts)
+                    if not (isinstance(value, str) and value == ""):
+                        values[col_idx] = value
+                node.clear()
+
+                converted_row = []
+                if values:
+                    converted_row = [""] * (max(values) + 1)
+                    for col_idx, value in values.items():
+                        converted_row[col_idx] = value
+                data.append(converted_row)
+
+                if column_limit_row is not None and row_idx == column_limit_row:
+                    last_used = max((c for c in values if c >= column_limit_start), default=column_limit_start - 1)
+                    max_col = last_used + 1 if max_col is None else min(max_col, last_used + 1)
+                    data = [row[:max_col] for row in data]
+
+    # Same trimming/padding as pandas' openpyxl reader.
+    for row in data:
+        while row and row[-1] == "":
+            row.pop()
+    while data and not data[-1]:
+        data.pop()
+    if data:
+        max_width = max(len(row) for row in data)
+        for row in data:
+            if len(row) < max_width:
+                row.extend([""] * (max_width - len(row)))
+    return data
+
+
+def rows_to_frame(data):
+    """Build the DataFrame pd.read_excel(header=None) builds from the same rows."""
+    if not data:
+        return pd.DataFrame()
+    return TextParser(data, header=None, skip_blank_lines=False).read()
+
+
+def read_sheet(source, sheet_name, **kwargs):
+    """Lean equivalent of pd.read_excel(source, sheet_name=sheet_name, header=None)."""
+    return rows_to_frame(read_sheet_rows(source, sheet_name, **kwargs))
+
+
+def read_form_sheet(source):
+    """
+    Read the Data Sheet 'FORM' block: columns A..AA, up to the last record pair
+    (row pairs from the top of the sheet, as convert_data_to_calc_sheet pairs them)
+    whose Tag No. cell is filled.
+    """
+    data = read_sheet_rows(source, FORM_SHEET_NAME, max_col=FORM_MAX_COL)
+    last_pair = -1
+    for row_idx in range(0, len(data), 2):
+        if data[row_idx] and data[row_idx][0] != "":
+            last_pair = row_idx // 2
+    return rows_to_frame(data[: min(len(data), 2 * (last_pair + 1))])
+
+
+def read_psv_sheet(source):
+    """Read the Calculation Sheet 'PSV' block: column B labels plus the tag columns."""
+    return read_sheet(
+        source, PSV_SHEET_NAME, column_limit_row=PSV_TAG_ROW, column_limit_start=PSV_FIRST_TAG_COL
+    )
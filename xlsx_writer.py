@@ -0,0 +1,379 @@
+import bisect
+import io
+import math
+import re
+import struct
+import zipfile
+import zlib
+from datetime import date, datetime, time, timedelta
+from numbers import Integral, Number
+from xml.sax.saxutils import escape
+
+import numpy as np
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.datetime import to_excel
+
+from xlsx_reader import _column_index, find_sheet_path
+
+# Fast writer that fills one worksheet of an existing .xlsx/.xlsm template.
+# Untouched zip members (vbaProject.bin, styles, drawings, other sheets ...) are
+# copied as their original compressed bytes and only the target sheet XML is rebuilt.
+# The sheet's rows are cut into blocks that are cleared and deflated once per
+# template; a request renders and compresses only the blocks holding rows it
+# writes, and the remaining pre-compressed blocks are spliced around them (each
+# block is a full-flushed, self-contained deflate segment, so concatenation stays valid).
+
+CALC_CHAIN_PATH = "xl/calcChain.xml"
+BLOCK_ROWS = 32
+COMPRESS_LEVEL = 6
+
+_SHEET_DATA_PATTERN = re.compile(r"<sheetData\s*/>|<sheetData\b[^>]*>")
+_ROW_PATTERN = re.compile(r"<row\b[^>]*?(?:/>|>.*?</row>)", re.S)
+_ROW_OPEN_PATTERN = re.compile(r"<row\b[^>]*?(/?)>")
+_CELL_PATTERN = re.compile(r"<c\b[^>]*?(?:/>|>.*?</c>)", re.S)
+_ATTR_PATTERN = re.compile(r'([\w:]+)="([^"]*)"')
+_SPANS_PATTERN = re.compile(r'\sspans="[^"]*"')
+_MERGE_PATTERN = re.compile(r'<mergeCell\b[^>]*?\bref="([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?"')
+_ILLEGAL_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_CALC_CHAIN_OVERRIDE = re.compile(r'<Override\b[^>]*PartName="/xl/calcChain\.xml"[^>]*/>')
+_CALC_CHAIN_RELATIONSHIP = re.compile(r'<Relationship\b[^>]*Target="(?:/xl/)?calcChain\.xml"[^>]*/>')
+
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_END_RECORD = struct.Struct("<IHHHHIIH")
+_FINAL_EMPTY_BLOCK = b"\x03\x00"  # final, empty fixed-Huffman deflate block
+
+
+class UnsupportedTemplateError(ValueError):
+    """The template has a shape the patching writer does not handle."""
+
+
+def _deflate_segment(data, level):
+    """Raw deflate of data, full-flushed so it can be followed by any other segment."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FULL_FLUSH)
+
+
+def _dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+class _ZipEntry:
+    """One zip member as stored bytes: either copied verbatim or freshly compressed."""
+
+    __slots__ = ("name", "method", "crc", "file_size", "raw", "date_time")
+
+    def __init__(self, name, method, crc, file_size, raw, date_time):
+        self.name = name
+        self.method = method
+        self.crc = crc
+        self.file_size = file_size
+        self.raw = raw
+        self.date_time = date_time
+
+    @classmethod
+    def copied(cls, template_bytes, info):
+        """Reuse a member's compressed bytes straight from the template archive."""
+        if info.flag_bits & 0x1:
+            raise UnsupportedTemplateError(f"Encrypted zip member '{info.filename}'")
+        offset = info.header_offset
+        if template_bytes[offset:offset + 4] != b"PK\x03\x04":
+            raise UnsupportedTemplateError(f"Bad local header for zip member '{info.filename}'")
+        name_len, extra_len = struct.unpack_from("<HH", template_bytes, offset + 26)
+        start = offset + 30 + name_len + extra_len
+        raw = template_bytes[start:start + info.compress_size]
+        return cls(info.filename, info.compress_type, info.CRC, info.file_size, raw, info.date_time)
+
+    @classmethod
+    def deflated(cls, name, data, date_time, level):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        raw = compressor.compress(data) + compressor.flush()
+        return cls(name, zipfile.ZIP_DEFLATED, zlib.crc32(data), len(data), raw, date_time)
+
+
+def _write_zip(entries):
+    """Serialize _ZipEntry objects into a zip archive (no zip64; members < 4 GiB)."""
+    chunks = []
+    central = []
+    offset = 0
+    for entry in entries:
+        name = entry.name.encode("utf-8")
+        flags = 0 if entry.name.isascii() else 0x800
+        dos_time, dos_date = _dos_date_time(entry.date_time)
+        header = _LOCAL_HEADER.pack(
+            0x04034B50, 20, flags, entry.method, dos_time, dos_date,
+            entry.crc, len(entry.raw), entry.file_size, len(name), 0,
+        )
+        central.append(_CENTRAL_HEADER.pack(
+            0x02014B50, 20, 20, flags, entry.method, dos_time, dos_date,
+            entry.crc, len(entry.raw), entry.file_size, len(name), 0, 0, 0, 0, 0, offset,
+        ) + name)
+        chunks += (header, name, entry.raw)
+        offset += len(header) + len(name) + len(entry.raw)
+
+    central_directory = b"".join(central)
+    end = _END_RECORD.pack(0x06054B50, 0, 0, len(entries), len(entries), len(central_directory), offset, 0)
+    return b"".join(chunks) + central_directory + end
+
+
+def _attributes(tag):
+    return dict(_ATTR_PATTERN.findall(tag))
+
+
+def _cell_xml(ref, style, value):
+    """<c> element for one written value (strings are written inline, no shared strings)."""
+    style_attr = f' s="{style}"' if style is not None else ""
+    if isinstance(value, (datetime, date, time, timedelta)):
+        value = to_excel(value) if value == value else None  # NaT compares unequal to itself
+    if isinstance(value, (bool, np.bool_)):
+        return f'<c r="{ref}"{style_attr} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, Number):
+        if isinstance(value, Integral):
+            return f'<c r="{ref}"{style_attr}><v>{int(value)}</v></c>'
+        value = float(value)
+        if math.isfinite(value):
+            return f'<c r="{ref}"{style_attr}><v>{value!r}</v></c>'
+        value = None
+    if value is None or value == "":
+        return f'<c r="{ref}"{style_attr}/>'
+
+    text = _ILLEGAL_XML_CHARS.sub("", str(value))
+    space = ' xml:space="preserve"' if text != text.strip() else ""
+    return f'<c r="{ref}"{style_attr} t="inlineStr"><is><t{space}>{escape(text)}</t></is></c>'
+
+
+class _Block:
+    """A run of sheet XML and its deflate segment, compressed when first needed."""
+
+    __slots__ = ("raw", "level", "_compressed")
+
+    def __init__(self, text, level):
+        self.raw = text.encode("utf-8")
+        self.level = level
+        self._compressed = None
+
+    @property
+    def compressed(self):
+        # Concurrent renders may both compress a block; the results are identical.
+        if self._compressed is None:
+            self._compressed = _deflate_segment(self.raw, self.level)
+        return self._compressed
+
+
+class SheetPatchTemplate:
+    """
+    A workbook template compiled for repeated filling of one worksheet.
+
+    Everything is derived once from the template bytes and never modified, so a
+    single instance can be shared by any number of concurrent renders.
+    Args:
+        template_bytes (bytes): The .xlsx/.xlsm template.
+        sheet_name (str): Worksheet to fill.
+        first_row (int): First 1-based row that may be written; rows above it are kept verbatim.
+        clear_cell (callable): clear_cell(row, col) -> True for template cells whose
+            value (or formula) is removed before filling. Cells covered by a merged
+            range are always cleared in rows >= first_row.
+        block_rows (int): Rows per pre-compressed block.
+        compresslevel (int): zlib level for the rebuilt parts.
+        precompress (bool): Deflate every block now. Templates rendered only once
+            pass False, so blocks that get rewritten are never compressed twice.
+    """
+
+    def __init__(self, template_bytes, sheet_name, first_row=1, clear_cell=None, block_rows=BLOCK_ROWS, compresslevel=COMPRESS_LEVEL, precompress=True):
+        self.first_row = first_row
+        self.compresslevel = compresslevel
+        self._clear_cell = clear_cell
+
+        with zipfile.ZipFile(io.BytesIO(template_bytes)) as zf:
+            self.sheet_path = find_sheet_path(zf, sheet_name)
+            sheet_xml = zf.read(self.sheet_path).decode("utf-8")
+            self._entries = self._compile_entries(zf, template_bytes)
+
+        head, body, tail = self._split_sheet_data(sheet_xml)
+        self._covered = self._covered_cells(tail)
+
+        head_rows = []
+        self._row_numbers = []
+        self._row_open = []
+        self._row_cells = []
+        self._row_text = []
+        for row_xml in self._iter_rows(body):
+            row_number, open_tag, cells = self._parse_row(row_xml)
+            if self._row_numbers and row_number <= self._row_numbers[-1] or head_rows and row_number <= head_rows[-1][0]:
+                raise UnsupportedTemplateError("Worksheet rows are not in ascending order")
+            if row_number < first_row:
+                head_rows.append((row_number, row_xml))
+                continue
+            cells = {col: self._clear(row_number, col, cell) for col, cell in cells.items()}
+            self._row_numbers.append(row_number)
+            self._row_open.append(open_tag)
+            self._row_cells.append(cells)
+            self._row_text.append(open_tag + "".join(cell for _, cell in cells.values()) + "</row>")
+
+        self._head = _Block(head + "".join(xml for _, xml in head_rows), compresslevel)
+        self._tail = _Block(tail, compresslevel)
+        self._block_rows = block_rows
+        self._blocks = [
+            _Block("".join(self._row_text[i:i + block_rows]), compresslevel)
+            for i in range(0, len(self._row_text), block_rows)
+        ]
+        self._block_first_rows = self._row_numbers[::block_rows]
+        if precompress:
+            for block in [self._head, self._tail, *self._blocks]:
+                block.compressed
+        self._row_position = {row: i for i, row in enumerate(self._row_numbers)}
+
+    def _compile_entries(self, zf, template_bytes):
+        """Zip entries of the output, with None standing for the rebuilt sheet."""
+        names = set(zf.namelist())
+        drop_calc_chain = CALC_CHAIN_PATH in names
+        entries = []
+        for info in zf.infolist():
+            if info.filename == self.sheet_path:
+                self._sheet_date_time = info.date_time
+                entries.append(None)
+            elif info.filename == CALC_CHAIN_PATH:
+                # Cleared formula cells would leave stale calc chain entries; Excel rebuilds it.
+                continue
+            elif drop_calc_chain and info.filename == "[Content_Types].xml":
+                xml = _CALC_CHAIN_OVERRIDE.sub("", zf.read(info).decode("utf-8"))
+                entries.append(_ZipEntry.deflated(info.filename, xml.encode("utf-8"), info.date_time, self.compresslevel))
+            elif drop_calc_chain and info.filename == "xl/_rels/workbook.xml.rels":
+                xml = _CALC_CHAIN_RELATIONSHIP.sub("", zf.read(info).decode("utf-8"))
+                entries.append(_ZipEntry.deflated(info.filename, xml.encode("utf-8"), info.date_time, self.compresslevel))
+            else:
+                entries.append(_ZipEntry.copied(template_bytes, info))
+        return entries
+
+    @staticmethod
+    def _split_sheet_data(sheet_xml):
+        """(text up to <sheetData>, row elements, text from </sheetData>)."""
+        match = _SHEET_DATA_PATTERN.search(sheet_xml)
+        if match is None:
+            raise UnsupportedTemplateError("Worksheet has no <sheetData> element (namespace prefixes are not supported)")
+        if match.group().endswith("/>"):
+            return sheet_xml[:match.start()] + "<sheetData>", "", "</sheetData>" + sheet_xml[match.end():]
+        close = sheet_xml.index("</sheetData>", match.end())
+        return sheet_xml[:match.end()], sheet_xml[match.end():close], sheet_xml[close:]
+
+    @staticmethod
+    def _iter_rows(body):
+        position = 0
+        for match in _ROW_PATTERN.finditer(body):
+            if body[position:match.start()].strip():
+                raise UnsupportedTemplateError("Unexpected content between worksheet rows")
+            position = match.end()
+            yield match.group()
+        if body[position:].strip():
+            raise UnsupportedTemplateError("Unexpected content after the last worksheet row")
+
+    @staticmethod
+    def _parse_row(row_xml):
+        """(row number, opening tag, {col: (style, cell xml)})."""
+        open_match = _ROW_OPEN_PATTERN.match(row_xml)
+        attrs = _attributes(open_match.group())
+        if "r" not in attrs:
+            raise UnsupportedTemplateError("Worksheet row without an 'r' attribute")
+        if open_match.group(1):
+            return int(attrs["r"]), open_match.group()[:-2].rstrip() + ">", {}
+
+        inner = row_xml[open_match.end():-len("</row>")]
+        cells = {}
+        for cell_xml in _CELL_PATTERN.findall(inner):
+            cell_attrs = _attributes(cell_xml[:cell_xml.index(">") + 1])
+            if "r" not in cell_attrs:
+                raise UnsupportedTemplateError("Worksheet cell without an 'r' attribute")
+            cells[_column_index(cell_attrs["r"]) + 1] = (cell_attrs.get("s"), cell_xml)
+        return int(attrs["r"]), open_match.group(), cells
+
+    @staticmethod
+    def _covered_cells(tail):
+        """Cells hidden under a merged range (every cell of the range but its top-left anchor)."""
+        covered = set()
+        for first_col, first_row, last_col, last_row in _MERGE_PATTERN.findall(tail):
+            if not last_col:
+                continue
+            min_col, max_col = _column_index(first_col) + 1, _column_index(last_col) + 1
+            min_row, max_row = int(first_row), int(last_row)
+            for row in range(min_row, max_row + 1):
+                for col in range(min_col, max_col + 1):
+                    covered.add((row, col))
+            covered.discard((min_row, min_col))
+        return covered
+
+    def _clear(self, row, col, cell):
+        style, cell_xml = cell
+        if (row, col) not in self._covered and (self._clear_cell is None or not self._clear_cell(row, col)):
+            return cell
+        if cell_xml.endswith("/>") and ' t="' not in cell_xml:
+            return cell
+        return style, _cell_xml(get_column_letter(col) + str(row), style, None)
+
+    def _render_row(self, row, values):
+        position = self._row_position.get(row)
+        if position is None:
+            open_tag, cells = f'<row r="{row}">', {}
+        else:
+            open_tag, cells = _SPANS_PATTERN.sub("", self._row_open[position]), dict(self._row_cells[position])
+        for col, value in values.items():
+            style = cells[col][0] if col in cells else None
+            cells[col] = (style, _cell_xml(get_column_letter(col) + str(row), style, value))
+        return open_tag + "".join(cells[col][1] for col in sorted(cells)) + "</row>"
+
+    def render(self, cell_values):
+        """
+        Build the filled workbook.
+        Args:
+            cell_values (dict): {(row, col): value}, 1-based, rows >= first_row.
+                Cells covered by a merged range are skipped.
+        Returns:
+            bytes: The complete .xlsx/.xlsm archive.
+        """
+        values_by_row = {}
+        for (row, col), value in cell_values.items():
+            if row < self.first_row:
+                raise ValueError(f"Row {row} is above the writable area (first row {self.first_row})")
+            if (row, col) not in self._covered:
+                values_by_row.setdefault(row, {})[col] = value
+
+        # Only blocks holding a written row are rendered and compressed again; the
+        # others are reused as they are. Rows the template lacks go to the block
+        # whose row range they fall in (rows after the last block to the last one).
+        rows_by_block = {}
+        for row in values_by_row:
+            block = max(bisect.bisect_right(self._block_first_rows, row) - 1, 0)
+            rows_by_block.setdefault(block, []).append(row)
+
+        segments = [self._head]
+        for block_index, block in enumerate(self._blocks or [None]):
+            if block_index not in rows_by_block:
+                segments.append(block)
+                continue
+            start = block_index * self._block_rows
+            rows = sorted(set(self._row_numbers[start:start + self._block_rows]).union(rows_by_block[block_index]))
+            text = "".join(
+                self._render_row(row, values_by_row[row]) if row in values_by_row else self._row_text[self._row_position[row]]
+                for row in rows
+            )
+            segments.append(_Block(text, self.compresslevel))
+        segments.append(self._tail)
+        segments = [segment for segment in segments if segment is not None]
+
+        crc = 0
+        for segment in segments:
+            crc = zlib.crc32(segment.raw, crc)
+        compressed = b"".join([segment.compressed for segment in segments] + [_FINAL_EMPTY_BLOCK])
+        sheet_entry = _ZipEntry(
+            self.sheet_path, zipfile.ZIP_DEFLATED, crc, sum(len(segment.raw) for segment in segments), compressed, self._sheet_date_time
+        )
+        return _write_zip([sheet_entry if entry is None else entry for entry in self._entries])
+
+    def stats(self):
+        return {
+            "sheet_path": self.sheet_path,
+            "rows": len(self._row_numbers),
+            "blocks": len(self._blocks),
+            "merged_covered_cells": len(self._covered),
+            "precompressed_bytes": sum(len(b.compressed) for b in self._blocks) + len(self._head.compressed) + len(self._tail.compressed),
+        }